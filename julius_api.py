@@ -1,16 +1,43 @@
 # julius_api.py
 
-from typing import List, Dict, Optional, Any, Literal, BinaryIO
+from typing import List, Dict, Optional, Any, Literal, BinaryIO, Iterator, AsyncIterator, Union, Callable, TYPE_CHECKING
 import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
 import json
-from dataclasses import dataclass
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 import os
+import re
+import csv
+import io
+import gzip
+import zipfile
+from xml.etree import ElementTree
 import mimetypes
 import time
-from PIL import Image
+import hashlib
+import base64
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 from io import BytesIO
 import sys
+import asyncio
+import shutil
+import tempfile
+import contextvars
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from abc import ABC, abstractmethod
+from collections import deque
+from bisect import bisect_left
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor  # Imported lazily at runtime; it loads multiprocessing
 
 # Actual model names from Julius
 ModelType = Literal["default", "GPT-4o", "gpt-4o-mini", "o1-mini", "claude-3-5-sonnet", "o1", "gemini", "cohere"]
@@ -41,20 +68,3946 @@ class JuliusResponse:
     choices: List[Choice]
     created: int
     model: str
+    timings: Dict[str, float] = field(default_factory=dict)  # Seconds per phase of the call that produced it
+    code_blocks: List = field(default_factory=list)  # (code location, code, output location, OutputBuffer)
 
     @property
     def message(self) -> JuliusMessage:
         return self.choices[0].message if self.choices else None
 
-class Files:
-    def __init__(self, client):
-        self.client = client
+    def outputs(self) -> Iterator[Any]:
+        """Iterate the code-execution outputs of every code block, read lazily from their buffers."""
+        for block in self.code_blocks:
+            yield from block[3]
+
+@dataclass
+class ContentDelta:
+    """Assistant text as it arrives on the stream."""
+    text: str
+    type: str = "content"
+
+@dataclass
+class CodeDelta:
+    """A fragment of function_call arguments (the generated code)."""
+    arguments: str
+    type: str = "code"
+
+@dataclass
+class OutputDelta:
+    """One entry from a chunk's code-execution outputs."""
+    output: Any
+    type: str = "output"
+
+@dataclass
+class ImageDelta:
+    """An image produced by the code interpreter."""
+    image_id: str
+    url: str
+    type: str = "image"
+
+@dataclass
+class MessageDone:
+    """Final event of a message, carrying its formatted content and saved code blocks."""
+    conversation_id: str
+    content: str
+    code_blocks: List
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    type: str = "done"
+
+StreamEvent = Union[ContentDelta, CodeDelta, OutputDelta, ImageDelta, MessageDone]
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = lambda obj: json.dumps(obj).encode('utf-8')
+
+STREAM_READ_SIZE = 64 * 1024
+OUTPUT_MEMORY_BUDGET = 8 * 1024 * 1024
+OUTPUT_SKIP_MARKERS = (b'Saved image as', b'Error saving')  # Client notes kept out of the output artifact
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class OutputBuffer:
+    """Code-execution outputs of one message, deduplicated by hash and spilled to disk past a memory budget.
+
+    Each distinct output is serialized once, in memory until the budget and then into a temporary
+    file; only its digest is kept to recognise repeats. Iterating the buffer reads the outputs back
+    one at a time. seal() releases the spill file's descriptor once the message is complete; reads
+    then reopen it, and the file is removed with the buffer or by close().
+    """
+
+    def __init__(self, memory_budget: int = OUTPUT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self._spool: Optional[BinaryIO] = io.BytesIO()  # Write handle; None while a spill file is sealed
+        self._path: Optional[str] = None
+        self._remove = None
+        self._digests: set = set()
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def append(self, output: Any):
+        line = _json_dumps(output)
+        digest = hashlib.sha256(line).digest()
+        with self._lock:
+            if digest in self._digests:
+                return
+            self._digests.add(digest)
+            if self._spool is None:
+                self._spool = open(self._path, 'r+b')
+            elif self._path is None and self._spool.tell() + len(line) > self.memory_budget:
+                self._spill()  # Spill before writing, so an oversized entry is never copied in memory
+            self._spool.seek(0, os.SEEK_END)
+            self._spool.write(line)
+            self._spool.write(b"\n")
+            self.count += 1
+
+    def _spill(self):
+        fd, self._path = tempfile.mkstemp(prefix="julius-outputs-", suffix=".ndjson")
+        self._remove = weakref.finalize(self, _remove_file, self._path)
+        spool = os.fdopen(fd, 'w+b')
+        with self._spool.getbuffer() as view:
+            spool.write(view)
+        self._spool = spool
+
+    def seal(self):
+        """Release the spill file's descriptor; the outputs stay readable."""
+        with self._lock:
+            if self._path is not None and self._spool is not None:
+                self._spool.close()
+                self._spool = None
+
+    def extend(self, outputs):
+        for output in outputs:
+            self.append(output)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Any]:
+        for line in self._lines():
+            yield _json_loads(line)
+
+    @property
+    def spilled(self) -> bool:
+        """True once the outputs outgrew the memory budget and moved to disk."""
+        return self._path is not None
+
+    def _lines(self) -> Iterator[bytes]:
+        with self._lock:
+            sealed_path = self._path if self._spool is None else None
+        if sealed_path is not None:
+            with open(sealed_path, 'rb') as f:
+                yield from f
+            return
+        # Reads share the spool with writers, so each batch seeks to its own position under the lock
+        position = 0
+        while True:
+            with self._lock:
+                if self._spool is None:
+                    return
+                self._spool.seek(position)
+                lines = self._spool.readlines(STREAM_READ_SIZE)
+                position = self._spool.tell()
+                self._spool.seek(0, os.SEEK_END)
+            if not lines:
+                return
+            yield from lines
+
+    def document(self) -> Iterator[bytes]:
+        """The output artifact, {"output": [...]} with indent=2, produced piece by piece."""
+        first = True
+        for line in self._lines():
+            if any(marker in line for marker in OUTPUT_SKIP_MARKERS):
+                continue
+            yield b'{\n  "output": [\n    ' if first else b',\n    '
+            if line[:1] in (b'{', b'['):
+                yield json.dumps(json.loads(line), indent=2).replace("\n", "\n    ").encode('utf-8')
+            else:
+                yield line.rstrip(b"\n")  # Scalars (most large outputs are strings) are already in final form
+            first = False
+        yield b'{\n  "output": []\n}' if first else b'\n  ]\n}'
+
+    def close(self):
+        """Discard the outputs and remove the spill file."""
+        with self._lock:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+            if self._remove is not None:
+                self._remove()
+            self._path = None
+
+class StreamDecoder:
+    """Incremental decoder for the NDJSON stream returned by /api/chat/message.
+
+    Bytes may be fed in arbitrary pieces. Text and code are collected in lists and joined once,
+    each line is parsed exactly once (with orjson when installed), and function_call arguments
+    are only decoded when a fragment is a complete JSON object that may carry an image URL.
+    """
+
+    def __init__(self, outputs: Optional[OutputBuffer] = None):
+        self._buffer = bytearray()
+        self._content: List[str] = []
+        self._code: List[str] = []
+        self.outputs = outputs if outputs is not None else []  # Any list-like with append/extend
+        self.chunk_count = 0
+        self._skip = 0  # Replayed chunks still to discard after resume()
+
+    @property
+    def content(self) -> str:
+        return ''.join(self._content)
+
+    @property
+    def code(self) -> str:
+        return ''.join(self._code)
+
+    def feed(self, data: bytes) -> List[StreamEvent]:
+        """Consume raw bytes and return the events of every line they complete."""
+        # Search only the new bytes: the buffered partial line holds no newline, and rescanning it
+        # on every read makes one long line quadratic
+        start = len(self._buffer)
+        self._buffer += data
+        end = self._buffer.rfind(b"\n", start)
+        if end < 0:
+            return []
+        complete = bytes(self._buffer[:end])
+        del self._buffer[:end + 1]
+        events = []
+        for line in complete.split(b"\n"):
+            events.extend(self.decode_line(line))
+        return events
+
+    def resume(self):
+        """Prepare for a replay of the same answer from its start: drop the partial line and skip seen chunks."""
+        self._buffer.clear()
+        self._skip = self.chunk_count
+
+    def close(self) -> List[StreamEvent]:
+        """Decode a final line that was not newline-terminated."""
+        line = bytes(self._buffer)
+        self._buffer.clear()
+        return self.decode_line(line)
+
+    def decode_line(self, line: bytes) -> List[StreamEvent]:
+        """Decode one NDJSON line into delta events, ignoring blank or malformed lines."""
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            chunk = _json_loads(line)
+        except ValueError:
+            return []
+        if not isinstance(chunk, dict):
+            return []
+        if self._skip:
+            self._skip -= 1
+            return []
+        self.chunk_count += 1
+        events = []
+
+        # Handle outputs
+        outputs = chunk.get('outputs')
+        if outputs:
+            self.outputs.extend(outputs)
+            events.extend(OutputDelta(output=output) for output in outputs)
+
+        # Accumulate content
+        content = chunk.get('content')
+        if content:
+            self._content.append(content)
+            events.append(ContentDelta(text=content))
+
+        # Handle function calls
+        function_call = chunk.get('function_call')
+        arguments = function_call.get('arguments') if isinstance(function_call, dict) else None
+        if arguments:
+            if isinstance(arguments, str) and '"python":' in arguments:
+                self._code.append(arguments)
+            events.append(CodeDelta(arguments=arguments))
+
+        # Handle images
+        images = self._images(chunk, arguments)
+        if images:
+            self.outputs.append({"image_urls": images})
+            events.extend(ImageDelta(image_id=img_id, url=url) for img_id, url in images.items())
+
+        return events
+
+    def _images(self, chunk: Dict[str, Any], arguments: Any) -> Dict[str, str]:
+        """Extract image URLs from a chunk."""
+        if 'image_urls_dict' in chunk:
+            return chunk['image_urls_dict'] or {}
+        if 'image_urls' in chunk:
+            return {f"image_{i}": url for i, url in enumerate(chunk['image_urls'] or [])}
+        if isinstance(arguments, str):
+            # Partial argument fragments are never complete objects; skip parsing them
+            candidate = arguments.strip()
+            if not (candidate.startswith('{') and candidate.endswith('}') and '"url"' in candidate):
+                return {}
+            try:
+                arguments = _json_loads(candidate)
+            except ValueError:
+                return {}
+        if isinstance(arguments, dict) and 'url' in arguments:
+            return {"image_0": arguments['url']}
+        return {}
+
+@dataclass
+class TraceEvent:
+    """One timed HTTP phase (http.*), stream milestone (stream.*) or whole call (call.*)."""
+    name: str
+    seconds: float  # Duration, or for stream milestones the offset from sending the message
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    status: Optional[int] = None
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+# Endpoint path -> phase name used in http.* trace events
+HTTP_PHASES = {
+    "/files/signed_url": "signed_url",
+    "/files/preprocess_file": "preprocess_file",
+    "/hub/v2/list_hub_files": "list_files",
+    "/api/chat/start": "start_conversation",
+    "/api/chat/sources": "register_source",
+    "/api/chat/message": "message",
+    "/api/user_preferences": "user_preferences",
+}
+
+def _http_phase(method: str, url: str, storage: bool, headers: Optional[Dict] = None,
+                reattach_path: Optional[str] = None) -> str:
+    """Name the phase a request belongs to, from its endpoint or, on storage hosts, its method."""
+    if storage:
+        if method == "GET":
+            return "http.image"
+        if method == "POST":
+            return "http.upload_start"
+        return "http.upload_part" if headers and "Content-Range" in headers else "http.upload"
+    path = urlsplit(url).path
+    if reattach_path and path == reattach_path:
+        return "http.reattach"
+    return "http." + HTTP_PHASES.get(path, "other")
+
+def _body_size(prepared) -> int:
+    """Bytes in a prepared request's body, without reading streamed bodies."""
+    body = prepared.body
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return int(prepared.headers.get("Content-Length") or 0)
+
+class CallTimings:
+    """Seconds spent per phase while one call runs, summed across the threads and tasks it uses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = {}
+
+    def add(self, event: TraceEvent):
+        with self._lock:
+            self.seconds[event.name] = self.seconds.get(event.name, 0.0) + event.seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.seconds)
+
+# Timings of the call running in this context; copied into worker threads with the context
+_call_timings: contextvars.ContextVar = contextvars.ContextVar("julius_call_timings", default=None)
+
+def _in_context(fn: Callable) -> Callable:
+    """Bind fn to a copy of the current context so pool threads see the caller's call timings."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+class Instrumentation:
+    """Dispatches trace events to the client's tracers and to the timings of the current call.
+
+    A tracer is any callable taking a TraceEvent, e.g. a HistogramCollector.
+    """
+
+    def __init__(self, tracers: Optional[List[Callable[[TraceEvent], None]]] = None):
+        self.tracers = list(tracers or [])
+
+    def add(self, tracer: Callable[[TraceEvent], None]):
+        self.tracers.append(tracer)
+
+    @property
+    def active(self) -> bool:
+        return bool(self.tracers) or _call_timings.get() is not None
+
+    def emit(self, name: str, seconds: float, **details):
+        if not self.active:
+            return
+        event = TraceEvent(name, seconds, **details)
+        timings = _call_timings.get()
+        if timings is not None:
+            timings.add(event)
+        for tracer in self.tracers:
+            try:
+                tracer(event)
+            except Exception:
+                pass  # A failing tracer must never fail the request it observes
+
+    @contextmanager
+    def call(self, name: str):
+        """Collect the timings of everything done inside the block, then emit call.<name>."""
+        timings = CallTimings()
+        token = _call_timings.set(timings)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield timings
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _call_timings.reset(token)
+            timings.seconds["total"] = elapsed
+            self.emit(f"call.{name}", elapsed, error=error)
+
+class StreamTimer:
+    """Emits the first-chunk, first-code-chunk and last-chunk milestones of one message stream."""
+
+    def __init__(self, instrumentation: Instrumentation):
+        self.instrumentation = instrumentation
+        self.started = time.perf_counter()
+        self.bytes_received = 0
+        self._first_chunk = False
+        self._first_code = False
+
+    def _emit(self, name: str, **details):
+        self.instrumentation.emit(name, time.perf_counter() - self.started,
+                                  bytes_received=self.bytes_received, **details)
+
+    def observe(self, size: int, decoder: StreamDecoder, events: List[StreamEvent]):
+        """Account for one network read and the events decoded from it."""
+        self.bytes_received += size
+        if not self._first_chunk and decoder.chunk_count:
+            self._first_chunk = True
+            self._emit("stream.first_chunk")
+        if not self._first_code and any(isinstance(event, CodeDelta) for event in events):
+            self._first_code = True
+            self._emit("stream.first_code_chunk")
+
+    def finish(self, decoder: StreamDecoder):
+        self._emit("stream.last_chunk", attributes={"chunks": decoder.chunk_count})
+
+class HistogramCollector:
+    """Tracer keeping in-memory histograms of event durations and byte counts, for scraping."""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self, buckets: Optional[List[float]] = None):
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS))
+        self._lock = threading.Lock()
+        self._series: Dict[str, Dict[str, Any]] = {}
+
+    def __call__(self, event: TraceEvent):
+        with self._lock:
+            series = self._series.get(event.name)
+            if series is None:
+                series = self._series[event.name] = {
+                    "counts": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0,
+                    "bytes_sent": 0, "bytes_received": 0, "errors": 0
+                }
+            series["counts"][bisect_left(self.buckets, event.seconds)] += 1
+            series["count"] += 1
+            series["sum"] += event.seconds
+            series["bytes_sent"] += event.bytes_sent
+            series["bytes_received"] += event.bytes_received
+            if event.error or (event.status or 0) >= 400:
+                series["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per event name: count, sum, errors, byte totals and cumulative bucket counts keyed by upper bound."""
+        with self._lock:
+            result = {}
+            for name, series in self._series.items():
+                cumulative, running = {}, 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    running += count
+                    cumulative[bound] = running
+                result[name] = {key: value for key, value in series.items() if key != "counts"}
+                result[name]["buckets"] = cumulative
+            return result
+
+    def quantile(self, name: str, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile (0..1) of an event's durations."""
+        series = self.snapshot().get(name)
+        if not series or not series["count"]:
+            return None
+        target = q * series["count"]
+        for bound, cumulative in series["buckets"].items():
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def render_prometheus(self, metric: str = "julius_phase_seconds") -> str:
+        """Prometheus text exposition of every histogram, labelled by event name."""
+        lines = [f"# TYPE {metric} histogram"]
+        for name, series in sorted(self.snapshot().items()):
+            for bound, cumulative in series["buckets"].items():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{phase="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{phase="{name}"}} {series["sum"]}')
+            lines.append(f'{metric}_count{{phase="{name}"}} {series["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+@dataclass
+class TransportConfig:
+    """Connection pooling and timeout settings shared by every request a client makes."""
+    pool_connections: int = 4  # Distinct hosts cached per session
+    pool_maxsize: int = 16  # Keep-alive connections per API host
+    storage_pool_maxsize: int = 16  # Keep-alive connections per signed-URL / image host
+    connect_timeout: float = 10.0
+    read_timeout: Optional[float] = 300.0
+    keep_alive: bool = True
+
+class CircuitOpenError(Exception):
+    """Raised without sending anything while an endpoint's circuit breaker is open."""
+
+class StreamInterruptedError(Exception):
+    """A message stream dropped and could not be re-attached; keeps the answer received so far."""
+
+    def __init__(self, conversation_id: str, partial_content: str, reason: str):
+        super().__init__(f"Stream of conversation {conversation_id} was interrupted: {reason}")
+        self.conversation_id = conversation_id
+        self.partial_content = partial_content
+
+@dataclass
+class RetryPolicy:
+    """How a client retries failed requests and protects endpoints that keep failing."""
+    max_attempts: int = 4  # Including the first attempt; 1 disables retries
+    base_delay: float = 0.5  # Backoff cap for the first retry, doubled for each one after
+    max_delay: float = 30.0
+    retry_statuses: tuple = (429, 500, 502, 503, 504)
+    max_retry_after: float = 120.0  # Longest server-requested Retry-After wait honored
+    circuit_failure_threshold: int = 5  # Consecutive failed requests that open an endpoint's circuit; 0 disables
+    circuit_reset_seconds: float = 30.0  # How long an open circuit rejects requests before one trial
+    reattach_path: Optional[str] = None  # GET endpoint replaying a conversation's in-progress answer
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry attempt+1: the server's Retry-After, else full-jitter backoff."""
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+# Phases whose requests can be sent again without side effects beyond the first. Starting a
+# conversation is not among them: a repeat after a lost response leaves an orphan conversation.
+REPLAY_SAFE_PHASES = {
+    "http.signed_url", "http.preprocess_file", "http.list_files", "http.register_source",
+    "http.user_preferences", "http.image", "http.upload", "http.upload_start", "http.reattach",
+}
+
+# Not replay-safe after a timeout or reset, yet retried on any retryable status: the server answered that it
+# failed, so at worst a repeat leaves an empty orphan conversation, which costs far less than the lost analysis
+STATUS_RETRY_PHASES = {"http.start_conversation"}
+
+def _replay_safe(phase: str, method: str) -> bool:
+    """Whether a request may be re-sent after it possibly reached the server; unknown endpoints only if reads."""
+    if phase == "http.other":
+        return method in ("GET", "HEAD")
+    return phase in REPLAY_SAFE_PHASES
+
+class CircuitBreaker:
+    """Opens after consecutive failures of one endpoint, then lets a single trial request through."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failure_threshold > 0 and self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class RateLimitedError(Exception):
+    """The server still answered 429 after every retry; retry_after is how long clients are backing off."""
+
+    def __init__(self, phase: str, retry_after: float):
+        super().__init__(f"Rate limited on {phase}; retry after {retry_after:.1f}s")
+        self.phase = phase
+        self.retry_after = retry_after
+
+@dataclass
+class RateBudget:
+    """Token bucket for one endpoint: rate requests per second sustained, bursts of up to burst."""
+    rate: float
+    burst: int = 1
+
+class RateLimitStore(ABC):
+    """Where a RateLimiter keeps each endpoint's bucket, as the one timestamp GCRA needs.
+
+    update(key, change) atomically replaces the key's timestamp (0.0 when unknown) with the first
+    element of change(timestamp) and returns the second; peek(key) only reads it. A store whose
+    calls may wait on other processes sets blocking, so async clients call it off the event loop.
+    """
+
+    blocking = False
+
+    @abstractmethod
+    def update(self, key: str, change: Callable[[float], tuple]) -> Any:
+        """Atomically apply change to key's timestamp and return its result."""
+
+    def peek(self, key: str) -> float:
+        return self.update(key, lambda timestamp: (timestamp, timestamp))
+
+    def close(self):
+        pass
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Buckets shared by the threads of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timestamps: Dict[str, float] = {}
+
+    def update(self, key: str, change: Callable[[float], tuple]) -> Any:
+        with self._lock:
+            self._timestamps[key], result = change(self._timestamps.get(key, 0.0))
+            return result
+
+    def peek(self, key: str) -> float:
+        with self._lock:
+            return self._timestamps.get(key, 0.0)
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Buckets in a SQLite file, shared by every process on the host that opens the same path."""
+
+    blocking = True  # Waits up to 30s for the write lock when other processes contend for it
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "julius", "rate_limits.sqlite3")
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def _connection(self):
+        """This process's connection; a forked child opens its own rather than sharing the parent's."""
+        if self._db is None or self._pid != os.getpid():
+            import sqlite3  # Only cross-process limiting needs it
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")  # A crash can only lose recent bucket state, i.e. allow one burst
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def update(self, key: str, change: Callable[[float], tuple]) -> Any:
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")  # Take the write lock before reading, so no two processes see one value
+            try:
+                row = db.execute("SELECT tat FROM buckets WHERE key = ?", (key,)).fetchone()
+                timestamp, result = change(row[0] if row else 0.0)
+                db.execute("INSERT OR REPLACE INTO buckets (key, tat) VALUES (?, ?)", (key, timestamp))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return result
+
+    def peek(self, key: str) -> float:
+        with self._lock:  # A plain read; under WAL it never waits for a writer
+            row = self._connection().execute("SELECT tat FROM buckets WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else 0.0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+class RateLimiter:
+    """Client-side token buckets per endpoint, plus 429 backoffs every client sharing the store observes.
+
+    budgets maps a phase ("http.message", "http.start_conversation", ...) to its RateBudget;
+    other endpoints are only held back while a server-requested backoff is in effect. Buckets
+    live in store: in memory by default, or a SQLiteRateLimitStore to share them between the
+    processes on one host. Each bucket is kept as its theoretical arrival time (GCRA), so
+    admitting a request is a single read-modify-write of the store, and a request to an
+    endpoint without a budget only reads it. Buckets are keyed by scope as well as phase
+    (see scope_for), so clients of different accounts or API addresses never share them.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, RateBudget]] = None, store: Optional[RateLimitStore] = None):
+        self.budgets = dict(budgets or {})
+        self.store = store or MemoryRateLimitStore()
+
+    @staticmethod
+    def scope_for(base_url: str, api_key: str) -> str:
+        """The bucket scope of one account on one API address; the key itself is never stored."""
+        return hashlib.sha256(f"{base_url}\0{api_key}".encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _key(phase: str, scope: str) -> str:
+        return f"{scope}/{phase}" if scope else phase
+
+    def _shape(self, phase: str) -> tuple:
+        """(seconds between requests, burst tolerance in seconds) for phase; zeros when it has no budget."""
+        budget = self.budgets.get(phase)
+        if budget is None:
+            return 0.0, 0.0
+        interval = 1.0 / budget.rate
+        return interval, (max(budget.burst, 1) - 1) * interval
+
+    def reserve(self, phase: str, scope: str = "") -> float:
+        """Take the next slot for a request to phase and return how many seconds to wait before sending it."""
+        interval, tolerance = self._shape(phase)
+        now = time.time()
+        if phase not in self.budgets:
+            return max(0.0, self.store.peek(self._key(phase, scope)) - now)  # Only a backoff can hold it
+
+        def take(tat: float) -> tuple:
+            tat = max(tat, now)
+            return tat + interval, max(0.0, tat - tolerance - now)
+
+        return self.store.update(self._key(phase, scope), take)
+
+    def backoff(self, phase: str, seconds: float, scope: str = ""):
+        """Hold every client sharing the store back from phase for seconds, then resume one interval apart."""
+        _, tolerance = self._shape(phase)
+        until = time.time() + seconds
+        self.store.update(self._key(phase, scope), lambda tat: (max(tat, until + tolerance), None))
+
+class RetryController:
+    """Retry decisions and per-endpoint circuit breakers shared by Transport and AsyncTransport.
+
+    Requests of replay-safe phases are retried on transient errors and retryable statuses.
+    Other requests (a chat message) are only retried when they provably never left the client,
+    or were rejected with 429.
+    """
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, instrumentation: Optional[Instrumentation] = None,
+                 metrics: Optional["ClientMetrics"] = None, limiter: Optional[RateLimiter] = None,
+                 limiter_scope: str = ""):
+        self.policy = policy or RetryPolicy()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.metrics = metrics
+        self.limiter = limiter
+        self.limiter_scope = limiter_scope
+        self._lock = threading.Lock()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, phase: str) -> CircuitBreaker:
+        with self._lock:
+            if phase not in self.breakers:
+                self.breakers[phase] = CircuitBreaker(
+                    self.policy.circuit_failure_threshold, self.policy.circuit_reset_seconds
+                )
+            return self.breakers[phase]
+
+    def admit(self, phase: str) -> CircuitBreaker:
+        """Return the phase's breaker, or raise CircuitOpenError if it is rejecting requests."""
+        breaker = self.breaker(phase)
+        if not breaker.allow():
+            if self.metrics is not None:
+                self.metrics.increment("circuit_rejections")
+            raise CircuitOpenError(f"Circuit for {phase} is open after {breaker.failures} consecutive failures")
+        return breaker
+
+    def delay_for_status(self, status: int, retry_after: Optional[str], attempt: int,
+                         replay_safe: bool, phase: str = "") -> Optional[float]:
+        """Seconds to wait before retrying a response with this status, or None to return it.
+
+        Requests that are not replay-safe are still retried when the server says it refused them
+        (429, or 503 with Retry-After), and those of STATUS_RETRY_PHASES on every retryable status.
+        """
+        if status not in self.policy.retry_statuses or attempt + 1 >= self.policy.max_attempts:
+            return None
+        refused = status == 429 or (status == 503 and bool(retry_after))
+        if not replay_safe and not refused and phase not in STATUS_RETRY_PHASES:
+            return None
+        return self.policy.delay(attempt, _retry_after_seconds(retry_after))
+
+    def delay_for_error(self, transient: bool, never_sent: bool, attempt: int,
+                        replay_safe: bool) -> Optional[float]:
+        """Seconds to wait before retrying after a transport error, or None to raise it."""
+        if attempt + 1 >= self.policy.max_attempts:
+            return None
+        if never_sent or (transient and replay_safe):
+            return self.policy.delay(attempt)
+        return None
+
+    @property
+    def limiter_blocks(self) -> bool:
+        """True when pace and rate_limited may block on the limiter's store."""
+        return self.limiter is not None and self.limiter.store.blocking
+
+    def pace(self, phase: str) -> float:
+        """Seconds to hold a request to phase back under the client's RateLimiter; 0 to send it now."""
+        if self.limiter is None:
+            return 0.0
+        wait = self.limiter.reserve(phase, self.limiter_scope)
+        if wait > 0:
+            if self.metrics is not None:
+                self.metrics.increment("rate_limit_waits")
+                self.metrics.increment("rate_limit_wait_seconds", wait)
+            self.instrumentation.emit("http.rate_limit", wait, attributes={"phase": phase})
+        return wait
+
+    def rate_limited(self, phase: str, retry_after: Optional[str], attempt: int) -> float:
+        """Share a 429's backoff with every client using the same limiter store, and return its length."""
+        seconds = self.policy.delay(attempt, _retry_after_seconds(retry_after))
+        if self.metrics is not None:
+            self.metrics.increment("rate_limited")
+        if self.limiter is not None:
+            self.limiter.backoff(phase, seconds, self.limiter_scope)
+        return seconds
+
+    def record(self, breaker: CircuitBreaker, status: Optional[int] = None):
+        """Count a finished request against its endpoint: errors and 5xx are failures."""
+        if status is None or status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def note_retry(self, phase: str, attempt: int, delay: float, reason: str):
+        if self.metrics is not None:
+            self.metrics.increment("retries")
+            self.metrics.increment("retry_wait_seconds", delay)
+        self.instrumentation.emit("http.retry", delay, attributes={"phase": phase, "attempt": attempt + 1,
+                                                                   "reason": reason})
+
+def _never_sent(error: Exception) -> bool:
+    """True when requests failed before a connection to the server existed."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), (NewConnectionError, ConnectTimeoutError))
+    return False
+
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+class Transport:
+    """Pooled HTTP transport with separate sessions for the Julius API and storage hosts."""
+
+    def __init__(self, config: Optional[TransportConfig] = None, instrumentation: Optional[Instrumentation] = None,
+                 retries: Optional[RetryController] = None, cassette: Optional["Cassette"] = None):
+        self.config = config or TransportConfig()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.retries = retries or RetryController(instrumentation=self.instrumentation)
+        self.cassette = cassette
+        self.api = self._build_session(self.config.pool_maxsize)
+        self.storage = self._build_session(self.config.storage_pool_maxsize)
+
+    def _build_session(self, pool_maxsize: int) -> requests.Session:
+        """Create a session whose adapter keeps up to pool_maxsize connections per host alive."""
+        session = requests.Session()
+        adapter_factory = self.cassette.adapter if self.cassette is not None else HTTPAdapter
+        adapter = adapter_factory(
+            pool_connections=self.config.pool_connections,
+            pool_maxsize=pool_maxsize
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.config.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    @property
+    def timeout(self) -> tuple:
+        return (self.config.connect_timeout, self.config.read_timeout)
+
+    def request(self, method: str, url: str, storage: bool = False, replay_safe: Optional[bool] = None,
+                **kwargs) -> requests.Response:
+        """Send a request through the API pool, or the storage pool for signed URLs and images.
+
+        Failures are retried under the client's RetryPolicy; replay_safe overrides whether the
+        endpoint may be re-sent after it possibly reached the server. API requests are paced by the
+        client's RateLimiter, and a 429 that outlasts the retries raises RateLimitedError.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.storage if storage else self.api
+        phase = _http_phase(method, url, storage, kwargs.get("headers"), self.retries.policy.reattach_path)
+        if replay_safe is None:
+            replay_safe = _replay_safe(phase, method)
+        data = kwargs.get("data")
+        if data is not None and not isinstance(data, (bytes, str, dict, list, tuple)) and not hasattr(data, "seek"):
+            replay_safe = False  # A consumed stream body cannot be sent twice
+        breaker = self.retries.admit(phase)
+
+        attempt = 0
+        while True:
+            if attempt and hasattr(data, "seek"):
+                data.seek(0)
+            if not storage:
+                wait = self.retries.pace(phase)
+                if wait:
+                    time.sleep(wait)
+            try:
+                response = self._send(session, phase, method, url, **kwargs)
+            except TRANSIENT_ERRORS as e:
+                delay = self.retries.delay_for_error(True, _never_sent(e), attempt, replay_safe)
+                if delay is None:
+                    self.retries.record(breaker)
+                    raise
+                reason = type(e).__name__
+            else:
+                retry_after = response.headers.get("Retry-After")
+                backoff = None
+                if response.status_code == 429 and not storage:
+                    backoff = self.retries.rate_limited(phase, retry_after, attempt)
+                delay = self.retries.delay_for_status(response.status_code, retry_after, attempt, replay_safe,
+                                                     phase)
+                if delay is None:
+                    self.retries.record(breaker, response.status_code)
+                    if backoff is not None:
+                        response.close()
+                        raise RateLimitedError(phase, backoff)
+                    return response
+                reason = f"HTTP {response.status_code}"
+                response.close()
+            self.retries.note_retry(phase, attempt, delay, reason)
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, session: requests.Session, phase: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Send one attempt, reporting it to the tracers when any are listening."""
+        if not self.instrumentation.active:
+            return session.request(method, url, **kwargs)
+
+        # Streamed responses are timed to their headers; their body is covered by stream.* milestones
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception as e:
+            self.instrumentation.emit(phase, time.perf_counter() - started, error=str(e),
+                                      attributes={"method": method, "url": url})
+            raise
+        self.instrumentation.emit(
+            phase, time.perf_counter() - started,
+            bytes_sent=_body_size(response.request),
+            bytes_received=0 if kwargs.get("stream") else len(response.content),
+            status=response.status_code,
+            attributes={"method": method, "url": url}
+        )
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, **kwargs)
+
+    def close(self):
+        """Close every pooled connection."""
+        self.api.close()
+        self.storage.close()
+
+class CassetteMissError(requests.exceptions.RequestException):
+    """A replaying Cassette has no recorded response left for a request."""
+
+# Never written to a cassette; bodies are stored decoded, so their encoding headers no longer apply
+CASSETTE_REDACTED_HEADERS = {"authorization", "cookie", "set-cookie", "content-encoding", "transfer-encoding",
+                             "content-length"}
+CASSETTE_MAX_BODY = 64 * 1024  # Largest JSON request body kept verbatim; others are recorded by size and hash
+# Query strings of signed URLs are credentials: signedUrl values, and any URL signed with one of these parameters
+_CASSETTE_SIGNED_URL = re.compile(rb'("signedUrl"\s*:\s*"[^"?]*\?)([^"]*)')
+_CASSETTE_URL_QUERY = re.compile(rb'(https?:(?:\\?/){2}[^\s"\'<>?]+\?)([^\s"\'<>]*)')
+_CASSETTE_SIGNING_PARAM = re.compile(
+    rb'(?i)(?:^|&|\\u0026)(?:[\w.-]*signature|sig|token|[\w.-]*security-token|[\w.-]*credential|googleaccessid|key)='
+)
+
+def _cassette_redact(data: bytes) -> bytes:
+    """data with the query strings of signed URLs masked; its length is kept, so chunk offsets stay valid."""
+    def mask(match):
+        return match.group(1) + b"*" * len(match.group(2))
+
+    def mask_signed(match):
+        return mask(match) if _CASSETTE_SIGNING_PARAM.search(match.group(2)) else match.group(0)
+
+    return _CASSETTE_URL_QUERY.sub(mask_signed, _CASSETTE_SIGNED_URL.sub(mask, data))
+
+def _cassette_key(method: str, url: str, headers) -> tuple:
+    """Requests are matched by method, path and conversation, so hosts and signed query strings may differ."""
+    return (method, urlsplit(url).path, headers.get("conversation-id", ""))
+
+def _cassette_chunk(offset: float, data: bytes) -> Dict[str, Any]:
+    try:
+        return {"t": round(offset, 6), "text": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"t": round(offset, 6), "b64": base64.b64encode(data).decode("ascii")}
+
+def _cassette_chunk_bytes(chunk: Dict[str, Any]) -> bytes:
+    return chunk["text"].encode("utf-8") if "text" in chunk else base64.b64decode(chunk["b64"])
+
+def _cassette_interaction(sequence: int, request: requests.PreparedRequest, status: int, reason: str,
+                          headers, headers_at: float) -> Dict[str, Any]:
+    """A cassette line for a request whose response headers arrived; body chunks are appended as read."""
+    return {
+        "seq": sequence,
+        "method": request.method,
+        "url": urlsplit(request.url)._replace(query="", fragment="").geturl(),
+        "key": list(_cassette_key(request.method, request.url, request.headers)),
+        "request": _cassette_request(request),
+        "response": {
+            "status": status,
+            "reason": reason,
+            "headers": {name: _cassette_redact(value.encode("latin-1")).decode("latin-1")
+                        for name, value in headers.items()
+                        if name.lower() not in CASSETTE_REDACTED_HEADERS},
+            "headers_at": round(headers_at, 6),
+            "chunks": [],
+            "error": None,
+        },
+    }
+
+def _cassette_redact_body(interaction: Dict[str, Any]):
+    """Mask signed URLs in a recorded body as a whole, since one may be split across chunks."""
+    response = interaction["response"]
+    chunks = [_cassette_chunk_bytes(chunk) for chunk in response["chunks"]]
+    body = b"".join(chunks)
+    redacted = _cassette_redact(body)
+    if redacted == body:
+        return
+    offset = 0
+    for index, data in enumerate(chunks):
+        response["chunks"][index] = _cassette_chunk(response["chunks"][index]["t"], redacted[offset:offset + len(data)])
+        offset += len(data)
+
+def _cassette_request(request: requests.PreparedRequest) -> Dict[str, Any]:
+    """Describe a sent request for the cassette, without credentials or file contents."""
+    record = {"headers": {name: value for name, value in request.headers.items()
+                          if name.lower() not in CASSETTE_REDACTED_HEADERS}}
+    body = request.body.encode("utf-8") if isinstance(request.body, str) else request.body
+    if isinstance(body, bytes):
+        record["body_size"] = len(body)
+        record["body_sha256"] = hashlib.sha256(body).hexdigest()
+        if "json" in request.headers.get("Content-Type", "") and len(body) <= CASSETTE_MAX_BODY:
+            record["body"] = _cassette_redact(body).decode("utf-8", "replace")
+    elif body is not None:
+        record["body_size"] = int(request.headers.get("Content-Length") or 0)
+    return record
+
+class _RecordedBody:
+    """Wraps a urllib3 response, copying each body chunk handed to requests into its cassette interaction."""
+
+    def __init__(self, raw, cassette: "Cassette", interaction: Dict[str, Any], started: float):
+        self._raw = raw
+        self._cassette = cassette
+        self._interaction = interaction
+        self._started = started
+        self._finished = False
+
+    def _record(self, data: bytes):
+        self._interaction["response"]["chunks"].append(_cassette_chunk(time.perf_counter() - self._started, data))
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self._cassette._write(self._interaction)
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None):
+        try:
+            for data in self._raw.stream(amt, decode_content=decode_content):
+                self._record(data)
+                yield data
+        except Exception as e:
+            self._interaction["response"]["error"] = type(e).__name__  # Replayed as a dropped stream
+            raise
+        finally:
+            self._finish()
+
+    def read(self, amt: Optional[int] = None, decode_content: bool = True, **kwargs) -> bytes:
+        data = self._raw.read(amt, decode_content=decode_content, **kwargs)
+        if data:
+            self._record(data)
+        else:
+            self._finish()
+        return data
+
+    def close(self):
+        self._raw.close()
+        self._finish()
+
+    def release_conn(self):
+        self._raw.release_conn()
+        self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+class _ReplayBody:
+    """File-like body serving recorded chunks, each no earlier than its recorded offset times time_scale."""
+
+    def __init__(self, chunks: List[Dict[str, Any]], error: Optional[str], headers_at: float, time_scale: float):
+        self._chunks = deque(chunks)
+        self._error = error
+        self._headers_at = headers_at
+        self._time_scale = time_scale
+        self._opened = time.perf_counter()
+
+    def read(self, amt: Optional[int] = None, **kwargs) -> bytes:
+        if amt is None:
+            return b"".join(iter(lambda: self.read(1), b""))
+        if not self._chunks:
+            if self._error:
+                error, self._error = self._error, None
+                raise requests.exceptions.ChunkedEncodingError(f"Recorded stream ended with {error}")
+            return b""
+        chunk = self._chunks.popleft()
+        if self._time_scale:
+            due = self._opened + (chunk["t"] - self._headers_at) * self._time_scale
+            pause = due - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+        return _cassette_chunk_bytes(chunk)
+
+    def close(self):
+        self._chunks.clear()
+
+class _RecordingAdapter(HTTPAdapter):
+    """HTTPAdapter that writes every exchange it carries to a Cassette."""
+
+    def __init__(self, cassette: "Cassette", **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        sequence = self.cassette._next_sequence()
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        interaction = _cassette_interaction(sequence, request, response.status_code, response.reason,
+                                            response.headers, time.perf_counter() - started)
+        response.raw = _RecordedBody(response.raw, self.cassette, interaction, started)
+        return response
+
+class _ReplayAdapter(BaseAdapter):
+    """Adapter answering every request from a Cassette, without opening connections."""
+
+    def __init__(self, cassette: "Cassette"):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout=None, verify=True,
+             cert=None, proxies=None) -> requests.Response:
+        return self.cassette._replay(request, self)
+
+    def close(self):
+        pass
+
+class Cassette:
+    """Record a client's HTTP traffic to a JSON Lines file, or replay it without touching the network.
+
+    In "record" mode, each request is written as it completes, with its response's status,
+    headers and body. The body is stored as it arrived: every chunk of a message's NDJSON stream,
+    with its offset. In "replay" mode, a request is answered by the next recorded exchange with
+    the same method, path and conversation. time_scale stretches the recorded delays: 1.0
+    reproduces the original timing, and 0 serves everything as fast as possible. Credentials
+    and uploaded file contents are never written: authorization headers and cookies are
+    dropped, and the query strings of signed URLs (signedUrl values, and URLs carrying a
+    signature or token parameter) are masked with "*" wherever they appear.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", time_scale: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._file = None
+        self._recorded: Dict[tuple, deque] = {}
+        if mode == "record":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, "w", encoding="utf-8")
+            self._file.write(json.dumps({"cassette": 1, "created": datetime.now().isoformat(timespec="seconds")}) + "\n")
+        else:
+            with open(path, encoding="utf-8") as f:
+                interactions = [json.loads(line) for line in f if line.strip()]
+            for interaction in sorted((i for i in interactions if "request" in i), key=lambda i: i["seq"]):
+                self._recorded.setdefault(tuple(interaction["key"]), deque()).append(interaction)
+
+    def adapter(self, **kwargs) -> BaseAdapter:
+        """Transport adapter for a session: a recording HTTPAdapter built with kwargs, or a replaying one."""
+        return _RecordingAdapter(self, **kwargs) if self.mode == "record" else _ReplayAdapter(self)
+
+    @property
+    def remaining(self) -> int:
+        """Recorded exchanges not replayed yet."""
+        with self._lock:
+            return sum(len(queue) for queue in self._recorded.values())
+
+    def _next_sequence(self) -> int:
+        with self._lock:
+            self._sequence += 1
+            return self._sequence
+
+    def _write(self, interaction: Dict[str, Any]):
+        _cassette_redact_body(interaction)
+        line = json.dumps(interaction) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+    def _next(self, request: requests.PreparedRequest) -> Dict[str, Any]:
+        """The recorded response to replay for request, or raise CassetteMissError."""
+        key = _cassette_key(request.method, request.url, request.headers)
+        with self._lock:
+            queue = self._recorded.get(key)
+            interaction = queue.popleft() if queue else None
+        if interaction is None:
+            raise CassetteMissError(f"No recorded response left for {request.method} {key[1]}", request=request)
+        return interaction["response"]
+
+    def _replay(self, request: requests.PreparedRequest, adapter: BaseAdapter) -> requests.Response:
+        recorded = self._next(request)
+        if self.time_scale:
+            time.sleep(recorded["headers_at"] * self.time_scale)
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = _ReplayBody(recorded["chunks"], recorded["error"], recorded["headers_at"], self.time_scale)
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class ClientMetrics:
+    """Thread-safe counters and accumulated durations describing what a client did."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+
+    def increment(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get(self, name: str, default: float = 0) -> float:
+        with self._lock:
+            return self.counters.get(name, default)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Copy of every counter, safe to read while requests are in flight."""
+        with self._lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+
+class ReasoningPreference:
+    """Last advanced-reasoning value the server confirmed for this account, as seen by one client.
+
+    The preference is account-wide, so set_advanced_reasoning holds the client's lock while it
+    compares and PATCHes, and completions hold the client's ReasoningGate until their answer is
+    read. Setting the value it already has is skipped and counted in metrics.
+    """
+
+    def __init__(self, metrics: ClientMetrics):
+        self.metrics = metrics
+        self.confirmed: Optional[bool] = None  # None until a PATCH succeeds
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    def is_current(self, enabled: bool) -> bool:
+        """True (and recorded as a skipped PATCH) when enabled is already the confirmed value."""
+        if self.confirmed is None or self.confirmed != enabled:
+            return False
+        patches = self.metrics.get("preference_patches")
+        self.metrics.increment("preference_patches_skipped")
+        if patches:
+            # Credit the skipped call with the mean duration of the PATCHes actually sent
+            self.metrics.increment("preference_seconds_saved",
+                                   self.metrics.get("preference_patch_seconds") / patches)
+        return True
+
+    def confirm(self, enabled: Optional[bool], result: Optional[Dict[str, Any]], elapsed: float):
+        """Record the outcome of a PATCH; enabled=None marks the server state as unknown after a failure."""
+        self.confirmed = enabled
+        self.last_result = result
+        self.metrics.increment("preference_patches")
+        self.metrics.increment("preference_patch_seconds", elapsed)
+
+class ReasoningGate:
+    """Keeps messages that need different advanced-reasoning values from running at the same time.
+
+    The preference is account-wide, so a message holds the gate from applying its value until the
+    server has accepted the message, and releases it before any of the answer is read (hold
+    yields the function doing so). Messages wanting the same value share the gate; one wanting
+    the other value waits for them, and once it waits, later arrivals queue behind it. Nothing
+    holds the gate while a stream's consumer runs, so abandoned or interleaved streams never
+    keep it.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._value: Optional[bool] = None
+        self._holders = 0
+        self._waiting = {True: 0, False: 0}
+
+    def _admits(self, enabled: bool) -> bool:
+        return self._holders == 0 or (self._value == enabled and not self._waiting[not enabled])
+
+    @contextmanager
+    def hold(self, enabled: bool):
+        enabled = bool(enabled)
+        with self._condition:
+            self._waiting[enabled] += 1
+            try:
+                self._condition.wait_for(lambda: self._admits(enabled))
+            finally:
+                self._waiting[enabled] -= 1
+            self._value = enabled
+            self._holders += 1
+        released = False
+
+        def release():
+            nonlocal released
+            with self._condition:
+                if not released:
+                    released = True
+                    self._holders -= 1
+                    self._condition.notify_all()
+
+        try:
+            yield release
+        finally:
+            release()
+
+class AsyncReasoningGate(ReasoningGate):
+    """ReasoningGate for tasks on one event loop."""
+
+    def __init__(self):
+        super().__init__()
+        self._condition = None  # Created on first use, inside the running loop
+
+    @asynccontextmanager
+    async def hold(self, enabled: bool):
+        enabled = bool(enabled)
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            self._waiting[enabled] += 1
+            try:
+                await self._condition.wait_for(lambda: self._admits(enabled))
+            finally:
+                self._waiting[enabled] -= 1
+            self._value = enabled
+            self._holders += 1
+        released = False
+
+        async def release():
+            nonlocal released
+            async with self._condition:
+                if not released:
+                    released = True
+                    self._holders -= 1
+                    self._condition.notify_all()
+
+        try:
+            yield release
+        finally:
+            await release()
+
+class UploadIndex:
+    """Local on-disk map from each server filename to the content hash and size uploaded under it.
+
+    A per-path (size, mtime) record lets unchanged files skip re-hashing entirely. Uploads are
+    saved as they are recorded; new digests are saved at most every save_interval seconds
+    and on flush(), since losing one only costs hashing that file again.
+    """
+
+    def __init__(self, path: Optional[str] = None, save_interval: float = 5.0):
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "julius", "upload_index.json")
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._entries = {"uploads": {}, "by_path": {}}
+        self._dirty = False
+        self._saved_at = 0.0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                self._entries["uploads"].update(data.get("uploads", {}))
+                self._entries["by_path"].update(data.get("by_path", {}))
+            except (OSError, ValueError):
+                pass  # A corrupt index only costs re-uploads
+
+    def content_hash(self, file_path: str) -> str:
+        """Return the SHA-256 of a file, reusing the stored digest when size and mtime are unchanged."""
+        abs_path = os.path.abspath(file_path)
+        stat = os.stat(abs_path)
+        with self._lock:
+            known = self._entries["by_path"].get(abs_path)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+        digest = hashlib.sha256()
+        with open(abs_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+
+        with self._lock:
+            self._entries["by_path"][abs_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": sha256
+            }
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= self.save_interval:
+                self._save()
+        return sha256
+
+    def lookup(self, sha256: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Return the recorded upload ({filename, size}) when filename holds exactly this content."""
+        with self._lock:
+            entry = self._entries["uploads"].get(filename)
+        if entry is None or entry["sha256"] != sha256:
+            return None
+        return {"filename": filename, "size": entry["size"]}
+
+    def record(self, sha256: str, filename: str, size: int):
+        """Record that the given content now lives on the server under filename."""
+        with self._lock:
+            # Uploading new bytes under an existing name replaces the old server file
+            self._entries["uploads"][filename] = {"sha256": sha256, "size": size}
+            self._save()
+
+    def forget(self, filename: str):
+        """Drop a server filename that no longer exists."""
+        with self._lock:
+            if self._entries["uploads"].pop(filename, None) is not None:
+                self._save()
+
+    def flush(self):
+        """Persist digests not yet saved."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        """Atomically persist the index; callers must hold the lock."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+class HubFileIndex:
+    """In-memory index of the account's hub files by name, re-listed once ttl_seconds have passed.
+
+    Re-listing is conditional (If-None-Match / If-Modified-Since) when the server sent an ETag or
+    Last-Modified. Files uploaded through the client are tracked separately until a listing
+    includes them, and both has() and files() see them straight away.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_lock = threading.Lock()  # Held by the one caller re-listing
+        self._lock = threading.Lock()
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._local: Dict[str, tuple] = {}  # Name -> (entry, added_at) for our uploads not yet listed
+        self._listed_at: Optional[float] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+    def is_fresh(self) -> bool:
+        with self._lock:
+            return self._listed_at is not None and time.monotonic() - self._listed_at < self.ttl_seconds
+
+    def listed_since(self, moment: float) -> bool:
+        """Whether a listing (or revalidation) completed after moment (time.monotonic())."""
+        with self._lock:
+            return self._listed_at is not None and self._listed_at > moment
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating the current listing."""
+        with self._lock:
+            if self._listed_at is None:
+                return {}
+            headers = {}
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+            return headers
+
+    def replace(self, files: List[Dict[str, Any]], etag: Optional[str], last_modified: Optional[str],
+                requested_at: float):
+        """Install a full listing fetched by a request sent at requested_at (time.monotonic())."""
+        by_name = {}
+        for entry in files:
+            name = _hub_file_name(entry)
+            if name:
+                by_name[name] = entry
+        with self._lock:
+            # Keep our own uploads the listing request may have raced with
+            self._local = {name: local for name, local in self._local.items()
+                           if name not in by_name and local[1] >= requested_at}
+            self._files = by_name
+            self.etag, self.last_modified = etag, last_modified
+            self._listed_at = time.monotonic()
+
+    def revalidated(self):
+        """The server confirmed the listing is unchanged (304)."""
+        with self._lock:
+            self._listed_at = time.monotonic()
+
+    def add(self, filename: str, size: Optional[int] = None):
+        """Record a file this client just uploaded, until a listing includes it."""
+        with self._lock:
+            self._local[filename] = ({"name": filename, "size": size}, time.monotonic())
+
+    def remove(self, filename: str):
+        with self._lock:
+            self._files.pop(filename, None)
+            self._local.pop(filename, None)
+
+    def invalidate(self):
+        """Force the next lookup to re-list."""
+        with self._lock:
+            self._listed_at = None
+
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        """The listed entry for filename, else the local record of our own upload of it."""
+        with self._lock:
+            entry = self._files.get(filename)
+            if entry is None and filename in self._local:
+                entry = self._local[filename][0]
+            return entry
+
+    def has(self, filename: str, size: Optional[int] = None) -> bool:
+        """Whether filename is listed or was uploaded by this client (and matches size when both are known)."""
+        entry = self.get(filename)
+        if entry is None:
+            return False
+        listed_size = _hub_file_size(entry)
+        return size is None or listed_size is None or listed_size == size
+
+    def files(self) -> List[Dict[str, Any]]:
+        """The server's entries from the latest listing, then this client's uploads it does not include yet."""
+        with self._lock:
+            return list(self._files.values()) + [entry for entry, _ in self._local.values()]
+
+@dataclass
+class UploadConfig:
+    """Settings for chunked, resumable uploads of large files."""
+    multipart_threshold: int = 64 * 1024 * 1024  # Files at least this large are sent in parts
+    part_size: int = 8 * 1024 * 1024  # Must be a multiple of 256 KiB for resumable storage sessions
+    part_retries: int = 5
+    manifest_dir: Optional[str] = None  # Defaults to ~/.cache/julius/resumable
+
+class UploadManifest:
+    """Local record of in-flight resumable uploads so a crashed upload continues from its last part."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".cache", "julius", "resumable")
+
+    @staticmethod
+    def key_for(file_path: str) -> str:
+        """Identify an upload by path, size and mtime so a modified file never resumes a stale session."""
+        stat = os.stat(file_path)
+        identity = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: str, state: Dict[str, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path(key))
+
+    def clear(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+@dataclass
+class TranscodeConfig:
+    """Settings for converting large CSV/XLSX files into a compact format before upload."""
+    format: str = "csv.gz"  # "csv.gz", or "parquet" (needs pyarrow, and a backend that preprocesses parquet)
+    min_size: int = 1024 * 1024  # Smaller files are sent as they are unless columns or a sheet are selected
+    compresslevel: int = 6
+    max_workers: int = min(4, os.cpu_count() or 1)  # Conversion processes; 1 converts in the calling thread
+    cache_dir: Optional[str] = None  # Defaults to ~/.cache/julius/transcoded
+    cache_ttl_seconds: float = 30 * 24 * 3600  # Conversions unused for this long are removed
+    cache_max_bytes: int = 4 * 1024 * 1024 * 1024  # Least recently used conversions are removed beyond this
+
+TRANSCODABLE_EXTENSIONS = (".csv", ".xlsx")
+
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_XLSX_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}  # Built-in number formats that display dates/times
+
+def _xlsx_sheet_parts(archive: zipfile.ZipFile) -> Dict[str, str]:
+    """Sheet name -> worksheet part inside the archive, in workbook order."""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    relationships = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in relationships}
+    parts = {}
+    for sheet in workbook.iter(f"{_XLSX_NS}sheet"):
+        target = targets[sheet.get(_XLSX_REL_ID)]
+        parts[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    return parts
+
+def _xlsx_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    for _, element in ElementTree.iterparse(archive.open("xl/sharedStrings.xml")):
+        if element.tag == f"{_XLSX_NS}si":
+            # Plain <t>, or rich-text runs <r><t>; phonetic hints (<rPh>) are not part of the value
+            strings.append("".join(
+                (child.text if child.tag == f"{_XLSX_NS}t" else child.findtext(f"{_XLSX_NS}t")) or ""
+                for child in element if child.tag in (f"{_XLSX_NS}t", f"{_XLSX_NS}r")
+            ))
+            element.clear()
+    return strings
+
+def _xlsx_date_styles(archive: zipfile.ZipFile) -> set:
+    """Indexes of cell styles whose number format shows a date or time."""
+    if "xl/styles.xml" not in archive.namelist():
+        return set()
+    styles = ElementTree.fromstring(archive.read("xl/styles.xml"))
+    date_formats = set(_XLSX_DATE_FORMATS)
+    for number_format in styles.iter(f"{_XLSX_NS}numFmt"):
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', "", number_format.get("formatCode", "").lower())
+        if re.search(r"[dmyhs]", code):
+            date_formats.add(int(number_format.get("numFmtId")))
+    cell_formats = styles.find(f"{_XLSX_NS}cellXfs")
+    if cell_formats is None:
+        return set()
+    return {index for index, xf in enumerate(cell_formats) if int(xf.get("numFmtId", 0)) in date_formats}
+
+def _xlsx_number(text: str, is_date: bool) -> str:
+    value = float(text)
+    if is_date:
+        moment = datetime(1899, 12, 30) + timedelta(days=value)
+        return moment.date().isoformat() if value.is_integer() else moment.isoformat(sep=" ")
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else text
+
+def _xlsx_column(reference: str) -> int:
+    """Zero-based column of a cell reference such as "AB12"."""
+    column = 0
+    for letter in reference:
+        if not letter.isalpha():
+            break
+        column = column * 26 + ord(letter.upper()) - 64
+    return column - 1
+
+def _xlsx_rows(file_path: str, sheet: Optional[str] = None) -> Iterator[List[str]]:
+    """Stream the cell values of one worksheet (the first when sheet is None) as rows of strings."""
+    with zipfile.ZipFile(file_path) as archive:
+        parts = _xlsx_sheet_parts(archive)
+        if sheet is None:
+            sheet = next(iter(parts))
+        if sheet not in parts:
+            raise Exception(f"Sheet {sheet!r} not found; the workbook has {list(parts)}")
+        strings = _xlsx_shared_strings(archive)
+        date_styles = _xlsx_date_styles(archive)
+
+        row: Dict[int, str] = {}
+        for _, element in ElementTree.iterparse(archive.open(parts[sheet])):
+            if element.tag == f"{_XLSX_NS}c":
+                reference = element.get("r")
+                column = _xlsx_column(reference) if reference else (max(row) + 1 if row else 0)
+                cell_type = element.get("t", "n")
+                value = element.findtext(f"{_XLSX_NS}v")
+                if cell_type == "s" and value is not None:
+                    value = strings[int(value)]
+                elif cell_type == "inlineStr":
+                    value = "".join(t.text or "" for t in element.iter(f"{_XLSX_NS}t"))
+                elif cell_type == "b" and value is not None:
+                    value = "TRUE" if value == "1" else "FALSE"
+                elif cell_type == "n" and value:
+                    value = _xlsx_number(value, int(element.get("s", 0)) in date_styles)
+                if value is not None:
+                    row[column] = value
+            elif element.tag == f"{_XLSX_NS}row":
+                yield [row.get(i, "") for i in range(max(row) + 1)] if row else []
+                row = {}
+                element.clear()
+
+def _select_columns(rows: Iterator[List[str]], columns: Optional[List[str]]) -> Iterator[List[str]]:
+    """Keep only the named columns, matched against the header row, in the requested order."""
+    if not columns:
+        yield from rows
+        return
+    header = next(rows, [])
+    missing = [name for name in columns if name not in header]
+    if missing:
+        raise Exception(f"Columns not found: {missing}")
+    indexes = [header.index(name) for name in columns]
+    yield columns
+    for row in rows:
+        yield [row[i] if i < len(row) else "" for i in indexes]
+
+def _transcode_file(source: str, target: str, target_format: str, columns: Optional[List[str]],
+                    sheet: Optional[str], compresslevel: int) -> str:
+    """Convert one CSV/XLSX file; runs in a worker process. Writes target atomically and returns it."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    is_csv = source.lower().endswith(".csv")
+    try:
+        if target_format == "parquet":
+            from pyarrow import csv as pa_csv, parquet
+            csv_source = source
+            if not is_csv:
+                csv_source = f"{tmp_path}.csv"
+                with open(csv_source, 'w', newline='', encoding='utf-8') as f:
+                    csv.writer(f).writerows(_select_columns(_xlsx_rows(source, sheet), columns))
+                columns = None
+            reader = pa_csv.open_csv(
+                csv_source, convert_options=pa_csv.ConvertOptions(include_columns=columns or [])
+            )
+            with parquet.ParquetWriter(tmp_path, reader.schema, compression="zstd") as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+            if csv_source != source:
+                os.remove(csv_source)
+        else:
+            with open(tmp_path, 'wb') as raw, gzip.GzipFile(
+                filename=os.path.basename(target)[:-3], mode='wb', fileobj=raw,
+                compresslevel=compresslevel, mtime=0  # mtime=0 keeps the output byte-identical across runs
+            ) as compressed:
+                if is_csv and not columns:
+                    with open(source, 'rb') as f:
+                        shutil.copyfileobj(f, compressed, 1024 * 1024)
+                else:
+                    if is_csv:
+                        source_file = open(source, newline='', encoding='utf-8-sig')
+                        rows = csv.reader(source_file)
+                    else:
+                        source_file = None
+                        rows = _xlsx_rows(source, sheet)
+                    try:
+                        text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+                        csv.writer(text).writerows(_select_columns(rows, columns))
+                        text.flush()
+                        text.detach()
+                    finally:
+                        if source_file is not None:
+                            source_file.close()
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+class Transcoder:
+    """Pre-upload stage turning large CSV/XLSX files into compressed CSV or parquet.
+
+    Conversions run in a process pool and are cached by source content hash and options, so
+    an unchanged file is only converted once; the cache is bounded by TTL and size like
+    ResponseCache. Only the requested columns, or one sheet of a workbook, can be kept to cut
+    upload bytes and server-side preprocessing further.
+    """
+
+    def __init__(self, config: TranscodeConfig, content_hash: Callable[[str], str], metrics: ClientMetrics):
+        if config.format not in ("csv.gz", "parquet"):
+            raise Exception(f"Unsupported transcode format: {config.format}")
+        if config.format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise Exception("Transcoding to parquet needs pyarrow (pip install pyarrow)")
+        self.config = config
+        self.content_hash = content_hash
+        self.metrics = metrics
+        self.cache_dir = config.cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "julius", "transcoded")
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def pool(self) -> "ProcessPoolExecutor":
+        # Loads multiprocessing; only transcoding needs it
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with self._pool_lock:
+            if self._pool is None:
+                # Created from upload threads, where forking a multithreaded process can deadlock
+                self._pool = ProcessPoolExecutor(max_workers=self.config.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _target(self, file_path: str, columns: Optional[List[str]], sheet: Optional[str]) -> Optional[str]:
+        """Cached output path for a file, or None if the file is sent as it is."""
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension not in TRANSCODABLE_EXTENSIONS:
+            if columns or sheet:
+                raise Exception(f"Only {', '.join(TRANSCODABLE_EXTENSIONS)} files can be trimmed: {file_path}")
+            return None
+        if not (columns or sheet) and os.path.getsize(file_path) < self.config.min_size:
+            return None
+        if extension == ".xlsx" and sheet is None:
+            with zipfile.ZipFile(file_path) as archive:
+                if len(_xlsx_sheet_parts(archive)) > 1:
+                    return None  # Several sheets cannot become one CSV; send the workbook unless one is chosen
+        options = json.dumps({"source": self.content_hash(file_path), "format": self.config.format,
+                              "columns": columns, "sheet": sheet, "level": self.config.compresslevel})
+        key = hashlib.sha256(options.encode('utf-8')).hexdigest()
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self.cache_dir, key, f"{stem}.{self.config.format}")
+
+    def prepare(self, file_path: str, columns: Optional[List[str]] = None, sheet: Optional[str] = None) -> str:
+        """Return the path to upload for file_path: a converted copy, or the file itself."""
+        return self.prepare_many([file_path], columns, sheet)[0]
+
+    def prepare_many(self, file_paths: List[str], columns: Optional[List[str]] = None,
+                     sheet: Optional[str] = None) -> List[str]:
+        """Convert several files in parallel worker processes; cached conversions are reused."""
+        targets = [self._target(path, columns, sheet) for path in file_paths]
+        pending = {}
+        for path, target in zip(file_paths, targets):
+            if target is None or target in pending:
+                continue
+            if os.path.exists(target):
+                try:
+                    os.utime(target)  # Mark as recently used for LRU eviction
+                except OSError:
+                    pass
+                self.metrics.increment("transcode_cache_hits")
+                continue
+            args = (path, target, self.config.format, columns, sheet, self.config.compresslevel)
+            pending[target] = self.pool.submit(_transcode_file, *args) if self.config.max_workers > 1 else args
+
+        for path, target in zip(file_paths, targets):
+            job = pending.pop(target, None)
+            if job is None:
+                continue
+            try:
+                job.result() if isinstance(job, Future) else _transcode_file(*job)
+            except Exception as e:
+                raise Exception(f"Error transcoding {path}: {str(e)}")
+            self.metrics.increment("transcoded_files")
+            self.metrics.increment("transcode_bytes_in", os.path.getsize(path))
+            self.metrics.increment("transcode_bytes_out", os.path.getsize(target))
+        if any(targets):
+            self._evict(keep={target for target in targets if target})
+        return [target or path for path, target in zip(file_paths, targets)]
+
+    def _evict(self, keep: set):
+        """Drop conversions unused for cache_ttl_seconds, then least recently used ones beyond cache_max_bytes."""
+        entries = []
+        total = 0
+        now = time.time()
+        with self._cache_lock:
+            for key in os.listdir(self.cache_dir):
+                entry_path = os.path.join(self.cache_dir, key)
+                try:
+                    names = os.listdir(entry_path)
+                    last_used = max(os.path.getmtime(os.path.join(entry_path, name)) for name in names)
+                    size = sum(os.path.getsize(os.path.join(entry_path, name)) for name in names)
+                except (OSError, ValueError):
+                    continue  # Removed concurrently, or empty
+                if any(os.path.join(entry_path, name) in keep or name.endswith(".tmp") for name in names):
+                    total += size  # About to be uploaded by this call, or being written by another: never evicted
+                    continue
+                if now - last_used > self.config.cache_ttl_seconds:
+                    shutil.rmtree(entry_path, ignore_errors=True)
+                    continue
+                entries.append((last_used, size, entry_path))
+                total += size
+
+            for _, size, entry_path in sorted(entries):
+                if total <= self.config.cache_max_bytes:
+                    break
+                shutil.rmtree(entry_path, ignore_errors=True)
+                total -= size
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+def _renamed_references(content: str, renames: Dict[str, str]) -> str:
+    """content with each mention of a source filename replaced by the name it was uploaded under."""
+    for name, uploaded in renames.items():
+        # Whole names only, so x.csv is not matched inside x.csv.gz
+        content = re.sub(rf"(?<![\w.]){re.escape(name)}(?!\w|\.\w)", lambda match: uploaded, content)
+    return content
+
+def _upload_mime_type(file_path: str) -> str:
+    """Content type for an upload; compressed files are sent as such rather than as their inner type."""
+    mime_type, encoding = mimetypes.guess_type(file_path)
+    if encoding == "gzip":
+        return "application/gzip"
+    if file_path.lower().endswith(".parquet"):
+        return "application/vnd.apache.parquet"
+    return mime_type or 'application/octet-stream'
+
+class _ProgressReader:
+    """File wrapper that reports how many bytes requests has read from it."""
+
+    def __init__(self, f: BinaryIO, total: int, on_read):
+        self._f = f
+        self._total = total
+        self._sent = 0
+        self._on_read = on_read
+
+    def __len__(self) -> int:
+        return self._total
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        if data:
+            self._sent += len(data)
+            self._on_read(self._sent)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """Rewind before the transport re-sends the body."""
+        position = self._f.seek(offset, whence)
+        self._sent = position
+        return position
+
+def _committed_offset(range_header: Optional[str]) -> int:
+    """Turn a resumable session's `Range: bytes=0-N` header into the next offset to send."""
+    if not range_header or '-' not in range_header:
+        return 0
+    return int(range_header.rsplit('-', 1)[1]) + 1
+
+def _hub_file_name(entry: Dict[str, Any]) -> Optional[str]:
+    """Extract the filename from a hub listing entry."""
+    for key in ("name", "filename", "file_name", "fileName"):
+        if entry.get(key):
+            return entry[key]
+    return None
+
+def _hub_file_size(entry: Dict[str, Any]) -> Optional[int]:
+    """Extract the size in bytes from a hub listing entry, if the listing reports one."""
+    for key in ("size", "file_size", "fileSize"):
+        if isinstance(entry.get(key), int):
+            return entry[key]
+    return None
+
+class Files:
+    def __init__(self, client):
+        self.client = client
+        self.uploaded_as: Dict[str, str] = {}  # Absolute source path -> server filename, for transcoded files
+
+    def _record_name(self, source: str, file_path: str, filename: str) -> str:
+        """Remember the server filename of a source that was transcoded, and so uploaded under another name."""
+        if file_path != source:
+            self.uploaded_as[os.path.abspath(source)] = filename
+        return filename
+
+    def renames(self, file_paths: List[str]) -> Dict[str, str]:
+        """Source filename -> server filename for those of file_paths uploaded under another name."""
+        return {os.path.basename(path): self.uploaded_as[os.path.abspath(path)]
+                for path in file_paths if os.path.abspath(path) in self.uploaded_as}
+
+    def _report_progress(self, filename: str, bytes_sent: int, total_bytes: int, progress=None):
+        """Forward upload progress to the caller's progress(filename, sent, total) callback."""
+        if progress:
+            progress(filename, bytes_sent, total_bytes)
+
+    def _find_duplicate(self, file_path: str) -> tuple[Optional[str], Optional[Dict]]:
+        """Hash a file and return (sha256, previous upload of it under the same name) when dedupe is enabled.
+
+        Identical bytes under another name are uploaded again, so prompts can refer to the name given.
+        """
+        if self.client.upload_index is None:
+            return None, None
+        sha256 = self.client.upload_index.content_hash(file_path)
+        return sha256, self.client.upload_index.lookup(sha256, self._normalize_filename(os.path.basename(file_path)))
+
+    def _normalize_filename(self, filename: str) -> str:
+        """Normalize filename to match server's format."""
+        return ' '.join(word for word in filename.split() if word)
+
+    def get_signed_url(self, filename: str, mime_type: str) -> Dict:
+        """Get signed URL for file upload."""
+        try:
+            normalized_filename = self._normalize_filename(filename)
+            payload = {
+                "filename": normalized_filename,
+                "mimeType": mime_type
+            }
+            
+            response = self.client.transport.post(
+                f"{self.client.base_url}/files/signed_url",
+                headers=self.client.headers,
+                json=payload
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            if 'signedUrl' not in data:
+                raise Exception(f"No signed URL in response: {data}")
+                
+            return data
+            
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error getting signed URL: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Error in signed URL request: {str(e)}")
+
+    def preprocess_file(self, filename: str) -> Dict:
+        """Preprocess uploaded file with response validation."""
+        try:
+            normalized_filename = self._normalize_filename(filename)
+            payload = {
+                "filename": normalized_filename,
+                "conversationId": None,
+                "analyze": True
+            }
+            
+            response = self.client.transport.post(
+                f"{self.client.base_url}/files/preprocess_file",
+                headers=self.client.headers,
+                json=payload
+            )
+            
+            response_data = response.json()
+            
+            if not response_data.get('success'):
+                raise Exception("Preprocess response indicates failure")
+                
+            if not response_data.get('res', {}).get('success'):
+                raise Exception("Preprocess result indicates failure")
+            
+            return response_data
+            
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error preprocessing file: {str(e)}")
+
+    def list_files(self, refresh: bool = False) -> List[Dict]:
+        """List all uploaded files, from the client's hub index unless it is stale or refresh is set.
+
+        With refresh, a listing another caller completed while this one waited for it is reused.
+        """
+        index = self.client.hub_index
+        try:
+            if refresh or not index.is_fresh():
+                requested_at = time.monotonic()
+                with index.refresh_lock:
+                    if (refresh and not index.listed_since(requested_at)) or not index.is_fresh():
+                        self._fetch_listing(index)
+            return index.files()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error listing files: {str(e)}")
+
+    def _fetch_listing(self, index: HubFileIndex):
+        """Re-list the hub into index, revalidating instead of downloading when the server allows it."""
+        requested_at = time.monotonic()
+        response = self.client.transport.get(
+            f"{self.client.base_url}/hub/v2/list_hub_files",
+            headers={**self.client.headers, **index.validators()}
+        )
+        if response.status_code == 304:
+            index.revalidated()
+            return
+        response.raise_for_status()
+        data = response.json()
+
+        if not isinstance(data.get('files'), list):
+            raise Exception(f"Invalid response from list files endpoint: {data}")
+
+        index.replace(data['files'], response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                      requested_at)
+
+    def exists(self, filename: str, size: Optional[int] = None, refresh: bool = False) -> bool:
+        """Whether the hub has filename (normalized like uploads are), with this size when both are known.
+
+        A listing up to ttl_seconds old is trusted when it has the file; one that does not is
+        revalidated first, since the file may have been uploaded after it. refresh always revalidates.
+        """
+        index = self.client.hub_index
+        filename = self._normalize_filename(filename)
+        requested_at = time.monotonic()
+        self.list_files(refresh=refresh)
+        if index.has(filename, size) or index.listed_since(requested_at):
+            return index.has(filename, size)
+        self.list_files(refresh=True)
+        return index.has(filename, size)
+
+    def _transcoded(self, file_path: str, columns: Optional[List[str]] = None, sheet: Optional[str] = None) -> str:
+        """Path to upload for file_path: the client's transcoded copy when transcoding applies."""
+        if self.client.transcoder is None:
+            if columns or sheet:
+                raise Exception("Selecting columns or a sheet needs a client created with transcode=TranscodeConfig()")
+            return file_path
+        return self.client.transcoder.prepare(file_path, columns, sheet)
+
+    def upload(self, file_path: str, dedupe: bool = True, progress=None,
+               columns: Optional[List[str]] = None, sheet: Optional[str] = None) -> str:
+        """Upload a file to Julius and return filename, skipping bytes the server already has.
+
+        progress, if given, is called as progress(filename, bytes_sent, total_bytes). Files larger
+        than UploadConfig.multipart_threshold are sent in independently retried, resumable parts.
+        With a transcoding client, large CSV/XLSX files are converted first; columns and sheet
+        keep only those columns, or that sheet of a workbook.
+        """
+        try:
+            if not os.path.exists(file_path):
+                raise Exception(f"File not found: {file_path}")
+            source = file_path
+            file_path = self._transcoded(file_path, columns, sheet)
+
+            sha256, previous = self._find_duplicate(file_path) if dedupe else (None, None)
+            if previous:
+                if self.exists(previous["filename"], previous["size"]):
+                    return self._record_name(source, file_path, previous["filename"])
+                self.client.upload_index.forget(previous["filename"])
+                
+            original_filename = os.path.basename(file_path)
+            normalized_filename = self._normalize_filename(original_filename)
+            mime_type = _upload_mime_type(file_path)
+
+            signed_url_response = self.get_signed_url(normalized_filename, mime_type)
+            upload_url = signed_url_response.get('signedUrl')
+            
+            if not upload_url:
+                raise Exception("No signed URL in response")
+
+            self._put_file(upload_url, file_path, mime_type, normalized_filename, progress)
+
+            preprocess_response = self.preprocess_file(normalized_filename)
+            if not preprocess_response.get('success'):
+                raise Exception("File preprocessing failed")
+
+            if sha256:
+                self.client.upload_index.record(sha256, normalized_filename, os.path.getsize(file_path))
+            self.client.hub_index.add(normalized_filename, os.path.getsize(file_path))
+                
+            return self._record_name(source, file_path, normalized_filename)
+
+        except Exception as e:
+            raise Exception(f"Error in file upload process: {str(e)}")
+
+    def _put_file(self, upload_url: str, file_path: str, mime_type: str, filename: str, progress=None):
+        """Send a file to its signed URL, in resumable parts when it is large enough."""
+        size = os.path.getsize(file_path)
+        self._report_progress(filename, 0, size, progress)
+
+        if size >= self.client.upload_config.multipart_threshold:
+            if self._resumable_put(upload_url, file_path, mime_type, filename, size, progress):
+                return
+
+        with open(file_path, 'rb') as f:
+            reader = _ProgressReader(f, size, lambda sent: self._report_progress(filename, sent, size, progress))
+            upload_response = self.client.transport.put(
+                upload_url,
+                data=reader,
+                headers={'Content-Type': mime_type},
+                storage=True
+            )
+            upload_response.raise_for_status()
+        self._report_progress(filename, size, size, progress)
+
+    def _resumable_put(self, upload_url: str, file_path: str, mime_type: str, filename: str,
+                       size: int, progress=None) -> bool:
+        """Upload through a resumable storage session; return False if the signed URL does not allow one."""
+        config = self.client.upload_config
+        manifest = self.client.upload_manifest
+        key = manifest.key_for(file_path)
+
+        state = manifest.load(key)
+        offset = None
+        if state:
+            offset = self._query_resumable_offset(state["session_url"], size)
+        if offset is None:
+            response = self.client.transport.post(
+                upload_url,
+                headers={'Content-Type': mime_type, 'x-goog-resumable': 'start'},
+                storage=True
+            )
+            if response.status_code not in (200, 201) or 'Location' not in response.headers:
+                return False
+            state = {"session_url": response.headers['Location'], "filename": filename, "size": size}
+            manifest.save(key, state)
+            offset = 0
+
+        with open(file_path, 'rb') as f:
+            while offset < size:
+                self._report_progress(filename, offset, size, progress)
+                f.seek(offset)
+                part = f.read(config.part_size)
+                offset = self._put_part(state["session_url"], part, offset, size)
+                state["offset"] = offset
+                manifest.save(key, state)
+
+        manifest.clear(key)
+        self._report_progress(filename, size, size, progress)
+        return True
+
+    def _put_part(self, session_url: str, part: bytes, start: int, size: int) -> int:
+        """Send one part, retrying it independently, and return the offset the server has committed."""
+        end = start + len(part) - 1
+        retries = self.client.upload_config.part_retries
+        last_error = None
+        for attempt in range(retries):
+            try:
+                response = self.client.transport.put(
+                    session_url,
+                    data=part,
+                    headers={'Content-Range': f"bytes {start}-{end}/{size}"},
+                    storage=True
+                )
+                if response.status_code in (200, 201):
+                    return size
+                if response.status_code == 308:
+                    return _committed_offset(response.headers.get('Range'))
+                if response.status_code < 500 and response.status_code != 429:
+                    response.raise_for_status()
+                last_error = f"HTTP {response.status_code}"
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                last_error = str(e)
+
+            time.sleep(self.client.retry_policy.delay(attempt))
+            # The server may have kept some of the part before the failure
+            committed = self._query_resumable_offset(session_url, size)
+            if committed is not None and committed > start:
+                return committed
+        raise Exception(f"Upload of bytes {start}-{end} failed after {retries} attempts: {last_error}")
+
+    def _query_resumable_offset(self, session_url: str, size: int) -> Optional[int]:
+        """Ask a resumable session how many bytes it has; None if the session is gone."""
+        try:
+            response = self.client.transport.put(
+                session_url,
+                data=b"",
+                headers={'Content-Range': f"bytes */{size}"},
+                storage=True
+            )
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code == 308:
+            return _committed_offset(response.headers.get('Range'))
+        return None
+
+
+class UploadScheduler:
+    """Runs every upload of a completion on a bounded pool while the conversation is started.
+
+    Sources are registered as soon as both the upload and the conversation are ready, and
+    each message only waits for the files it attaches.
+    """
+
+    def __init__(self, files: Files, register, max_workers: int = 4):
+        self.files = files
+        self.register = register
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="julius-upload")
+        self._uploads: Dict[str, Future] = {}
+        self._registrations: Dict[str, Future] = {}
+
+    def submit(self, file_paths: List[str]):
+        """Start uploading every file not already scheduled."""
+        for file_path in file_paths:
+            if file_path not in self._uploads:
+                self._uploads[file_path] = self._executor.submit(_in_context(self.files.upload), file_path)
+
+    def bind(self, conversation_id: str):
+        """Register each upload as a conversation source once it completes."""
+        # Registration tasks are queued behind every upload, so they never delay one starting
+        for file_path in self._uploads:
+            self._registrations[file_path] = self._executor.submit(
+                _in_context(self._register_when_uploaded), conversation_id, file_path
+            )
+
+    def _register_when_uploaded(self, conversation_id: str, file_path: str) -> str:
+        filename = self._uploads[file_path].result()
+        self.register(conversation_id, filename)
+        return filename
+
+    def wait(self, file_paths: List[str]) -> List[str]:
+        """Block until the given files are uploaded and registered; return their server filenames."""
+        return [self._registrations[file_path].result() for file_path in file_paths]
+
+    def shutdown(self):
+        """Release the worker pool, dropping uploads nobody is waiting for anymore."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class ArtifactSink(ABC):
+    """Destination for the generated code, outputs and images of completions.
+
+    Each conversation writes through its own ArtifactScope, so concurrent calls on one client
+    never share file names or delete each other's artifacts.
+    """
+
+    def open(self, conversation_id: str, executor: Optional[ThreadPoolExecutor] = None) -> "ArtifactScope":
+        """Start the artifacts of a conversation; writes run on executor when one is given."""
+        return ArtifactScope(self, conversation_id, executor)
+
+    @abstractmethod
+    def locate(self, scope: "ArtifactScope", name: str) -> str:
+        """Return the location an artifact will be readable at, before its data is serialized."""
+
+    @abstractmethod
+    def store(self, scope: "ArtifactScope", name: str, location: str, data) -> Optional[str]:
+        """Persist data: bytes, or a callable or iterable of byte chunks (see _artifact_chunks).
+
+        Runs on the writer thread. May return where the data was actually stored, when that
+        differs from location.
+        """
+
+    @abstractmethod
+    def load(self, location: str) -> bytes:
+        """Read back an artifact stored at location."""
+
+    def finish(self, scope: "ArtifactScope"):
+        """Called once a scope's queued writes are done."""
+
+def _artifact_chunks(data) -> Iterator[bytes]:
+    """The bytes of artifact data given as bytes, a callable, or an iterable of byte chunks."""
+    data = data() if callable(data) else data
+    if isinstance(data, (bytes, bytearray)):
+        yield data
+    else:
+        yield from data
+
+def _atomic_write(path: str, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for piece in _artifact_chunks(data):
+            f.write(piece)
+    os.replace(tmp_path, path)
+
+class DirectorySink(ArtifactSink):
+    """Writes each conversation's artifacts to root/<conversation_id>/, or straight into root.
+
+    With retention_seconds, conversation directories under root not written to for that long
+    are removed (see prune) as later conversations finish, at most once a minute; root should
+    then hold nothing else. Without it, nothing is ever deleted.
+    """
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, root: str = "outputs", per_conversation: bool = True,
+                 retention_seconds: Optional[float] = None):
+        self.root = root
+        self.per_conversation = per_conversation
+        self.retention_seconds = retention_seconds
+        self._prune_lock = threading.Lock()
+        self._pruned_at: Optional[float] = None
+
+    def directory(self, scope: "ArtifactScope") -> str:
+        return os.path.join(self.root, scope.conversation_id) if self.per_conversation else self.root
+
+    def locate(self, scope: "ArtifactScope", name: str) -> str:
+        return os.path.join(self.directory(scope), name)
+
+    def store(self, scope: "ArtifactScope", name: str, location: str, data):
+        _atomic_write(location, data)
+
+    def load(self, location: str) -> bytes:
+        with open(location, 'rb') as f:
+            return f.read()
+
+    def finish(self, scope: "ArtifactScope"):
+        if self.retention_seconds is None or not self.per_conversation:
+            return
+        with self._prune_lock:
+            now = time.monotonic()
+            if self._pruned_at is not None and now - self._pruned_at < self.PRUNE_INTERVAL:
+                return
+            self._pruned_at = now
+        self.prune(keep=scope.conversation_id)
+
+    def prune(self, max_age: Optional[float] = None, keep: Optional[str] = None) -> int:
+        """Remove conversation directories under root last modified over max_age seconds ago
+        (retention_seconds by default), except keep; returns how many were removed."""
+        max_age = self.retention_seconds if max_age is None else max_age
+        if max_age is None or not self.per_conversation:
+            return 0
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.name == keep or not entry.is_dir(follow_symlinks=False):
+                    continue
+                if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    shutil.rmtree(entry.path)
+                    removed += 1
+            except OSError:
+                continue  # Removed or in use by another process; the next prune retries
+        return removed
+
+class MemorySink(ArtifactSink):
+    """Keeps artifacts in memory under memory://<conversation_id>/<name> locations; nothing touches disk."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.blobs: Dict[str, bytes] = {}
+
+    def locate(self, scope: "ArtifactScope", name: str) -> str:
+        return f"memory://{scope.conversation_id}/{name}"
+
+    def store(self, scope: "ArtifactScope", name: str, location: str, data):
+        data = b"".join(_artifact_chunks(data))
+        with self._lock:
+            self.blobs[location] = data
+
+    def load(self, location: str) -> bytes:
+        with self._lock:
+            return self.blobs[location]
+
+    def clear(self):
+        with self._lock:
+            self.blobs.clear()
+
+class ContentAddressedSink(ArtifactSink):
+    """Stores each distinct artifact once, at root/<sha256[:2]>/<sha256><ext>.
+
+    Artifacts are located by name at root/conversations/<conversation_id>/<name>, a hard link to
+    their blob made once the writer has hashed them, so data is serialized only once and never on
+    the stream path. A manifest mapping artifact names to blobs is written to
+    root/conversations/<conversation_id>.json.
+    """
+
+    def __init__(self, root: str = os.path.join("outputs", "objects")):
+        self.root = root
+
+    def locate(self, scope: "ArtifactScope", name: str) -> str:
+        return os.path.join(self.root, "conversations", scope.conversation_id, name)
+
+    def store(self, scope: "ArtifactScope", name: str, location: str, data) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f".{os.getpid()}.{threading.get_ident()}.tmp")
+        digest = hashlib.sha256()
+        with open(tmp_path, 'wb') as f:
+            for piece in _artifact_chunks(data):
+                digest.update(piece)
+                f.write(piece)
+        digest = digest.hexdigest()
+        blob = os.path.join(self.root, digest[:2], digest + os.path.splitext(name)[1])
+        if os.path.exists(blob):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(tmp_path, blob)
+
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        link_path = f"{location}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob, link_path)
+        except OSError:
+            shutil.copyfile(blob, link_path)  # No hard links on this filesystem
+        os.replace(link_path, location)
+        return blob
+
+    def load(self, location: str) -> bytes:
+        with open(location, 'rb') as f:
+            return f.read()
+
+    def finish(self, scope: "ArtifactScope"):
+        manifest = json.dumps(scope.stored(), indent=2, sort_keys=True).encode('utf-8')
+        _atomic_write(os.path.join(self.root, "conversations", f"{scope.conversation_id}.json"), manifest)
+
+class ArtifactScope:
+    """The artifacts of one conversation: code-block numbering and named writes queued off the stream path."""
+
+    def __init__(self, sink: ArtifactSink, conversation_id: str, executor: Optional[ThreadPoolExecutor] = None):
+        self.sink = sink
+        self.conversation_id = conversation_id
+        self.executor = executor
+        self.code_counter = 0
+        self._lock = threading.Lock()
+        self._locations: Dict[str, str] = {}
+        self._stored: Dict[str, str] = {}  # Name -> where the sink stored it, when not its location
+        self._pending: List[Future] = []
+
+    def next_code_number(self) -> int:
+        with self._lock:
+            self.code_counter += 1
+            return self.code_counter
+
+    def write(self, name: str, data: Union[bytes, Callable[[], Union[bytes, Iterator[bytes]]]]) -> str:
+        """Queue an artifact and return where it will be stored.
+
+        data may be a callable, returning bytes or an iterator of byte chunks, so that serialization
+        also happens on the writer thread.
+        """
+        location = self.sink.locate(self, name)
+        with self._lock:
+            self._locations[name] = location
+        if self.executor is None:
+            self._store(name, location, data)
+        else:
+            future = self.executor.submit(self._store, name, location, data)
+            with self._lock:
+                self._pending.append(future)
+        return location
+
+    def _store(self, name: str, location: str, data):
+        stored = self.sink.store(self, name, location, data)
+        if stored is not None:
+            with self._lock:
+                self._stored[name] = stored
+
+    def flush(self):
+        """Wait until every queued write has landed; raise the first write error."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        errors = []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise Exception(f"Error writing artifacts: {str(errors[0])}")
+        self.sink.finish(self)
+
+    def artifacts(self) -> Dict[str, str]:
+        """Artifact name -> location, in write order."""
+        with self._lock:
+            return dict(self._locations)
+
+    def stored(self) -> Dict[str, str]:
+        """Artifact name -> where the sink stored it: its location, unless the sink reported another."""
+        with self._lock:
+            return {name: self._stored.get(name, location) for name, location in self._locations.items()}
+
+    def read(self, name: str) -> bytes:
+        self.flush()
+        return self.sink.load(self.artifacts()[name])
+
+@dataclass
+class BatchResult:
+    """Ordered results of create_batch; failed items have None in results and their error in errors."""
+    results: List[Optional[JuliusResponse]]
+    errors: List[Optional[Exception]]
+    elapsed_seconds: float
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for result in self.results if result is not None)
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for error in self.errors if error is not None)
+
+    @property
+    def throughput(self) -> float:
+        """Completed items per second of wall-clock time."""
+        return self.succeeded / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+class ImageFetcher:
+    """Downloads and saves a message's images on the client's bounded pool while its stream is read."""
+
+    def __init__(self, completions: "ChatCompletions", scope: Optional[ArtifactScope] = None):
+        self.completions = completions
+        self.scope = scope
+        self._pending: List[Future] = []
+
+    def submit(self, img_id: str, url: str):
+        """Queue an image download without waiting for it."""
+        self._pending.append(self.completions.client.image_executor.submit(_in_context(self._fetch), img_id, url))
+
+    def _fetch(self, img_id: str, url: str) -> Optional[str]:
+        img_response = self.completions.client.transport.get(url, storage=True)
+        if img_response.status_code != 200:
+            return None
+        return self.completions._save_image(img_id, img_response.content, self.scope)
+
+    def join(self) -> List[str]:
+        """Wait for every queued image and return one status line per saved or failed image."""
+        results = []
+        for future in self._pending:
+            try:
+                save_path = future.result()
+                if save_path:
+                    results.append(f"Saved image as {save_path}")
+            except Exception as e:
+                results.append(f"Error saving image: {str(e)}")
+        self._pending = []
+        return results
+
+class ResponseCache:
+    """Opt-in on-disk cache of completed responses and their artifacts, with TTL and LRU size bounds.
+
+    Entries are keyed by the API address and account, model, the normalized messages (including
+    advanced_reasoning) and the content hash of every attached file, so a hit is only served for
+    byte-identical inputs sent to the same target. Entries expire ttl_seconds after they were stored.
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl_seconds: float = 7 * 24 * 3600,
+                 max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".cache", "julius", "responses")
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def key(self, model: str, messages: List[Dict[str, Any]], file_hash, base_url: str = "",
+            api_key: str = "") -> str:
+        """Build the cache key; file_hash(path) returns the content hash of an attached file."""
+        normalized = []
+        for msg in messages:
+            entry = {k: v for k, v in msg.items() if k != "file_paths"}
+            if msg.get("file_paths"):
+                entry["file_hashes"] = [file_hash(path) for path in msg["file_paths"]]
+            normalized.append(entry)
+        material = json.dumps({
+            "base_url": base_url.rstrip("/"),
+            "account": hashlib.sha256(api_key.encode('utf-8')).hexdigest(),
+            "model": model,
+            "messages": normalized
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str, open_scope: Callable[[str], ArtifactScope]) -> Optional[JuliusResponse]:
+        """Restore a fresh entry into the scope open_scope(conversation_id) returns; None on a miss."""
+        entry_path = self._entry_path(key)
+        meta_path = os.path.join(entry_path, "response.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - meta["stored_at"] > self.ttl_seconds or "code_blocks" not in meta:
+            shutil.rmtree(entry_path, ignore_errors=True)
+            return None
+
+        artifacts_path = os.path.join(entry_path, "artifacts")
+        try:
+            os.utime(meta_path)  # Mark as recently used for LRU eviction
+            artifacts = {}
+            for name in meta["locations"]:
+                with open(os.path.join(artifacts_path, name), 'rb') as f:
+                    artifacts[name] = f.read()
+        except OSError:
+            return None  # Evicted by another thread or process while being read
+
+        scope = open_scope(meta["id"])
+        content = meta["content"]
+        for name, old_location in meta["locations"].items():
+            new_location = scope.write(name, artifacts[name])
+            # Point the response text at where the artifacts live now
+            content = content.replace(old_location, new_location)
+        scope.code_counter = meta["code_counter"]
+        scope.flush()
+
+        code_blocks = []
+        for code_name, output_name in meta["code_blocks"]:
+            outputs = OutputBuffer()
+            outputs.extend(json.loads(artifacts[output_name]).get("output", []))
+            outputs.seal()
+            code_blocks.append((scope.artifacts()[code_name], artifacts[code_name].decode('utf-8'),
+                                scope.artifacts()[output_name], outputs))
+
+        return JuliusResponse(
+            id=meta["id"],
+            choices=[Choice(index=0, message=JuliusMessage(role="assistant", content=content))],
+            created=meta["created"],
+            model=meta["model"],
+            code_blocks=code_blocks
+        )
+
+    def put(self, key: str, response: JuliusResponse, scope: ArtifactScope):
+        """Store a response with a copy of every artifact its scope wrote, then enforce the size bound."""
+        os.makedirs(self.directory, exist_ok=True)
+        staging = os.path.join(self.directory, f".{key}.{os.getpid()}.{threading.get_ident()}")
+        artifacts_path = os.path.join(staging, "artifacts")
+        os.makedirs(artifacts_path, exist_ok=True)
+
+        locations = scope.artifacts()
+        for name in locations:
+            with open(os.path.join(artifacts_path, name), 'wb') as f:
+                f.write(scope.read(name))
+        names = {location: name for name, location in locations.items()}
+        code_blocks = [[names[code_location], names[output_location]]
+                       for code_location, _, output_location, _ in response.code_blocks]
+
+        with open(os.path.join(staging, "response.json"), 'w') as f:
+            json.dump({
+                "id": response.id,
+                "content": response.message.content if response.message else "",
+                "created": response.created,
+                "model": response.model,
+                "locations": locations,
+                "code_counter": scope.code_counter,
+                "code_blocks": code_blocks,
+                "stored_at": time.time()
+            }, f)
+
+        entry_path = self._entry_path(key)
+        with self._lock:
+            shutil.rmtree(entry_path, ignore_errors=True)
+            os.replace(staging, entry_path)
+            self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        now = time.time()
+        for key in os.listdir(self.directory):
+            entry_path = self._entry_path(key)
+            meta_path = os.path.join(entry_path, "response.json")
+            if key.startswith(".") or not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path) as f:
+                    stored_at = json.load(f)["stored_at"]
+                last_used = os.path.getmtime(meta_path)
+                size = sum(os.path.getsize(os.path.join(root, name))
+                           for root, _, names in os.walk(entry_path) for name in names)
+            except (OSError, ValueError, KeyError):
+                continue  # Removed or rewritten concurrently
+            # Expiry counts from when the entry was stored, as in get(); last use only orders eviction
+            if now - stored_at > self.ttl_seconds:
+                shutil.rmtree(entry_path, ignore_errors=True)
+                continue
+            entries.append((last_used, size, entry_path))
+            total += size
+
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+def _file_content_hash(client, file_path: str) -> str:
+    """Content hash of a file, reusing the upload index's size/mtime fast path when available."""
+    if client.upload_index is not None:
+        return client.upload_index.content_hash(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ChatCompletions:
+    def __init__(self, client):
+        self.client = client
+        self._last_scope: Optional[ArtifactScope] = None
+
+    @property
+    def code_counter(self) -> int:
+        """Number of code files written by the most recent completion."""
+        return self._last_scope.code_counter if self._last_scope else 0
+
+    def _artifact_scope(self, conversation_id: str, output_dir: Optional[str] = None) -> ArtifactScope:
+        """Open the artifacts of a conversation: in output_dir when given, else in the client's artifact sink."""
+        sink = DirectorySink(output_dir, per_conversation=False) if output_dir else self.client.artifact_sink
+        scope = sink.open(conversation_id, self.client.artifact_executor)
+        self._last_scope = scope
+        return scope
+
+    def _save_code_and_output(self, code: str, outputs: OutputBuffer, scope: ArtifactScope) -> tuple[str, str]:
+        """Save code and its corresponding outputs to separate artifacts and return their locations."""
+        number = scope.next_code_number()
+        
+        # Save code file - code already comes with python key wrapping
+        code_filename = scope.write(f"generated_code_{number}.txt", code.encode('utf-8'))
+        
+        # Outputs are already deduplicated; the file is streamed from the buffer on the artifact writer
+        output_filename = scope.write(f"generated_output_{number}.txt", outputs.document)
+                
+        return code_filename, output_filename
+
+    def _format_terminal_output(self, content: str, code_blocks: list) -> str:
+        """Format the terminal output to be clean and readable."""
+        # Clean up any literal \n strings and get the main content
+        final_content = content.replace('\\n', '\n')
+        
+        # Add file notifications
+        if code_blocks:
+            for code_filename, _, output_filename, _ in code_blocks:
+                final_content += f"\n\nCode Generated: {code_filename}"
+                final_content += f"\nOutput Generated: {output_filename}"
+        
+        return final_content
+
+    def _stream_bytes(self, response: requests.Response, conversation_id: str,
+                      decoder: StreamDecoder) -> Iterator[bytes]:
+        """Yield a message stream's bytes, re-attaching to the answer when the connection drops mid-stream."""
+        attempt = 0
+        try:
+            while True:
+                try:
+                    yield from response.iter_content(chunk_size=STREAM_READ_SIZE)
+                    return
+                except TRANSIENT_ERRORS as e:
+                    response.close()
+                    response = self._reattach(conversation_id, decoder, attempt, e)
+                    attempt += 1
+        finally:
+            response.close()  # Also when the reader stops early; releases the connection at once
+
+    def _reattach(self, conversation_id: str, decoder: StreamDecoder, attempt: int,
+                  error: Exception) -> requests.Response:
+        """Reopen a conversation's in-progress answer, or raise StreamInterruptedError if that is not possible.
+
+        Re-posting the message would run the analysis twice, so this needs RetryPolicy.reattach_path:
+        an endpoint that replays the answer from its start, of which already decoded chunks are skipped.
+        """
+        policy = self.client.retry_policy
+        if not policy.reattach_path or attempt + 1 >= policy.max_attempts:
+            raise StreamInterruptedError(conversation_id, decoder.content, str(error))
+        delay = policy.delay(attempt)
+        self.client.transport.retries.note_retry("stream.reattach", attempt, delay, type(error).__name__)
+        time.sleep(delay)
+        decoder.resume()
+        try:
+            response = self.client.transport.get(
+                f"{self.client.base_url}{policy.reattach_path}",
+                headers={**self.client.headers, "conversation-id": conversation_id},
+                params={"conversation_id": conversation_id},
+                stream=True
+            )
+            response.raise_for_status()
+        except Exception as e:
+            raise StreamInterruptedError(conversation_id, decoder.content, f"{error}; re-attach failed: {e}")
+        return response
+    
+    def _sanitize_code(self, code: str) -> str:
+        """Remove any double python key wrapping."""
+        try:
+            while isinstance(code, str) and code.startswith('{"python":'):
+                code = json.loads(code)["python"]
+        except json.JSONDecodeError:
+            pass
+        return code
+
+    def _send_message(self, conversation_id: str, message: Dict[str, Any], model: str, current_reasoning_state: bool,
+                      uploads: Optional[UploadScheduler] = None, scope: Optional[ArtifactScope] = None,
+                      on_sent: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """Send a message and return its formatted content, code blocks and metadata."""
+        for event in self._iter_message_events(conversation_id, message, model, current_reasoning_state,
+                                               uploads, scope, on_sent):
+            if isinstance(event, MessageDone):
+                return {
+                    'content': event.content,
+                    'code_blocks': event.code_blocks,
+                    'metadata': event.metadata
+                }
+        raise Exception("Error in send_message: stream ended without a result")
+
+    def _iter_message_events(self, conversation_id: str, message: Dict[str, Any], model: str,
+                             current_reasoning_state: bool, uploads: Optional[UploadScheduler] = None,
+                             scope: Optional[ArtifactScope] = None,
+                             on_sent: Optional[Callable[[], None]] = None) -> Iterator[StreamEvent]:
+        """Send a message and yield typed delta events as its NDJSON stream arrives.
+
+        on_sent is called once the server has accepted the message, before the first event.
+        The response is closed however the generator ends, including when the consumer abandons it.
+        """
+        response = None
+        try:
+            headers = {
+                **self.client.headers,
+                "conversation-id": conversation_id
+            }
+
+            # Handle file attachments
+            new_attachments = {}
+            if message.get("file_paths"):
+                if uploads is not None:
+                    filenames = uploads.wait(message["file_paths"])
+                else:
+                    filenames = []
+                    for file_path in message["file_paths"]:
+                        filename = self.client.files.upload(file_path)
+                        self._register_file_source(conversation_id, filename)
+                        filenames.append(filename)
+                for filename in filenames:
+                    new_attachments[filename] = self._attachment_entry(filename)
+                renames = self.client.files.renames(message["file_paths"])
+                if renames:
+                    message = {**message, "content": _renamed_references(message["content"], renames)}
+
+            payload = self._message_payload(message, model, new_attachments, current_reasoning_state)
+
+            timer = StreamTimer(self.client.instrumentation)
+            response = self.client.transport.post(
+                f"{self.client.base_url}/api/chat/message",
+                headers=headers,
+                json=payload,
+                stream=True
+            )
+            
+            response.raise_for_status()
+            if on_sent is not None:
+                on_sent()
+            
+            decoder = StreamDecoder(OutputBuffer(self.client.output_memory_budget))
+            images_fetcher = ImageFetcher(self, scope)
+
+            for data in self._stream_bytes(response, conversation_id, decoder):
+                events = decoder.feed(data)
+                timer.observe(len(data), decoder, events)
+                for event in events:
+                    # Save images to outputs directory without stalling the stream
+                    if isinstance(event, ImageDelta):
+                        images_fetcher.submit(event.image_id, event.url)
+                    yield event
+            for event in decoder.close():
+                if isinstance(event, ImageDelta):
+                    images_fetcher.submit(event.image_id, event.url)
+                yield event
+            timer.finish(decoder)
+
+            accumulated_outputs = decoder.outputs
+            accumulated_outputs.extend(images_fetcher.join())
+
+            yield self._finalize_message(
+                conversation_id, model, decoder.content, decoder.code, accumulated_outputs, scope
+            )
+            
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in send_message: {str(e)}")
+        finally:
+            if response is not None:
+                response.close()
+
+    def _attachment_entry(self, filename: str) -> Dict[str, Any]:
+        """Build the new_attachments entry for a file; messages are only sent once their uploads finish."""
+        return {
+            "name": filename,
+            "isUploading": False,
+            "percentComplete": 100
+        }
+
+    def _message_payload(self, message: Dict[str, Any], model: str, new_attachments: Dict[str, Any],
+                         current_reasoning_state: bool) -> Dict[str, Any]:
+        """Build the /api/chat/message request body."""
+        payload = {
+            "message": {"content": message["content"]},
+            "provider": model if model != "default" else "default",
+            "chat_mode": "auto",
+            "client_version": "20240130",
+            "theme": "light",
+            "dataframe_format": "json",
+            "new_attachments": new_attachments,
+            "new_images": [],
+            "selectedModels": None
+        }
+
+        if current_reasoning_state:
+            payload["advanced_reasoning"] = True
+
+        return payload
+
+    def _save_image(self, img_id: str, image_bytes: bytes, scope: ArtifactScope) -> str:
+        """Decode a downloaded image, save it as a PNG artifact and return its location."""
+        from PIL import Image  # Imported on the first image, so text-only use never loads PIL
+        img = Image.open(BytesIO(image_bytes))
+        png = BytesIO()
+        img.save(png, format="PNG")
+        return scope.write(f"output_{img_id}.png", png.getvalue())
+
+    def _finalize_message(self, conversation_id: str, model: str, current_content: str,
+                          accumulated_function: str, accumulated_outputs: OutputBuffer,
+                          scope: Optional[ArtifactScope] = None) -> "MessageDone":
+        """Save the accumulated code and outputs of a message and build its final event."""
+        code_blocks = []
+        accumulated_outputs.seal()  # The message is complete; keep no descriptor open while it lives
+
+        # Process accumulated code and outputs at the end
+        if accumulated_function:
+            try:
+                code_filename, output_filename = self._save_code_and_output(
+                    accumulated_function, 
+                    accumulated_outputs,
+                    scope
+                )
+                code_blocks.append((code_filename, accumulated_function, output_filename, accumulated_outputs))
+            except Exception as e:
+                current_content += f"\nError saving code/output: {str(e)}\n"
+
+        # Format the content before returning
+        formatted_content = self._format_terminal_output(current_content, code_blocks)
+
+        return MessageDone(
+            conversation_id=conversation_id,
+            content=formatted_content,
+            code_blocks=code_blocks,
+            metadata={
+                'conversation_id': conversation_id,
+                'model': model,
+                'timestamp': datetime.now().timestamp()
+            }
+        )
+
+    def _register_file_source(self, conversation_id: str, filename: str):
+        """Register a file as a source for the conversation."""
+        try:
+            headers = {
+                **self.client.headers,
+                "conversation-id": conversation_id
+            }
+            
+            payload = {"file_name": filename}
+            
+            response = self.client.transport.post(
+                f"{self.client.base_url}/api/chat/sources",
+                headers=headers,
+                json=payload
+            )
+            
+            if response.status_code != 200:
+                raise Exception(f"Failed to register file source: {response.text}")
+                
+            return response.json()
+        except Exception as e:
+            raise Exception(f"Failed to register file source: {str(e)}")
+
+    def _start_payload(self, model: str) -> Dict[str, Any]:
+        """Build the /api/chat/start request body."""
+        return {
+            "provider": model if model != "default" else "default",
+            "server_type": "CPU",
+            "template_id": None,
+            "chat_type": None,
+            "conversation_plan": None,
+            "tool_preferences": {
+                "model": model if model != "default" else None
+            }
+        }
+
+    def _start_conversation(self, model: str) -> str:
+        """Start a new conversation with model preference."""
+        try:
+            response = self.client.transport.post(
+                f"{self.client.base_url}/api/chat/start",
+                headers=self.client.headers,
+                json=self._start_payload(model)
+            )
+            response.raise_for_status()
+            data = json.loads(response.text)
+            return data.get("id", "")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error starting conversation: {str(e)}")
+
+    def _message_plan(self, messages: List[Dict[str, Any]]) -> List[tuple]:
+        """Order messages system-first and resolve the reasoning preference each is sent with.
+
+        Returns (message, preference_change, reasoning_state) tuples, where preference_change
+        is the value to PATCH into the user preferences before sending, or None.
+        """
+        current_reasoning_state = False
+        system_step = None
+        user_messages = []
+
+        # Sort messages by type
+        for msg in messages:
+            if msg["role"] == "system":
+                preference_change = None
+                if "advanced_reasoning" in msg:
+                    current_reasoning_state = msg["advanced_reasoning"]
+                    if current_reasoning_state:
+                        preference_change = True
+                system_step = (msg, preference_change)
+            elif msg["role"] == "user":
+                user_messages.append(msg)
+
+        plan = []
+        if system_step:
+            plan.append((system_step[0], system_step[1], current_reasoning_state))
+
+        for user_msg in user_messages:
+            preference_change = None
+            if "advanced_reasoning" in user_msg:
+                current_reasoning_state = user_msg["advanced_reasoning"]
+                preference_change = bool(current_reasoning_state)
+            plan.append((user_msg, preference_change, current_reasoning_state))
+
+        return plan
+
+    def create(self, messages: List[Dict[str, Any]], model: ModelType = "default", stream: bool = False,
+               output_dir: Optional[str] = None, use_cache: bool = True,
+               **kwargs) -> Union[JuliusResponse, Iterator[StreamEvent]]:
+        """Create a chat completion, or an iterator of delta events when stream=True.
+
+        Generated code, outputs and images go to output_dir when given, otherwise to the client's
+        artifact sink (./outputs/<conversation_id> by default). When the client has a response_cache,
+        identical non-streaming requests are served from it.
+        """
+        if stream:
+            return self._stream_create(messages, model, output_dir)
+
+        with self.client.instrumentation.call("create") as timings:
+            response = self._complete(messages, model, output_dir, use_cache)
+        response.timings = timings.snapshot()
+        return response
+
+    def _complete(self, messages: List[Dict[str, Any]], model: str, output_dir: Optional[str],
+                  use_cache: bool) -> JuliusResponse:
+        """Run a non-streaming completion, or serve it from the response cache."""
+        uploads = None
+        try:
+            cache_key = self._cache_key(messages, model) if use_cache else None
+            if cache_key:
+                cached = self.client.response_cache.get(
+                    cache_key, lambda conversation_id: self._artifact_scope(conversation_id, output_dir)
+                )
+                if cached:
+                    return cached
+
+            uploads = self._schedule_uploads(messages)
+            conversation_id = self._start_conversation(model)
+            scope = self._artifact_scope(conversation_id, output_dir)
+            if uploads is not None:
+                uploads.bind(conversation_id)
+            final_content = ""
+            code_blocks = []
+
+            for msg, preference_change, current_reasoning_state in self._message_plan(messages):
+                with self.client.reasoning_gate.hold(current_reasoning_state) as release:
+                    if preference_change is not None:
+                        self.client.set_advanced_reasoning(preference_change)
+
+                    response_data = self._send_message(conversation_id, msg, model, current_reasoning_state,
+                                                       uploads, scope, on_sent=release)
+                final_content += response_data['content']
+                code_blocks.extend(response_data['code_blocks'])
+            scope.flush()
+
+            # Create and return the final response
+            response = JuliusResponse(
+                id=conversation_id,
+                choices=[Choice(
+                    index=0,
+                    message=JuliusMessage(
+                        role="assistant",
+                        content=final_content
+                    )
+                )],
+                created=int(datetime.now().timestamp()),
+                model=model,
+                code_blocks=code_blocks
+            )
+            if cache_key:
+                self.client.response_cache.put(cache_key, response, scope)
+            return response
+
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in chat completion: {str(e)}")
+        finally:
+            if uploads is not None:
+                uploads.shutdown()
+
+    def _cache_key(self, messages: List[Dict[str, Any]], model: str) -> Optional[str]:
+        """Response cache key for a request, or None when the client has no cache."""
+        if self.client.response_cache is None:
+            return None
+        return self.client.response_cache.key(
+            model, messages, lambda path: _file_content_hash(self.client, path),
+            base_url=self.client.base_url, api_key=self.client.api_key
+        )
+
+    def _schedule_uploads(self, messages: List[Dict[str, Any]]) -> Optional[UploadScheduler]:
+        """Start uploading every file attached anywhere in messages, or return None if there are none."""
+        file_paths = [path for msg in messages for path in msg.get("file_paths") or []]
+        if not file_paths:
+            return None
+        uploads = UploadScheduler(self.client.files, self._register_file_source, self.client.max_upload_workers)
+        uploads.submit(file_paths)
+        return uploads
+
+    def _stream_create(self, messages: List[Dict[str, Any]], model: str,
+                       output_dir: Optional[str] = None) -> Iterator[StreamEvent]:
+        """Yield delta events for every message of a chat completion as they arrive."""
+        uploads = None
+        try:
+            uploads = self._schedule_uploads(messages)
+            conversation_id = self._start_conversation(model)
+            scope = self._artifact_scope(conversation_id, output_dir)
+            if uploads is not None:
+                uploads.bind(conversation_id)
+
+            for msg, preference_change, current_reasoning_state in self._message_plan(messages):
+                # Released as soon as the message is accepted, before its first event is yielded
+                with self.client.reasoning_gate.hold(current_reasoning_state) as release:
+                    if preference_change is not None:
+                        self.client.set_advanced_reasoning(preference_change)
+
+                    yield from self._iter_message_events(conversation_id, msg, model, current_reasoning_state,
+                                                         uploads, scope, on_sent=release)
+            scope.flush()
+
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in chat completion: {str(e)}")
+        finally:
+            if uploads is not None:
+                uploads.shutdown()
+
+    def create_batch(self, batch: List[List[Dict[str, Any]]], model: ModelType = "default",
+                     max_concurrency: int = 4, output_dir: Optional[str] = None) -> BatchResult:
+        """Run independent completions concurrently, one conversation each, preserving input order.
+
+        Every item writes its artifacts to its own scope (output_dir/item_<n> when output_dir is
+        given), and one item failing does not affect the others. Keep max_concurrency within TransportConfig.pool_maxsize
+        so every in-flight stream reuses a pooled connection.
+        """
+        results: List[Optional[JuliusResponse]] = [None] * len(batch)
+        errors: List[Optional[Exception]] = [None] * len(batch)
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="julius-batch") as pool:
+            futures = {
+                pool.submit(
+                    self.create, messages, model,
+                    output_dir=os.path.join(output_dir, f"item_{index}") if output_dir else None
+                ): index
+                for index, messages in enumerate(batch)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    errors[index] = e
+
+        return BatchResult(results=results, errors=errors, elapsed_seconds=time.monotonic() - started)
+
+class Conversation:
+    """A multi-turn session that keeps its conversation and registered sources between turns.
+
+    Follow-up turns skip the conversation start and any upload or source registration
+    already done, so each one costs a single message round trip. Code numbering and
+    artifacts continue in the same ArtifactScope across turns.
+    """
+
+    def __init__(self, completions: ChatCompletions, conversation_id: str, model: str, scope: ArtifactScope):
+        self.completions = completions
+        self.client = completions.client
+        self.conversation_id = conversation_id
+        self.model = model
+        self.scope = scope
+        self.sources: set = set()  # Server filenames registered on this conversation
+        self.advanced_reasoning: Optional[bool] = None  # Setting of the latest turn; None before the first
+        self._uploaded: Dict[str, tuple] = {}  # Absolute path -> (size, mtime_ns, server filename)
+
+    def _known_filename(self, file_path: str) -> Optional[str]:
+        """Server filename of a file already attached in this session, if it has not changed since."""
+        known = self._uploaded.get(os.path.abspath(file_path))
+        if not known:
+            return None
+        stat = os.stat(file_path)
+        return known[2] if (stat.st_size, stat.st_mtime_ns) == known[:2] else None
+
+    def wait(self, file_paths: List[str]) -> List[str]:
+        """Upload and register only the files this conversation has not seen; return their filenames."""
+        missing = [path for path in file_paths if self._known_filename(path) is None]
+        if missing:
+            uploads = UploadScheduler(self.client.files, self._register_once, self.client.max_upload_workers)
+            try:
+                uploads.submit(missing)
+                uploads.bind(self.conversation_id)
+                for file_path, filename in zip(missing, uploads.wait(missing)):
+                    stat = os.stat(file_path)
+                    self._uploaded[os.path.abspath(file_path)] = (stat.st_size, stat.st_mtime_ns, filename)
+            finally:
+                uploads.shutdown()
+        return [self._known_filename(path) for path in file_paths]
+
+    def _register_once(self, conversation_id: str, filename: str):
+        if filename not in self.sources:
+            self.completions._register_file_source(conversation_id, filename)
+            self.sources.add(filename)
+
+    def _turn_reasoning(self, advanced_reasoning: Optional[bool]) -> bool:
+        """The turn's reasoning setting: as given, else the previous turn's, else off."""
+        if advanced_reasoning is not None:
+            self.advanced_reasoning = bool(advanced_reasoning)
+        elif self.advanced_reasoning is None:
+            self.advanced_reasoning = False
+        return self.advanced_reasoning
+
+    def _apply_reasoning(self, advanced_reasoning: Optional[bool]):
+        """Apply the turn's setting to the account; the client skips the PATCH when it already holds."""
+        self.client.set_advanced_reasoning(self._turn_reasoning(advanced_reasoning))
+
+    def _message(self, content: str, file_paths: Optional[List[str]]) -> Dict[str, Any]:
+        message = {"role": "user", "content": content}
+        if file_paths:
+            message["file_paths"] = list(file_paths)
+        return message
+
+    def send(self, content: str, file_paths: Optional[List[str]] = None,
+             advanced_reasoning: Optional[bool] = None) -> JuliusResponse:
+        """Send one turn and return its response."""
+        try:
+            with self.client.instrumentation.call("conversation_turn") as timings:
+                with self.client.reasoning_gate.hold(self._turn_reasoning(advanced_reasoning)) as release:
+                    self._apply_reasoning(advanced_reasoning)
+                    message = self._message(content, file_paths)
+                    response_data = self.completions._send_message(
+                        self.conversation_id, message, self.model, self.advanced_reasoning, self, self.scope,
+                        on_sent=release
+                    )
+                self.scope.flush()
+            return JuliusResponse(
+                id=self.conversation_id,
+                choices=[Choice(
+                    index=0,
+                    message=JuliusMessage(
+                        role="assistant",
+                        content=response_data['content']
+                    )
+                )],
+                created=int(datetime.now().timestamp()),
+                model=self.model,
+                timings=timings.snapshot(),
+                code_blocks=response_data['code_blocks']
+            )
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in conversation turn: {str(e)}")
+
+    def stream(self, content: str, file_paths: Optional[List[str]] = None,
+               advanced_reasoning: Optional[bool] = None) -> Iterator[StreamEvent]:
+        """Send one turn and yield its delta events as they arrive."""
+        try:
+            # Released as soon as the message is accepted, before its first event is yielded
+            with self.client.reasoning_gate.hold(self._turn_reasoning(advanced_reasoning)) as release:
+                self._apply_reasoning(advanced_reasoning)
+                message = self._message(content, file_paths)
+                yield from self.completions._iter_message_events(
+                    self.conversation_id, message, self.model, self.advanced_reasoning, self, self.scope,
+                    on_sent=release
+                )
+                self.scope.flush()
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in conversation turn: {str(e)}")
+
+class Conversations:
+    def __init__(self, client):
+        self.client = client
+
+    def open(self, model: ModelType = "default", output_dir: Optional[str] = None) -> Conversation:
+        """Start a conversation that can be sent several turns.
+
+        Artifacts go to output_dir when given, otherwise to the client's artifact sink.
+        """
+        try:
+            completions = self.client.chat.completions
+            conversation_id = completions._start_conversation(model)
+            return Conversation(
+                completions, conversation_id, model, completions._artifact_scope(conversation_id, output_dir)
+            )
+        except Exception as e:
+            raise Exception(f"Error opening conversation: {str(e)}")
+
+class _JuliusBase(ABC):
+    """Configuration, transport, caches and instrumentation shared by Julius and AsyncJulius."""
+
+    _transport_type: type
+    _gate_type: type
+    _files_type: type
+    _completions_type: type
+    _conversations_type: type
+
+    def __init__(self, api_key: str, base_url: str = "https://api.julius.ai",
+                 transport_config: Optional[TransportConfig] = None,
+                 dedupe_uploads: bool = True, upload_index_path: Optional[str] = None,
+                 max_upload_workers: int = 4, upload_config: Optional[UploadConfig] = None,
+                 max_image_workers: int = 4, response_cache: Optional[ResponseCache] = None,
+                 tracers: Optional[List[Callable[[TraceEvent], None]]] = None,
+                 retry_policy: Optional[RetryPolicy] = None, artifact_sink: Optional[ArtifactSink] = None,
+                 output_memory_budget: int = OUTPUT_MEMORY_BUDGET, transcode: Optional[TranscodeConfig] = None,
+                 hub_index: Optional[HubFileIndex] = None, rate_limiter: Optional[RateLimiter] = None,
+                 cassette: Optional[Cassette] = None):
+        """Initialize the Julius API client with your API key.
+
+        tracers are called with a TraceEvent for every HTTP phase and stream milestone.
+        artifact_sink receives generated code, outputs and images (./outputs/<conversation_id> by default).
+        Code-execution outputs beyond output_memory_budget bytes per message are spilled to a temporary file.
+        transcode enables converting large CSV/XLSX files to a compact format before upload.
+        rate_limiter paces API requests and shares 429 backoffs; pass one with a SQLiteRateLimitStore
+        to coordinate the worker processes on a host.
+        cassette records every HTTP exchange to a file, or replays a recording instead of using the network.
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.instrumentation = Instrumentation(tracers)
+        self.metrics = ClientMetrics()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.cassette = cassette
+        self.transport = self._transport_type(
+            transport_config, self.instrumentation,
+            RetryController(
+                self.retry_policy, self.instrumentation, self.metrics, self.rate_limiter,
+                RateLimiter.scope_for(self.base_url, api_key)
+            ),
+            cassette
+        )
+        self.upload_index = UploadIndex(upload_index_path) if dedupe_uploads else None
+        self.hub_index = hub_index or HubFileIndex()
+        self.max_upload_workers = max_upload_workers
+        self.upload_config = upload_config or UploadConfig()
+        self.upload_manifest = UploadManifest(self.upload_config.manifest_dir)
+        self.transcoder = Transcoder(
+            transcode, lambda file_path: _file_content_hash(self, file_path), self.metrics
+        ) if transcode else None
+        self.max_image_workers = max_image_workers
+        self.response_cache = response_cache
+        self.artifact_sink = artifact_sink or DirectorySink()
+        self.output_memory_budget = output_memory_budget
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Origin": "https://julius.ai"
+        }
+        self.reasoning_preference = ReasoningPreference(self.metrics)
+        self.reasoning_gate = self._gate_type()
+        self._preference_lock = None
+        self._artifact_executor = None
+        self._executor_lock = threading.Lock()
+        self.files = self._files_type(self)
+        self.chat = type('Chat', (), {'completions': self._completions_type(self)})()
+        self.conversations = self._conversations_type(self)
+
+    @property
+    def artifact_executor(self) -> ThreadPoolExecutor:
+        """Writer pool for artifacts, so saving never blocks a stream; created on first use."""
+        with self._executor_lock:
+            if self._artifact_executor is None:
+                self._artifact_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="julius-artifacts")
+            return self._artifact_executor
+
+class Julius(_JuliusBase):
+    _transport_type = Transport
+    _gate_type = ReasoningGate
+    _files_type = Files
+    _completions_type = ChatCompletions
+    _conversations_type = Conversations
+    _image_executor = None
+
+
+    @property
+    def image_executor(self) -> ThreadPoolExecutor:
+        """Bounded pool shared by every image download this client makes, created on first use."""
+        with self._executor_lock:
+            if self._image_executor is None:
+                self._image_executor = ThreadPoolExecutor(
+                    max_workers=self.max_image_workers, thread_name_prefix="julius-image"
+                )
+            return self._image_executor
+
+    @property
+    def preference_lock(self) -> threading.Lock:
+        """Serializes advanced-reasoning changes made through this client."""
+        with self._executor_lock:
+            if self._preference_lock is None:
+                self._preference_lock = threading.Lock()
+            return self._preference_lock
+
+    def close(self):
+        """Release the pooled connections and worker threads held by this client."""
+        self.transport.close()
+        if self._image_executor is not None:
+            self._image_executor.shutdown(wait=True)
+            self._image_executor = None
+        if self._artifact_executor is not None:
+            self._artifact_executor.shutdown(wait=True)
+            self._artifact_executor = None
+        if self.transcoder is not None:
+            self.transcoder.close()
+        if self.upload_index is not None:
+            self.upload_index.flush()
+        if self.cassette is not None:
+            self.cassette.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def set_advanced_reasoning(self, enabled: bool = True, force: bool = False):
+        """Set advanced reasoning mode preference.
+
+        Skips the PATCH when this client already confirmed the same value; pass force=True
+        after the preference may have been changed elsewhere (e.g. in the web app).
+        """
+        enabled = bool(enabled)
+        with self.preference_lock:
+            if not force and self.reasoning_preference.is_current(enabled):
+                return self.reasoning_preference.last_result
+            started = time.perf_counter()
+            try:
+                response = self.transport.patch(
+                    f"{self.base_url}/api/user_preferences",
+                    headers=self.headers,
+                    json={
+                        "preferences": {
+                            "advanced_reasoning": enabled
+                        }
+                    }
+                )
+                response.raise_for_status()
+                result = response.json()
+            except Exception as e:
+                self.reasoning_preference.confirm(None, None, time.perf_counter() - started)
+                raise Exception(f"Failed to set advanced reasoning: {str(e)}")
+            self.reasoning_preference.confirm(enabled, result, time.perf_counter() - started)
+            return result
+
+def _import_aiohttp():
+    """Import aiohttp lazily so the blocking client does not depend on it."""
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError("AsyncJulius requires aiohttp. Install it with `pip install aiohttp`.")
+    return aiohttp
+
+def _cassette_prepared(method: str, url: str, kwargs: Dict[str, Any]) -> requests.PreparedRequest:
+    """The request an aiohttp call makes, prepared as requests would, to match and record it by."""
+    data = kwargs.get("data")
+    streamed = data is not None and not isinstance(data, (bytes, str, dict))
+    prepared = requests.Request(
+        method, url, headers=kwargs.get("headers"), params=kwargs.get("params"), json=kwargs.get("json"),
+        data=None if streamed else data
+    ).prepare()
+    if streamed:
+        prepared.body = data  # Recorded by its Content-Length, like a file body
+    return prepared
+
+class _AsyncRecordedResponse:
+    """Wraps an aiohttp response, copying the body it hands out into its cassette interaction."""
+
+    def __init__(self, response, cassette: "Cassette", interaction: Dict[str, Any], started: float):
+        self._response = response
+        self._cassette = cassette
+        self._interaction = interaction
+        self._started = started
+        self._finished = False
+
+    def _record(self, data: bytes):
+        self._interaction["response"]["chunks"].append(_cassette_chunk(time.perf_counter() - self._started, data))
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self._cassette._write(self._interaction)
+
+    @property
+    def content(self):
+        return self  # Serves response.content.iter_any()
+
+    async def iter_any(self) -> AsyncIterator[bytes]:
+        try:
+            async for data in self._response.content.iter_any():
+                self._record(data)
+                yield data
+        except Exception as e:
+            self._interaction["response"]["error"] = type(e).__name__  # Replayed as a dropped stream
+            raise
+        finally:
+            self._finish()
+
+    async def read(self) -> bytes:
+        data = await self._response.read()
+        if data:
+            self._record(data)
+        self._finish()
+        return data
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        return (await self.read()).decode(encoding or self._response.charset or "utf-8")
+
+    async def json(self, content_type: Optional[str] = None, **kwargs) -> Any:
+        data = await self.read()
+        return json.loads(data) if data.strip() else None
+
+    def release(self):
+        self._finish()
+        return self._response.release()
+
+    async def __aexit__(self, *exc):
+        self._finish()
+        await self._response.__aexit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+class _AsyncReplayResponse:
+    """aiohttp-like response serving a recorded exchange, each chunk no earlier than its recorded offset times time_scale."""
+
+    def __init__(self, recorded: Dict[str, Any], method: str, url: str, time_scale: float, aiohttp):
+        self.status = recorded["status"]
+        self.reason = recorded["reason"]
+        self.headers = CaseInsensitiveDict(recorded["headers"])
+        self.content_length = None
+        self._chunks = deque(recorded["chunks"])
+        self._error = recorded["error"]
+        self._headers_at = recorded["headers_at"]
+        self._time_scale = time_scale
+        self._opened = time.perf_counter()
+        self._method = method
+        self._url = url
+        self._aiohttp = aiohttp
+
+    @property
+    def content(self):
+        return self  # Serves response.content.iter_any()
+
+    async def iter_any(self) -> AsyncIterator[bytes]:
+        while self._chunks:
+            chunk = self._chunks.popleft()
+            if self._time_scale:
+                pause = self._opened + (chunk["t"] - self._headers_at) * self._time_scale - time.perf_counter()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+            yield _cassette_chunk_bytes(chunk)
+        if self._error:
+            error, self._error = self._error, None
+            raise self._aiohttp.ClientPayloadError(f"Recorded stream ended with {error}")
+
+    async def read(self) -> bytes:
+        return b"".join([data async for data in self.iter_any()])
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        return (await self.read()).decode(encoding or "utf-8")
+
+    async def json(self, content_type: Optional[str] = None, **kwargs) -> Any:
+        data = await self.read()
+        return json.loads(data) if data.strip() else None
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            from multidict import CIMultiDict, CIMultiDictProxy  # aiohttp's own dependencies
+            from yarl import URL
+            request_info = self._aiohttp.RequestInfo(URL(self._url), self._method, CIMultiDictProxy(CIMultiDict()))
+            raise self._aiohttp.ClientResponseError(request_info, (), status=self.status, message=self.reason,
+                                                    headers=self.headers)
+
+    async def release(self):
+        self._chunks.clear()
+
+    async def __aexit__(self, *exc):
+        self._chunks.clear()
+
+class _AsyncCassetteSession:
+    """Stands in for an AsyncTransport session: records each exchange made through session, or
+    replays the cassette without one."""
+
+    def __init__(self, transport: "AsyncTransport", cassette: "Cassette", storage: bool, session=None):
+        self.transport = transport
+        self.cassette = cassette
+        self.storage = storage
+        self.session = session
+
+    async def request(self, method: str, url: str, **kwargs):
+        request = _cassette_prepared(method, url, kwargs)
+        started = time.perf_counter()
+        if self.session is not None:
+            sequence = self.cassette._next_sequence()
+            response = await self.session.request(method, url, **kwargs)
+            interaction = _cassette_interaction(sequence, request, response.status, response.reason or "",
+                                                response.headers, time.perf_counter() - started)
+            return _AsyncRecordedResponse(response, self.cassette, interaction, started)
+
+        recorded = self.cassette._next(request)
+        if self.cassette.time_scale:
+            await asyncio.sleep(recorded["headers_at"] * self.cassette.time_scale)
+        # No aiohttp session traces a replay, so emit its http.* event here
+        self.transport.instrumentation.emit(
+            _http_phase(method, request.url, self.storage, request.headers, self.transport.retries.policy.reattach_path),
+            time.perf_counter() - started,
+            status=recorded["status"],
+            attributes={"method": method, "url": request.url}
+        )
+        return _AsyncReplayResponse(recorded, method, request.url, self.cassette.time_scale, self.transport._aiohttp)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+class AsyncTransport:
+    """Pooled aiohttp transport mirroring Transport for use on an event loop."""
+
+    def __init__(self, config: Optional[TransportConfig] = None, instrumentation: Optional[Instrumentation] = None,
+                 retries: Optional[RetryController] = None, cassette: Optional["Cassette"] = None):
+        self.config = config or TransportConfig()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.retries = retries or RetryController(instrumentation=self.instrumentation)
+        self.cassette = cassette
+        self._aiohttp = _import_aiohttp()
+        # Exception classes for callers that should not import aiohttp themselves
+        self.request_errors = (self._aiohttp.ClientError, asyncio.TimeoutError)
+        self.connection_errors = (self._aiohttp.ClientConnectionError, self._aiohttp.ClientPayloadError,
+                                  asyncio.TimeoutError)
+        self._api = None
+        self._storage = None
+
+    def _trace_config(self, storage: bool):
+        """aiohttp hooks emitting the same http.* events as Transport.request."""
+        instrumentation = self.instrumentation
+        reattach_path = self.retries.policy.reattach_path
+
+        async def on_request_start(session, context, params):
+            context.started = time.perf_counter()
+            context.bytes_sent = 0
+
+        async def on_request_chunk_sent(session, context, params):
+            context.bytes_sent += len(params.chunk)
+
+        async def on_request_end(session, context, params):
+            instrumentation.emit(
+                _http_phase(params.method, str(params.url), storage, params.headers, reattach_path),
+                time.perf_counter() - context.started,
+                bytes_sent=context.bytes_sent,
+                bytes_received=params.response.content_length or 0,
+                status=params.response.status,
+                attributes={"method": params.method, "url": str(params.url)}
+            )
+
+        async def on_request_exception(session, context, params):
+            instrumentation.emit(
+                _http_phase(params.method, str(params.url), storage, params.headers, reattach_path),
+                time.perf_counter() - context.started,
+                error=str(params.exception),
+                attributes={"method": params.method, "url": str(params.url)}
+            )
+
+        trace_config = self._aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def _build_session(self, pool_maxsize: int, storage: bool = False):
+        """Create a session whose connector keeps up to pool_maxsize connections per host alive.
+
+        With a cassette, the session records through it, or in replay mode is the cassette alone.
+        """
+        if self.cassette is not None and self.cassette.mode == "replay":
+            return _AsyncCassetteSession(self, self.cassette, storage)
+        aiohttp = self._aiohttp
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=pool_maxsize,
+            force_close=not self.config.keep_alive
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.config.connect_timeout,
+            sock_read=self.config.read_timeout
+        )
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[self._trace_config(storage)])
+        return _AsyncCassetteSession(self, self.cassette, storage, session) if self.cassette is not None else session
+
+    def request(self, method: str, url: str, storage: bool = False, replay_safe: Optional[bool] = None, **kwargs):
+        """Return a response context manager from the API pool, or the storage pool, retried like Transport."""
+        # Sessions are created lazily because aiohttp binds them to the running loop
+        if storage:
+            if self._storage is None:
+                self._storage = self._build_session(self.config.storage_pool_maxsize, storage=True)
+            session = self._storage
+        else:
+            if self._api is None:
+                self._api = self._build_session(self.config.pool_maxsize)
+            session = self._api
+        return _RetryingRequest(self, session, method, url, storage, replay_safe, kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    async def close(self):
+        """Close every pooled connection."""
+        for session in (self._api, self._storage):
+            if session is not None:
+                await session.close()
+        self._api = None
+        self._storage = None
+
+class _RetryingRequest:
+    """Async context manager that sends a request under the client's RetryPolicy and releases the response."""
+
+    def __init__(self, transport: AsyncTransport, session, method: str, url: str, storage: bool,
+                 replay_safe: Optional[bool], kwargs: Dict[str, Any]):
+        self.transport = transport
+        self.session = session
+        self.method = method
+        self.url = url
+        self.storage = storage
+        self.kwargs = kwargs
+        self.phase = _http_phase(method, url, storage, kwargs.get("headers"), transport.retries.policy.reattach_path)
+        self.replay_safe = _replay_safe(self.phase, method) if replay_safe is None else replay_safe
+        data = kwargs.get("data")
+        # A callable builds a fresh body per attempt; a consumed stream body cannot be sent twice
+        self.body_factory = kwargs.pop("data") if callable(data) else None
+        if data is not None and self.body_factory is None and not isinstance(data, (bytes, str, dict, list, tuple)):
+            self.replay_safe = False
+        self.response = None
+
+    async def __aenter__(self):
+        retries = self.transport.retries
+        aiohttp = self.transport._aiohttp
+        breaker = retries.admit(self.phase)
+        attempt = 0
+        while True:
+            if self.body_factory is not None:
+                self.kwargs["data"] = self.body_factory()
+            if not self.storage:
+                wait = await self._limiter(retries.pace, self.phase)
+                if wait:
+                    await asyncio.sleep(wait)
+            try:
+                response = await self.session.request(self.method, self.url, **self.kwargs)
+            except self.transport.request_errors as e:
+                never_sent = isinstance(e, aiohttp.ClientConnectorError)
+                transient = isinstance(e, self.transport.connection_errors)
+                delay = retries.delay_for_error(transient, never_sent, attempt, self.replay_safe)
+                if delay is None:
+                    retries.record(breaker)
+                    raise
+                reason = type(e).__name__
+            else:
+                retry_after = response.headers.get("Retry-After")
+                backoff = None
+                if response.status == 429 and not self.storage:
+                    backoff = await self._limiter(retries.rate_limited, self.phase, retry_after, attempt)
+                delay = retries.delay_for_status(response.status, retry_after, attempt, self.replay_safe, self.phase)
+                if delay is None:
+                    retries.record(breaker, response.status)
+                    if backoff is not None:
+                        await response.release()
+                        raise RateLimitedError(self.phase, backoff)
+                    self.response = response
+                    return response
+                reason = f"HTTP {response.status}"
+                await response.release()
+            retries.note_retry(self.phase, attempt, delay, reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def __aexit__(self, *exc):
+        if self.response is not None:
+            await self.response.__aexit__(*exc)
 
-    def _normalize_filename(self, filename: str) -> str:
-        """Normalize filename to match server's format."""
-        return ' '.join(word for word in filename.split() if word)
+    async def _limiter(self, call, *args):
+        """Run a rate-limiter call, on a worker thread when its store may block the event loop."""
+        if self.transport.retries.limiter_blocks:
+            return await asyncio.to_thread(call, *args)
+        return call(*args)
 
-    def get_signed_url(self, filename: str, mime_type: str) -> Dict:
+class AsyncFiles(Files):
+    def __init__(self, client):
+        super().__init__(client)
+        self._refresh_lock = None  # asyncio.Lock, created inside the running loop
+
+    async def get_signed_url(self, filename: str, mime_type: str) -> Dict:
         """Get signed URL for file upload."""
         try:
             normalized_filename = self._normalize_filename(filename)
@@ -62,26 +4015,24 @@ class Files:
                 "filename": normalized_filename,
                 "mimeType": mime_type
             }
-            
-            response = requests.post(
+
+            async with self.client.transport.post(
                 f"{self.client.base_url}/files/signed_url",
                 headers=self.client.headers,
                 json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            
+            ) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+
             if 'signedUrl' not in data:
                 raise Exception(f"No signed URL in response: {data}")
-                
+
             return data
-            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error getting signed URL: {str(e)}")
+
         except Exception as e:
             raise Exception(f"Error in signed URL request: {str(e)}")
 
-    def preprocess_file(self, filename: str) -> Dict:
+    async def preprocess_file(self, filename: str) -> Dict:
         """Preprocess uploaded file with response validation."""
         try:
             normalized_filename = self._normalize_filename(filename)
@@ -90,246 +4041,285 @@ class Files:
                 "conversationId": None,
                 "analyze": True
             }
-            
-            response = requests.post(
+
+            async with self.client.transport.post(
                 f"{self.client.base_url}/files/preprocess_file",
                 headers=self.client.headers,
                 json=payload
-            )
-            
-            response_data = response.json()
-            
+            ) as response:
+                response_data = await response.json(content_type=None)
+
             if not response_data.get('success'):
                 raise Exception("Preprocess response indicates failure")
-                
+
             if not response_data.get('res', {}).get('success'):
                 raise Exception("Preprocess result indicates failure")
-            
+
             return response_data
-            
-        except requests.exceptions.RequestException as e:
+
+        except Exception as e:
             raise Exception(f"Error preprocessing file: {str(e)}")
 
-    def list_files(self) -> List[Dict]:
-        """List all uploaded files."""
+    async def list_files(self, refresh: bool = False) -> List[Dict]:
+        """List all uploaded files, from the client's hub index unless it is stale or refresh is set."""
+        index = self.client.hub_index
         try:
-            response = requests.get(
-                f"{self.client.base_url}/hub/v2/list_hub_files",
-                headers=self.client.headers
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            if not isinstance(data.get('files'), list):
-                raise Exception(f"Invalid response from list files endpoint: {data}")
-                
-            return data.get('files', [])
-        except requests.exceptions.RequestException as e:
+            if refresh or not index.is_fresh():
+                requested_at = time.monotonic()
+                if self._refresh_lock is None:
+                    self._refresh_lock = asyncio.Lock()
+                async with self._refresh_lock:
+                    if (refresh and not index.listed_since(requested_at)) or not index.is_fresh():
+                        await self._fetch_listing(index)
+            return index.files()
+        except Exception as e:
             raise Exception(f"Error listing files: {str(e)}")
 
-    def upload(self, file_path: str) -> str:
-        """Upload a file to Julius and return filename."""
+    async def _fetch_listing(self, index: HubFileIndex):
+        """Re-list the hub into index, revalidating instead of downloading when the server allows it."""
+        requested_at = time.monotonic()
+        async with self.client.transport.get(
+            f"{self.client.base_url}/hub/v2/list_hub_files",
+            headers={**self.client.headers, **index.validators()}
+        ) as response:
+            if response.status == 304:
+                index.revalidated()
+                return
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+        if not isinstance(data.get('files'), list):
+            raise Exception(f"Invalid response from list files endpoint: {data}")
+
+        index.replace(data['files'], etag, last_modified, requested_at)
+
+    async def exists(self, filename: str, size: Optional[int] = None, refresh: bool = False) -> bool:
+        """Whether the hub has filename (normalized like uploads are), with this size when both are known."""
+        index = self.client.hub_index
+        filename = self._normalize_filename(filename)
+        requested_at = time.monotonic()
+        await self.list_files(refresh=refresh)
+        if index.has(filename, size) or index.listed_since(requested_at):
+            return index.has(filename, size)
+        await self.list_files(refresh=True)
+        return index.has(filename, size)
+
+    async def upload(self, file_path: str, dedupe: bool = True, progress=None,
+                     columns: Optional[List[str]] = None, sheet: Optional[str] = None) -> str:
+        """Upload a file to Julius and return filename, skipping bytes the server already has."""
         try:
             if not os.path.exists(file_path):
                 raise Exception(f"File not found: {file_path}")
-                
+            source = file_path
+            file_path = await asyncio.to_thread(self._transcoded, file_path, columns, sheet)
+
+            sha256, previous = await asyncio.to_thread(self._find_duplicate, file_path) if dedupe else (None, None)
+            if previous:
+                if await self.exists(previous["filename"], previous["size"]):
+                    return self._record_name(source, file_path, previous["filename"])
+                self.client.upload_index.forget(previous["filename"])
+
             original_filename = os.path.basename(file_path)
             normalized_filename = self._normalize_filename(original_filename)
-            mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+            mime_type = _upload_mime_type(file_path)
 
-            signed_url_response = self.get_signed_url(normalized_filename, mime_type)
+            signed_url_response = await self.get_signed_url(normalized_filename, mime_type)
             upload_url = signed_url_response.get('signedUrl')
-            
+
             if not upload_url:
                 raise Exception("No signed URL in response")
 
-            with open(file_path, 'rb') as f:
-                upload_response = requests.put(
-                    upload_url, 
-                    data=f, 
-                    headers={'Content-Type': mime_type}
-                )
-                upload_response.raise_for_status()
+            await self._put_file(upload_url, file_path, mime_type, normalized_filename, progress)
 
-            preprocess_response = self.preprocess_file(normalized_filename)
+            preprocess_response = await self.preprocess_file(normalized_filename)
             if not preprocess_response.get('success'):
                 raise Exception("File preprocessing failed")
-                
-            return normalized_filename
+
+            if sha256:
+                self.client.upload_index.record(sha256, normalized_filename, os.path.getsize(file_path))
+            self.client.hub_index.add(normalized_filename, os.path.getsize(file_path))
+
+            return self._record_name(source, file_path, normalized_filename)
 
         except Exception as e:
             raise Exception(f"Error in file upload process: {str(e)}")
 
+    async def _put_file(self, upload_url: str, file_path: str, mime_type: str, filename: str, progress=None):
+        """Send a file to its signed URL, in resumable parts when it is large enough."""
+        size = os.path.getsize(file_path)
+        self._report_progress(filename, 0, size, progress)
 
-class ChatCompletions:
-    def __init__(self, client):
-        self.client = client
-        self.code_counter = 0  # Global counter for code files
+        if size >= self.client.upload_config.multipart_threshold:
+            if await self._resumable_put(upload_url, file_path, mime_type, filename, size, progress):
+                return
 
-    def _save_code_and_output(self, code: str, outputs: list) -> tuple[str, str]:
-        """Save code and its corresponding outputs to separate files and return their filenames."""
-        folder_path = "./outputs"
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
-                
-        self.code_counter += 1
-        
-        # Save code file - code already comes with python key wrapping
-        code_filename = f"outputs/generated_code_{self.code_counter}.txt"
-        with open(code_filename, 'w') as f:
-            f.write(code)  # Write the code as-is since it's already wrapped
-        
-        # Process and deduplicate outputs
-        processed_outputs = []
-        seen_outputs = set()
-        for output in outputs:
-            # Convert output to string for deduplication
-            output_str = json.dumps(output) if isinstance(output, dict) else str(output)
-            if output_str not in seen_outputs:
-                seen_outputs.add(output_str)
-                # Only include actual outputs, skip file saving messages
-                if not any(skip in output_str for skip in ['Saved image as', 'Error saving']):
-                    processed_outputs.append(output)
-        
-        # Save output file
-        output_filename = f"outputs/generated_output_{self.code_counter}.txt"
-        with open(output_filename, 'w') as f:
-            f.write(json.dumps({"output": processed_outputs}, indent=2))
-                
-        return code_filename, output_filename
-    
-    def _cleanup_outputs_directory(self):
-        """Clean up the outputs directory by removing and recreating it."""
-        import shutil
-        output_dir = "./outputs"
-        
-        # Remove the directory and its contents if it exists
-        if os.path.exists(output_dir):
-            try:
-                shutil.rmtree(output_dir)
-            except Exception as e:
-                raise Exception(f"Failed to clean outputs directory: {str(e)}")
-        
-        # Create fresh outputs directory
-        try:
-            os.makedirs(output_dir)
-        except Exception as e:
-            raise Exception(f"Failed to create outputs directory: {str(e)}")
-        
-        # Reset the code counter since we're starting fresh
-        self.code_counter = 0
+        async def body():
+            sent = 0
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(256 * 1024), b""):
+                    yield block
+                    sent += len(block)
+                    self._report_progress(filename, sent, size, progress)
 
-    def _format_terminal_output(self, content: str, code_blocks: list) -> str:
-        """Format the terminal output to be clean and readable."""
-        # Clean up any literal \n strings and get the main content
-        final_content = content.replace('\\n', '\n')
-        
-        # Add file notifications
-        if code_blocks:
-            for code_filename, _, output_filename, _ in code_blocks:
-                final_content += f"\n\nCode Generated: {code_filename}"
-                final_content += f"\nOutput Generated: {output_filename}"
-        
-        return final_content
+        async with self.client.transport.put(
+            upload_url,
+            data=body,
+            headers={'Content-Type': mime_type, 'Content-Length': str(size)},
+            storage=True
+        ) as upload_response:
+            upload_response.raise_for_status()
+        self._report_progress(filename, size, size, progress)
 
-    def _process_stream_chunk(self, chunk: Dict[str, Any]) -> tuple[str, Optional[str], Optional[Dict], List]:
-        """Process a chunk from the stream and return content, function call, images, and outputs."""
-        content = chunk.get('content', '')
-        function_call = chunk.get('function_call', '')
-        outputs = chunk.get('outputs', [])
-        
-        # Extract any image URLs from the chunk
-        images = {}
-        if 'image_urls_dict' in chunk:
-            images = chunk['image_urls_dict']
-        elif 'image_urls' in chunk:
-            for i, url in enumerate(chunk['image_urls']):
-                images[f"image_{i}"] = url
-        elif isinstance(function_call, dict) and 'arguments' in function_call:
-            try:
-                args = json.loads(function_call['arguments']) if isinstance(function_call['arguments'], str) else function_call['arguments']
-                if isinstance(args, dict) and 'url' in args:
-                    images[f"image_{len(images)}"] = args['url']
-            except json.JSONDecodeError:
-                pass
-                
-        return content, function_call, images, outputs
-
-    def _handle_stream_response(self, response: requests.Response, max_retries: int = 3) -> tuple[str, List, str, List]:
-        """Handle streaming response with retry logic and better error handling."""
-        current_content = ""
-        accumulated_function = ""
-        accumulated_outputs = []
-        retry_count = 0
-        
-        while retry_count < max_retries:
+    async def _resumable_put(self, upload_url: str, file_path: str, mime_type: str, filename: str,
+                             size: int, progress=None) -> bool:
+        """Upload through a resumable storage session; return False if the signed URL does not allow one."""
+        config = self.client.upload_config
+        manifest = self.client.upload_manifest
+        key = manifest.key_for(file_path)
+
+        state = manifest.load(key)
+        offset = None
+        if state:
+            offset = await self._query_resumable_offset(state["session_url"], size)
+        if offset is None:
+            async with self.client.transport.post(
+                upload_url,
+                headers={'Content-Type': mime_type, 'x-goog-resumable': 'start'},
+                storage=True
+            ) as response:
+                if response.status not in (200, 201) or 'Location' not in response.headers:
+                    return False
+                state = {"session_url": response.headers['Location'], "filename": filename, "size": size}
+            manifest.save(key, state)
+            offset = 0
+
+        with open(file_path, 'rb') as f:
+            while offset < size:
+                self._report_progress(filename, offset, size, progress)
+                f.seek(offset)
+                part = f.read(config.part_size)
+                offset = await self._put_part(state["session_url"], part, offset, size)
+                state["offset"] = offset
+                manifest.save(key, state)
+
+        manifest.clear(key)
+        self._report_progress(filename, size, size, progress)
+        return True
+
+    async def _put_part(self, session_url: str, part: bytes, start: int, size: int) -> int:
+        """Send one part, retrying it independently, and return the offset the server has committed."""
+        end = start + len(part) - 1
+        retries = self.client.upload_config.part_retries
+        last_error = None
+        for attempt in range(retries):
             try:
-                for line in response.iter_lines():
-                    if not line:
-                        continue
-                        
-                    try:
-                        chunk = json.loads(line.decode('utf-8'))
-                        content, function_call, images, outputs = self._process_stream_chunk(chunk)
-                        
-                        # Handle outputs
-                        if outputs:
-                            accumulated_outputs.extend(outputs)
-                        
-                        # Accumulate content 
-                        if content:
-                            current_content += content
-                            
-                        # Handle function calls
-                        if function_call:
-                            if isinstance(function_call, dict) and function_call.get('arguments'):
-                                if '"python":' in function_call['arguments']:
-                                    accumulated_function += function_call['arguments']
-                        
-                        # Handle images by just storing their URLs
-                        if images:
-                            image_info = {"image_urls": images}
-                            accumulated_outputs.append(image_info)
-                            
-                            # Save images silently
-                            os.makedirs("outputs", exist_ok=True)
-                            for img_id, url in images.items():
-                                try:
-                                    img_response = requests.get(url)
-                                    if img_response.status_code == 200:
-                                        img = Image.open(BytesIO(img_response.content))
-                                        save_path = os.path.join("outputs", f"output_{img_id}.png")
-                                        img.save(save_path)
-                                except Exception:
-                                    pass
-                                    
-                    except json.JSONDecodeError:
-                        continue
-                        
-                # If we get here, processing was successful
-                break
-                
-            except (requests.exceptions.ChunkedEncodingError, 
-                    requests.exceptions.ConnectionError, 
-                    requests.exceptions.StreamConsumedError) as e:
-                retry_count += 1
-                if retry_count >= max_retries:
-                    raise Exception(f"Failed to process stream after {max_retries} attempts: {str(e)}")
-                time.sleep(1)  # Wait before retrying
-                
-        return current_content, accumulated_outputs, accumulated_function, []
-    
-    def _sanitize_code(self, code: str) -> str:
-        """Remove any double python key wrapping."""
+                async with self.client.transport.put(
+                    session_url,
+                    data=part,
+                    headers={'Content-Range': f"bytes {start}-{end}/{size}"},
+                    storage=True
+                ) as response:
+                    if response.status in (200, 201):
+                        return size
+                    if response.status == 308:
+                        return _committed_offset(response.headers.get('Range'))
+                    if response.status < 500 and response.status != 429:
+                        response.raise_for_status()
+                    last_error = f"HTTP {response.status}"
+            except self.client.transport.connection_errors as e:
+                last_error = str(e)
+
+            await asyncio.sleep(self.client.retry_policy.delay(attempt))
+            # The server may have kept some of the part before the failure
+            committed = await self._query_resumable_offset(session_url, size)
+            if committed is not None and committed > start:
+                return committed
+        raise Exception(f"Upload of bytes {start}-{end} failed after {retries} attempts: {last_error}")
+
+    async def _query_resumable_offset(self, session_url: str, size: int) -> Optional[int]:
+        """Ask a resumable session how many bytes it has; None if the session is gone."""
         try:
-            while isinstance(code, str) and code.startswith('{"python":'):
-                code = json.loads(code)["python"]
-        except json.JSONDecodeError:
-            pass
-        return code
+            async with self.client.transport.put(
+                session_url,
+                data=b"",
+                headers={'Content-Range': f"bytes */{size}"},
+                storage=True
+            ) as response:
+                if response.status in (200, 201):
+                    return size
+                if response.status == 308:
+                    return _committed_offset(response.headers.get('Range'))
+                return None
+        except self.client.transport.request_errors:
+            return None
+
+class AsyncUploadScheduler:
+    """asyncio counterpart of UploadScheduler, bounding concurrent uploads with a semaphore."""
+
+    def __init__(self, files: AsyncFiles, register, max_workers: int = 4):
+        self.files = files
+        self.register = register
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._uploads: Dict[str, asyncio.Task] = {}
+        self._registrations: Dict[str, asyncio.Task] = {}
+
+    def submit(self, file_paths: List[str]):
+        """Start uploading every file not already scheduled."""
+        for file_path in file_paths:
+            if file_path not in self._uploads:
+                self._uploads[file_path] = asyncio.ensure_future(self._upload(file_path))
+
+    async def _upload(self, file_path: str) -> str:
+        async with self._semaphore:
+            return await self.files.upload(file_path)
+
+    def bind(self, conversation_id: str):
+        """Register each upload as a conversation source once it completes."""
+        for file_path in self._uploads:
+            self._registrations[file_path] = asyncio.ensure_future(
+                self._register_when_uploaded(conversation_id, file_path)
+            )
+
+    async def _register_when_uploaded(self, conversation_id: str, file_path: str) -> str:
+        filename = await self._uploads[file_path]
+        await self.register(conversation_id, filename)
+        return filename
+
+    async def wait(self, file_paths: List[str]) -> List[str]:
+        """Wait until the given files are uploaded and registered; return their server filenames."""
+        return [await self._registrations[file_path] for file_path in file_paths]
+
+    def shutdown(self):
+        """Cancel uploads nobody is waiting for anymore."""
+        for task in [*self._uploads.values(), *self._registrations.values()]:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # Mark failures as retrieved; they were raised through wait()
 
-    def _send_message(self, conversation_id: str, message: Dict[str, Any], model: str, current_reasoning_state: bool) -> Dict[str, Any]:
-        """Enhanced send_message with cleaner output handling."""
+class AsyncChatCompletions(ChatCompletions):
+    async def _send_message(self, conversation_id: str, message: Dict[str, Any], model: str, current_reasoning_state: bool,
+                            uploads: Optional[AsyncUploadScheduler] = None,
+                            scope: Optional[ArtifactScope] = None, on_sent=None) -> Dict[str, Any]:
+        """Send a message and return its formatted content, code blocks and metadata."""
+        async for event in self._iter_message_events(conversation_id, message, model, current_reasoning_state,
+                                                     uploads, scope, on_sent):
+            if isinstance(event, MessageDone):
+                return {
+                    'content': event.content,
+                    'code_blocks': event.code_blocks,
+                    'metadata': event.metadata
+                }
+        raise Exception("Error in send_message: stream ended without a result")
+
+    async def _iter_message_events(self, conversation_id: str, message: Dict[str, Any], model: str,
+                                   current_reasoning_state: bool, uploads: Optional[AsyncUploadScheduler] = None,
+                                   scope: Optional[ArtifactScope] = None, on_sent=None) -> AsyncIterator[StreamEvent]:
+        """Send a message and yield typed delta events without blocking the event loop.
+
+        on_sent is awaited once the server has accepted the message, before the first event.
+        """
         try:
             headers = {
                 **self.client.headers,
@@ -338,207 +4328,204 @@ class ChatCompletions:
 
             # Handle file attachments
             new_attachments = {}
-            if "file_paths" in message:
-                for file_path in message["file_paths"]:
-                    filename = self.client.files.upload(file_path)
-                    self._register_file_source(conversation_id, filename)
-                    new_attachments[filename] = {
-                        "name": filename,
-                        "isUploading": False,
-                        "percentComplete": 100
-                    }
+            if message.get("file_paths"):
+                if uploads is not None:
+                    filenames = await uploads.wait(message["file_paths"])
+                else:
+                    filenames = []
+                    for file_path in message["file_paths"]:
+                        filename = await self.client.files.upload(file_path)
+                        await self._register_file_source(conversation_id, filename)
+                        filenames.append(filename)
+                for filename in filenames:
+                    new_attachments[filename] = self._attachment_entry(filename)
+                renames = self.client.files.renames(message["file_paths"])
+                if renames:
+                    message = {**message, "content": _renamed_references(message["content"], renames)}
 
-            payload = {
-                "message": {"content": message["content"]},
-                "provider": model if model != "default" else "default",
-                "chat_mode": "auto",
-                "client_version": "20240130",
-                "theme": "light",
-                "dataframe_format": "json",
-                "new_attachments": new_attachments,
-                "new_images": [],
-                "selectedModels": None
-            }
+            payload = self._message_payload(message, model, new_attachments, current_reasoning_state)
 
-            if current_reasoning_state:
-                payload["advanced_reasoning"] = True
+            decoder = StreamDecoder(OutputBuffer(self.client.output_memory_budget))
+            image_tasks = []
 
-            response = requests.post(
+            timer = StreamTimer(self.client.instrumentation)
+            async with self.client.transport.post(
                 f"{self.client.base_url}/api/chat/message",
                 headers=headers,
-                json=payload,
-                stream=True
-            )
-            
-            response.raise_for_status()
-            
-            current_content = ""
-            code_blocks = []
-            accumulated_function = ""
-            accumulated_outputs = []
-            
-            for line in response.iter_lines():
-                if not line:
-                    continue
-                    
-                try:
-                    chunk = json.loads(line.decode('utf-8'))
-                    content, function_call, images, outputs = self._process_stream_chunk(chunk)
-                    
-                    # Handle outputs
-                    if outputs:
-                        accumulated_outputs.extend(outputs)
-                    
-                    # Accumulate content 
-                    if content:
-                        current_content += content
-                        
-                    # Handle function calls
-                    if function_call:
-                        if isinstance(function_call, dict) and function_call.get('arguments'):
-                            if '"python":' in function_call['arguments']:
-                                accumulated_function += function_call['arguments']
-                    
-                    # Handle images
-                    if images:
-                        image_info = {"image_urls": images}
-                        accumulated_outputs.append(image_info)
-                        
-                        # Save images to outputs directory
-                        os.makedirs("outputs", exist_ok=True)
-                        for img_id, url in images.items():
-                            try:
-                                response = requests.get(url)
-                                if response.status_code == 200:
-                                    img = Image.open(BytesIO(response.content))
-                                    save_path = os.path.join("outputs", f"output_{img_id}.png")
-                                    img.save(save_path)
-                                    accumulated_outputs.append(f"Saved image as {save_path}")
-                            except Exception as e:
-                                accumulated_outputs.append(f"Error saving image: {str(e)}")
-                                
-                except json.JSONDecodeError:
-                    continue
-            
-            # Process accumulated code and outputs at the end
-            if accumulated_function:
+                json=payload
+            ) as response:
+                response.raise_for_status()
+                if on_sent is not None:
+                    await on_sent()
+
+                # Closed explicitly, so a re-attached response is released even when the consumer stops early
+                stream = self._stream_bytes(response, conversation_id, decoder)
                 try:
-                    code_filename, output_filename = self._save_code_and_output(
-                        accumulated_function, 
-                        accumulated_outputs
-                    )
-                    # current_content += f"\nCode saved to: {code_filename}\n"
-                    # current_content += f"Output saved to: {output_filename}\n"
-                    code_blocks.append((code_filename, accumulated_function, output_filename, accumulated_outputs))
-                except Exception as e:
-                    current_content += f"\nError saving code/output: {str(e)}\n"
-
-            # Format the content before returning
-            formatted_content = self._format_terminal_output(current_content, code_blocks)
-                    
-            return {
-                'content': formatted_content,
-                'code_blocks': code_blocks,
-                'metadata': {
-                    'conversation_id': conversation_id,
-                    'model': model,
-                    'timestamp': datetime.now().timestamp()
-                }
-            }
-            
+                    async for data in stream:
+                        events = decoder.feed(data)
+                        timer.observe(len(data), decoder, events)
+                        for event in events:
+                            if isinstance(event, ImageDelta):
+                                image_tasks.append(
+                                    asyncio.ensure_future(self._fetch_image(event.image_id, event.url, scope))
+                                )
+                            yield event
+                finally:
+                    await stream.aclose()
+                for event in decoder.close():
+                    if isinstance(event, ImageDelta):
+                        image_tasks.append(asyncio.ensure_future(self._fetch_image(event.image_id, event.url, scope)))
+                    yield event
+            timer.finish(decoder)
+
+            accumulated_outputs = decoder.outputs
+            for result in await asyncio.gather(*image_tasks, return_exceptions=True):
+                if isinstance(result, Exception):
+                    accumulated_outputs.append(f"Error saving image: {str(result)}")
+                elif result:
+                    accumulated_outputs.append(f"Saved image as {result}")
+
+            yield self._finalize_message(
+                conversation_id, model, decoder.content, decoder.code, accumulated_outputs, scope
+            )
+
+        except (StreamInterruptedError, RateLimitedError):
+            raise
         except Exception as e:
             raise Exception(f"Error in send_message: {str(e)}")
 
-    def _register_file_source(self, conversation_id: str, filename: str):
+    async def _stream_bytes(self, response, conversation_id: str, decoder: StreamDecoder) -> AsyncIterator[bytes]:
+        """Yield a message stream's bytes, re-attaching to the answer when the connection drops mid-stream."""
+        attempt = 0
+        request = None
+        try:
+            while True:
+                try:
+                    async for data in response.content.iter_any():
+                        yield data
+                    return
+                except self.client.transport.connection_errors as e:
+                    if request is not None:
+                        await request.__aexit__(None, None, None)
+                    request, response = await self._reattach(conversation_id, decoder, attempt, e)
+                    attempt += 1
+        finally:
+            if request is not None:
+                await request.__aexit__(None, None, None)
+
+    async def _reattach(self, conversation_id: str, decoder: StreamDecoder, attempt: int, error: Exception):
+        """Reopen a conversation's in-progress answer; returns (request context, response)."""
+        policy = self.client.retry_policy
+        if not policy.reattach_path or attempt + 1 >= policy.max_attempts:
+            raise StreamInterruptedError(conversation_id, decoder.content, str(error))
+        delay = policy.delay(attempt)
+        self.client.transport.retries.note_retry("stream.reattach", attempt, delay, type(error).__name__)
+        await asyncio.sleep(delay)
+        decoder.resume()
+        request = self.client.transport.get(
+            f"{self.client.base_url}{policy.reattach_path}",
+            headers={**self.client.headers, "conversation-id": conversation_id},
+            params={"conversation_id": conversation_id}
+        )
+        try:
+            response = await request.__aenter__()
+            response.raise_for_status()
+        except Exception as e:
+            await request.__aexit__(None, None, None)
+            raise StreamInterruptedError(conversation_id, decoder.content, f"{error}; re-attach failed: {e}")
+        return request, response
+
+    async def _fetch_image(self, img_id: str, url: str, scope: Optional[ArtifactScope] = None) -> Optional[str]:
+        """Download and save one image, bounded by the client's image concurrency limit."""
+        async with self.client.image_semaphore:
+            async with self.client.transport.get(url, storage=True) as img_response:
+                if img_response.status != 200:
+                    return None
+                image_bytes = await img_response.read()
+        # Decoding and re-encoding is CPU and disk work, keep it off the event loop
+        return await asyncio.to_thread(self._save_image, img_id, image_bytes, scope)
+
+    async def _register_file_source(self, conversation_id: str, filename: str):
         """Register a file as a source for the conversation."""
         try:
             headers = {
                 **self.client.headers,
                 "conversation-id": conversation_id
             }
-            
-            payload = {"file_name": filename}
-            
-            response = requests.post(
+
+            async with self.client.transport.post(
                 f"{self.client.base_url}/api/chat/sources",
                 headers=headers,
-                json=payload
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to register file source: {response.text}")
-                
-            return response.json()
+                json={"file_name": filename}
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to register file source: {await response.text()}")
+                return await response.json(content_type=None)
         except Exception as e:
             raise Exception(f"Failed to register file source: {str(e)}")
 
-    def _start_conversation(self, model: str) -> str:
+    async def _start_conversation(self, model: str) -> str:
         """Start a new conversation with model preference."""
         try:
-            payload = {
-                "provider": model if model != "default" else "default",
-                "server_type": "CPU",
-                "template_id": None,
-                "chat_type": None,
-                "conversation_plan": None,
-                "tool_preferences": {
-                    "model": model if model != "default" else None
-                }
-            }
-            
-            response = requests.post(
+            async with self.client.transport.post(
                 f"{self.client.base_url}/api/chat/start",
                 headers=self.client.headers,
-                json=payload
-            )
-            response.raise_for_status()
-            data = json.loads(response.text)
+                json=self._start_payload(model)
+            ) as response:
+                response.raise_for_status()
+                data = json.loads(await response.text())
             return data.get("id", "")
-        except requests.exceptions.RequestException as e:
+        except RateLimitedError:
+            raise
+        except Exception as e:
             raise Exception(f"Error starting conversation: {str(e)}")
 
-    def create(self, messages: List[Dict[str, Any]], model: ModelType = "default", **kwargs) -> JuliusResponse:
-        """Create a chat completion."""
+    async def create(self, messages: List[Dict[str, Any]], model: ModelType = "default", stream: bool = False,
+                     output_dir: Optional[str] = None, use_cache: bool = True,
+                     **kwargs) -> Union[JuliusResponse, AsyncIterator[StreamEvent]]:
+        """Create a chat completion, or an async iterator of delta events when stream=True."""
+        if stream:
+            return self._stream_create(messages, model, output_dir)
+
+        with self.client.instrumentation.call("create") as timings:
+            response = await self._complete(messages, model, output_dir, use_cache)
+        response.timings = timings.snapshot()
+        return response
+
+    async def _complete(self, messages: List[Dict[str, Any]], model: str, output_dir: Optional[str],
+                        use_cache: bool) -> JuliusResponse:
+        """Run a non-streaming completion, or serve it from the response cache."""
+        uploads = None
         try:
-            # Clean up outputs directory at the start of each chat session
-            self._cleanup_outputs_directory()
+            cache_key = await asyncio.to_thread(self._cache_key, messages, model) if use_cache else None
+            if cache_key:
+                cached = await asyncio.to_thread(
+                    self.client.response_cache.get, cache_key,
+                    lambda conversation_id: self._artifact_scope(conversation_id, output_dir)
+                )
+                if cached:
+                    return cached
 
-            conversation_id = self._start_conversation(model)
-            current_reasoning_state = False
-            system_msg = None
-            user_messages = []
+            uploads = self._schedule_uploads(messages)
+            conversation_id = await self._start_conversation(model)
+            scope = self._artifact_scope(conversation_id, output_dir)
+            if uploads is not None:
+                uploads.bind(conversation_id)
             final_content = ""
-            
-            # Sort messages by type
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_msg = msg
-                    if "advanced_reasoning" in msg:
-                        current_reasoning_state = msg["advanced_reasoning"]
-                        if current_reasoning_state:
-                            self.client.set_advanced_reasoning(True)
-                elif msg["role"] == "user":
-                    user_messages.append(msg)
-            
-            # Process system message if present
-            if system_msg:
-                response_data = self._send_message(conversation_id, system_msg, model, current_reasoning_state)
-                final_content += response_data['content']
-            
-            # Process user messages
-            for user_msg in user_messages:
-                if "advanced_reasoning" in user_msg:
-                    current_reasoning_state = user_msg["advanced_reasoning"]
-                    if current_reasoning_state:
-                        self.client.set_advanced_reasoning(True)
-                    else:
-                        self.client.set_advanced_reasoning(False)
-                
-                response_data = self._send_message(conversation_id, user_msg, model, current_reasoning_state)
+            code_blocks = []
+
+            for msg, preference_change, current_reasoning_state in self._message_plan(messages):
+                async with self.client.reasoning_gate.hold(current_reasoning_state) as release:
+                    if preference_change is not None:
+                        await self.client.set_advanced_reasoning(preference_change)
+
+                    response_data = await self._send_message(conversation_id, msg, model,
+                                                             current_reasoning_state, uploads, scope, release)
                 final_content += response_data['content']
+                code_blocks.extend(response_data['code_blocks'])
+            await asyncio.to_thread(scope.flush)
 
-            # Create and return the final response
-            return JuliusResponse(
+            response = JuliusResponse(
                 id=conversation_id,
                 choices=[Choice(
                     index=0,
@@ -548,38 +4535,230 @@ class ChatCompletions:
                     )
                 )],
                 created=int(datetime.now().timestamp()),
-                model=model
+                model=model,
+                code_blocks=code_blocks
             )
+            if cache_key:
+                await asyncio.to_thread(self.client.response_cache.put, cache_key, response, scope)
+            return response
 
+        except (StreamInterruptedError, RateLimitedError):
+            raise
         except Exception as e:
             raise Exception(f"Error in chat completion: {str(e)}")
+        finally:
+            if uploads is not None:
+                uploads.shutdown()
 
-class Julius:
-    def __init__(self, api_key: str):
-        """Initialize Julius API with your API key."""
-        self.api_key = api_key
-        self.base_url = "https://api.julius.ai"
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Origin": "https://julius.ai"
-        }
-        self.files = Files(self)
-        self.chat = type('Chat', (), {'completions': ChatCompletions(self)})()
-
-    def set_advanced_reasoning(self, enabled: bool = True):
-        """Set advanced reasoning mode preference."""
-        try:
-            response = requests.patch(
-                f"{self.base_url}/api/user_preferences",
-                headers=self.headers,
-                json={
-                    "preferences": {
-                        "advanced_reasoning": enabled
-                    }
-                }
+    def _schedule_uploads(self, messages: List[Dict[str, Any]]) -> Optional[AsyncUploadScheduler]:
+        """Start uploading every file attached anywhere in messages, or return None if there are none."""
+        file_paths = [path for msg in messages for path in msg.get("file_paths") or []]
+        if not file_paths:
+            return None
+        uploads = AsyncUploadScheduler(self.client.files, self._register_file_source, self.client.max_upload_workers)
+        uploads.submit(file_paths)
+        return uploads
+
+    async def _stream_create(self, messages: List[Dict[str, Any]], model: str,
+                             output_dir: Optional[str] = None) -> AsyncIterator[StreamEvent]:
+        """Yield delta events for every message of a chat completion as they arrive."""
+        uploads = None
+        try:
+            uploads = self._schedule_uploads(messages)
+            conversation_id = await self._start_conversation(model)
+            scope = self._artifact_scope(conversation_id, output_dir)
+            if uploads is not None:
+                uploads.bind(conversation_id)
+
+            for msg, preference_change, current_reasoning_state in self._message_plan(messages):
+                # Released as soon as the message is accepted, before its first event is yielded
+                async with self.client.reasoning_gate.hold(current_reasoning_state) as release:
+                    if preference_change is not None:
+                        await self.client.set_advanced_reasoning(preference_change)
+
+                    async for event in self._iter_message_events(conversation_id, msg, model,
+                                                                 current_reasoning_state, uploads, scope, release):
+                        yield event
+            await asyncio.to_thread(scope.flush)
+
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in chat completion: {str(e)}")
+        finally:
+            if uploads is not None:
+                uploads.shutdown()
+
+    async def create_batch(self, batch: List[List[Dict[str, Any]]], model: ModelType = "default",
+                           max_concurrency: int = 4, output_dir: Optional[str] = None) -> BatchResult:
+        """Run independent completions concurrently, one conversation each, preserving input order."""
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        started = time.monotonic()
+
+        async def run(index: int, messages: List[Dict[str, Any]]) -> JuliusResponse:
+            async with semaphore:
+                return await self.create(
+                    messages, model, output_dir=os.path.join(output_dir, f"item_{index}") if output_dir else None
+                )
+
+        outcomes = await asyncio.gather(*[run(i, m) for i, m in enumerate(batch)], return_exceptions=True)
+        return BatchResult(
+            results=[None if isinstance(o, Exception) else o for o in outcomes],
+            errors=[o if isinstance(o, Exception) else None for o in outcomes],
+            elapsed_seconds=time.monotonic() - started
+        )
+
+class AsyncConversation(Conversation):
+    """asyncio counterpart of Conversation."""
+
+    async def wait(self, file_paths: List[str]) -> List[str]:
+        """Upload and register only the files this conversation has not seen; return their filenames."""
+        missing = [path for path in file_paths if self._known_filename(path) is None]
+        if missing:
+            uploads = AsyncUploadScheduler(self.client.files, self._register_once, self.client.max_upload_workers)
+            try:
+                uploads.submit(missing)
+                uploads.bind(self.conversation_id)
+                for file_path, filename in zip(missing, await uploads.wait(missing)):
+                    stat = os.stat(file_path)
+                    self._uploaded[os.path.abspath(file_path)] = (stat.st_size, stat.st_mtime_ns, filename)
+            finally:
+                uploads.shutdown()
+        return [self._known_filename(path) for path in file_paths]
+
+    async def _register_once(self, conversation_id: str, filename: str):
+        if filename not in self.sources:
+            await self.completions._register_file_source(conversation_id, filename)
+            self.sources.add(filename)
+
+    async def _apply_reasoning(self, advanced_reasoning: Optional[bool]):
+        await self.client.set_advanced_reasoning(self._turn_reasoning(advanced_reasoning))
+
+    async def send(self, content: str, file_paths: Optional[List[str]] = None,
+                   advanced_reasoning: Optional[bool] = None) -> JuliusResponse:
+        """Send one turn and return its response."""
+        try:
+            with self.client.instrumentation.call("conversation_turn") as timings:
+                async with self.client.reasoning_gate.hold(self._turn_reasoning(advanced_reasoning)) as release:
+                    await self._apply_reasoning(advanced_reasoning)
+                    message = self._message(content, file_paths)
+                    response_data = await self.completions._send_message(
+                        self.conversation_id, message, self.model, self.advanced_reasoning, self, self.scope,
+                        release
+                    )
+                await asyncio.to_thread(self.scope.flush)
+            return JuliusResponse(
+                id=self.conversation_id,
+                choices=[Choice(
+                    index=0,
+                    message=JuliusMessage(
+                        role="assistant",
+                        content=response_data['content']
+                    )
+                )],
+                created=int(datetime.now().timestamp()),
+                model=self.model,
+                timings=timings.snapshot(),
+                code_blocks=response_data['code_blocks']
             )
-            response.raise_for_status()
-            return response.json()
+        except (StreamInterruptedError, RateLimitedError):
+            raise
+        except Exception as e:
+            raise Exception(f"Error in conversation turn: {str(e)}")
+
+    async def stream(self, content: str, file_paths: Optional[List[str]] = None,
+                     advanced_reasoning: Optional[bool] = None) -> AsyncIterator[StreamEvent]:
+        """Send one turn and yield its delta events as they arrive."""
+        try:
+            # Released as soon as the message is accepted, before its first event is yielded
+            async with self.client.reasoning_gate.hold(self._turn_reasoning(advanced_reasoning)) as release:
+                await self._apply_reasoning(advanced_reasoning)
+                message = self._message(content, file_paths)
+                async for event in self.completions._iter_message_events(
+                    self.conversation_id, message, self.model, self.advanced_reasoning, self, self.scope,
+                    release
+                ):
+                    yield event
+            await asyncio.to_thread(self.scope.flush)
+        except (StreamInterruptedError, RateLimitedError):
+            raise
         except Exception as e:
-            raise Exception(f"Failed to set advanced reasoning: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error in conversation turn: {str(e)}")
+
+class AsyncConversations(Conversations):
+    async def open(self, model: ModelType = "default", output_dir: Optional[str] = None) -> AsyncConversation:
+        """Start a conversation that can be sent several turns."""
+        try:
+            completions = self.client.chat.completions
+            conversation_id = await completions._start_conversation(model)
+            return AsyncConversation(
+                completions, conversation_id, model, completions._artifact_scope(conversation_id, output_dir)
+            )
+        except Exception as e:
+            raise Exception(f"Error opening conversation: {str(e)}")
+
+class AsyncJulius(_JuliusBase):
+    _transport_type = AsyncTransport
+    _gate_type = AsyncReasoningGate
+    _files_type = AsyncFiles
+    _completions_type = AsyncChatCompletions
+    _conversations_type = AsyncConversations
+    _image_semaphore = None
+
+    @property
+    def image_semaphore(self) -> asyncio.Semaphore:
+        """Limit on concurrent image downloads shared by every conversation on this client."""
+        if self._image_semaphore is None:
+            self._image_semaphore = asyncio.Semaphore(self.max_image_workers)
+        return self._image_semaphore
+
+    @property
+    def preference_lock(self) -> asyncio.Lock:
+        """Serializes advanced-reasoning changes made through this client."""
+        if self._preference_lock is None:
+            self._preference_lock = asyncio.Lock()
+        return self._preference_lock
+
+    async def close(self):
+        """Release the pooled connections and artifact writers held by this client."""
+        await self.transport.close()
+        if self._artifact_executor is not None:
+            await asyncio.to_thread(self._artifact_executor.shutdown, wait=True)
+            self._artifact_executor = None
+        if self.transcoder is not None:
+            await asyncio.to_thread(self.transcoder.close)
+        if self.upload_index is not None:
+            self.upload_index.flush()
+        if self.cassette is not None:
+            self.cassette.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def set_advanced_reasoning(self, enabled: bool = True, force: bool = False):
+        """Set advanced reasoning mode preference, skipping the PATCH when nothing would change."""
+        enabled = bool(enabled)
+        async with self.preference_lock:
+            if not force and self.reasoning_preference.is_current(enabled):
+                return self.reasoning_preference.last_result
+            started = time.perf_counter()
+            try:
+                async with self.transport.patch(
+                    f"{self.base_url}/api/user_preferences",
+                    headers=self.headers,
+                    json={
+                        "preferences": {
+                            "advanced_reasoning": enabled
+                        }
+                    }
+                ) as response:
+                    response.raise_for_status()
+                    result = await response.json(content_type=None)
+            except Exception as e:
+                self.reasoning_preference.confirm(None, None, time.perf_counter() - started)
+                raise Exception(f"Failed to set advanced reasoning: {str(e)}")
+            self.reasoning_preference.confirm(enabled, result, time.perf_counter() - started)
+            return result
@@ -0,0 +1,186 @@
+"""
+Command-line entry point for the Julius API, installed as `julius`.
+
+    julius upload data.csv more.xlsx          upload files, printing each server filename
+    julius ls [--json]                        list the files on your hub
+    julius ask "Plot revenue by month" -f data.csv
+    julius batch prompts.jsonl > answers.jsonl
+
+The token is read from JULIUS_API_TOKEN (and the API address from JULIUS_BASE_URL, if set).
+`ask` streams the answer to stdout as it arrives; where generated code and outputs were saved
+goes to stderr, so stdout can be piped. A prompt of "-" is read from stdin.
+
+`batch` reads one job per line, either a JSON string prompt or an object
+{"prompt": "...", "file_paths": [...], "advanced_reasoning": false}, and writes one JSON
+result per line in input order: {"index", "conversation_id", "content"} or {"index", "error"}.
+
+Every invocation starts a fresh interpreter, so julius_api is imported only once the arguments
+are parsed (`julius --help` never loads it) and its heavy dependencies load only when needed.
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List
+
+EXIT_USAGE = 2
+
+
+def _client(args):
+    """A client for this invocation, or exit with a usage error when no token is set."""
+    api_key = os.environ.get("JULIUS_API_TOKEN")
+    if not api_key:
+        print("julius: set JULIUS_API_TOKEN to your Julius API token", file=sys.stderr)
+        sys.exit(EXIT_USAGE)
+
+    from julius_api import Julius
+    return Julius(api_key=api_key, base_url=args.base_url)
+
+
+def _message(prompt: str, file_paths: List[str], advanced_reasoning: bool) -> Dict[str, Any]:
+    message = {"role": "user", "content": prompt}
+    if file_paths:
+        message["file_paths"] = file_paths
+    if advanced_reasoning:
+        message["advanced_reasoning"] = True
+    return message
+
+
+def _read_prompt(prompt: str) -> str:
+    return sys.stdin.read() if prompt == "-" else prompt
+
+
+def cmd_upload(args, client) -> int:
+    for path in args.files:
+        print(client.files.upload(path, dedupe=not args.no_dedupe), flush=True)
+    return 0
+
+
+def cmd_ls(args, client) -> int:
+    files = client.files.list_files()
+    if args.json:
+        json.dump(files, sys.stdout, indent=2)
+        print()
+        return 0
+    for entry in files:
+        name = entry.get("name") or entry.get("filename") or entry.get("file_name") or ""
+        size = entry.get("size")
+        print(f"{size if size is not None else '-':>12}  {name}")
+    return 0
+
+
+def cmd_ask(args, client) -> int:
+    from julius_api import ContentDelta, MessageDone
+
+    message = _message(_read_prompt(args.prompt), args.file, args.advanced_reasoning)
+    events = client.chat.completions.create(
+        messages=[message], model=args.model, stream=True, output_dir=args.output_dir
+    )
+    for event in events:
+        if isinstance(event, ContentDelta):
+            sys.stdout.write(event.text)
+            sys.stdout.flush()
+        elif isinstance(event, MessageDone):
+            print()
+            for code_location, _, output_location, _ in event.code_blocks:
+                print(f"code: {code_location}", file=sys.stderr)
+                print(f"output: {output_location}", file=sys.stderr)
+    return 0
+
+
+def _batch_jobs(lines) -> List[Dict[str, Any]]:
+    jobs = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise Exception(f"Invalid JSON on line {number}: {str(e)}")
+        if isinstance(job, str):
+            job = {"prompt": job}
+        if not isinstance(job, dict) or not isinstance(job.get("prompt"), str):
+            raise Exception(f"Line {number} needs a prompt string or an object with a \"prompt\"")
+        jobs.append(job)
+    return jobs
+
+
+def cmd_batch(args, client) -> int:
+    if args.jobs == "-":
+        jobs = _batch_jobs(sys.stdin)
+    else:
+        with open(args.jobs, encoding="utf-8") as f:
+            jobs = _batch_jobs(f)
+
+    batch = [
+        [_message(job["prompt"], job.get("file_paths") or [], bool(job.get("advanced_reasoning")))]
+        for job in jobs
+    ]
+    result = client.chat.completions.create_batch(
+        batch, model=args.model, max_concurrency=args.concurrency, output_dir=args.output_dir
+    )
+    for index, (response, error) in enumerate(zip(result.results, result.errors)):
+        if error is not None:
+            record = {"index": index, "error": str(error)}
+        else:
+            record = {"index": index, "conversation_id": response.id, "content": response.message.content}
+        print(json.dumps(record), flush=True)
+    return 1 if any(error is not None for error in result.errors) else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="julius", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--base-url", default=os.environ.get("JULIUS_BASE_URL", "https://api.julius.ai"),
+                        help="API address (default: $JULIUS_BASE_URL or https://api.julius.ai)")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+
+    upload = commands.add_parser("upload", help="upload files to your hub")
+    upload.add_argument("files", nargs="+", metavar="FILE")
+    upload.add_argument("--no-dedupe", action="store_true", help="upload even if an identical file was sent before")
+    upload.set_defaults(handler=cmd_upload)
+
+    ls = commands.add_parser("ls", help="list the files on your hub")
+    ls.add_argument("--json", action="store_true", help="print the raw file entries as JSON")
+    ls.set_defaults(handler=cmd_ls)
+
+    ask = commands.add_parser("ask", help="ask a question and stream the answer to stdout")
+    ask.add_argument("prompt", help='the question, or "-" to read it from stdin')
+    ask.add_argument("-f", "--file", action="append", default=[], metavar="FILE",
+                     help="attach a file (repeatable)")
+    ask.add_argument("--model", default="default")
+    ask.add_argument("--advanced-reasoning", action="store_true")
+    ask.add_argument("--output-dir", help="save generated code and outputs here instead of ./outputs/<conversation_id>")
+    ask.set_defaults(handler=cmd_ask)
+
+    batch = commands.add_parser("batch", help="answer a JSONL file of prompts, one JSON result per line")
+    batch.add_argument("jobs", metavar="FILE.jsonl", help='one prompt per line, or "-" to read from stdin')
+    batch.add_argument("--model", default="default")
+    batch.add_argument("--concurrency", type=int, default=4)
+    batch.add_argument("--output-dir", help="save each item's artifacts under this directory")
+    batch.set_defaults(handler=cmd_batch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    client = _client(args)
+    try:
+        return args.handler(args, client)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # Reader went away (e.g. `julius ask ... | head`); don't let the interpreter complain at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except Exception as e:
+        print(f"julius: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
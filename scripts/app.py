@@ -1,152 +1,448 @@
-import os
-import requests
+"""
+Streaming HTTP gateway in front of the Julius API, built on julius_api.
+
+POST /send with {"prompt": "...", "model": "default", "advanced_reasoning": false, "file_paths": []}
+starts a conversation and forwards every chunk of the answer as soon as it arrives:
+
+    Accept: application/x-ndjson (default)   one upstream JSON chunk per line
+    Accept: text/event-stream                the same chunks as Server-Sent Events
+    Accept: application/json / ?format=json  the previous buffered reply with parsed_chunks
+
+All requests share one client, so connections to the API are pooled and reused. Identical
+requests that arrive while one is in flight (same normalized prompt, model, reasoning flag and
+attached file contents) join that upstream call instead of starting their own, and receive
+its whole stream from the first chunk. GET /metrics reports the coalescing ratio.
+
+The token is read from JULIUS_API_TOKEN. Set JULIUS_GATEWAY_RECORD_DIR (or --record-dir) to
+also write each answer to julius_response_<conversation_id>.ndjson as it streams.
+
+file_paths are only accepted when JULIUS_GATEWAY_UPLOAD_ROOT (or --upload-root) is set. Each one
+must be a relative path to an existing file under that directory; anything else is a 400.
+
+    python -m scripts.app --port 5000
+    gunicorn -w 4 -k gthread --threads 32 'scripts.app:create_app()'
+"""
+import argparse
+import hashlib
 import json
-from flask import Flask, request, jsonify
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response, jsonify, request
 
-app = Flask(__name__)
+from julius_api import ClientMetrics, Julius, StreamDecoder, TransportConfig, _file_content_hash
 
-# 1) Paste your fresh Julius token here
-#    e.g. "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZC..."
-#    Do NOT include "Bearer " in front— we'll add that in code.
-JULIUS_TOKEN = "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6InJoM0dwdVZXd2JMMTJpYnBtamlxWCJ9.eyJodHRwczovL2NoYXR3aXRoeW91cmRhdGEuaW8vdXNlcl9lbWFpbCI6ImFyeWFuZ3VsQHN0YW5mb3JkLmVkdSIsImh0dHBzOi8vY2hhdHdpdGh5b3VyZGF0YS5pby91c2VyX2lwIjoiMjYwMzo4MDAxOmY4NDA6MWI6Njg5OTo2ZjEwOmJkOWQ6YWNiZCIsImh0dHBzOi8vY2hhdHdpdGh5b3VyZGF0YS5pby91c2VyX2NvdW50cnlDb2RlIjoiVVMiLCJodHRwczovL2NoYXR3aXRoeW91cmRhdGEuaW8vdXNlcl9jb250aW5lbnRDb2RlIjoiTkEiLCJodHRwczovL2NoYXR3aXRoeW91cmRhdGEuaW8vZW1haWxfdmVyaWZpZWQiOnRydWUsImh0dHBzOi8vY2hhdHdpdGh5b3VyZGF0YS5pby9jcmVhdGVkX2F0IjoiMjAyMy0xMi0wMVQwMzoxNTo0OC45NTRaIiwiaXNzIjoiaHR0cHM6Ly9hdXRoLmp1bGl1cy5haS8iLCJzdWIiOiJnb29nbGUtb2F1dGgyfDExMDMyMzI1NTU3MTAxNDc4MzY5NyIsImF1ZCI6WyJodHRwczovL2NoYXR3aXRoeW91cmRhdGEuaW8iLCJodHRwczovL2NoYXR3aXRoeW91cmRhdGEudXMuYXV0aDAuY29tL3VzZXJpbmZvIl0sImlhdCI6MTczNTA4NjYwNCwiZXhwIjoxNzM3Njc4NjA0LCJzY29wZSI6Im9wZW5pZCBwcm9maWxlIGVtYWlsIG9mZmxpbmVfYWNjZXNzIiwiYXpwIjoiUVhUc1dEbHR5VEkxVnJSSE9RUlJmVHRHMWNmNFlESzgifQ.G-BVjbI7mmAKLkLeWaGvixvq891LSrnYw2KiSk5NXcurN8R9dG_oR02on5sfGM6T2PH7Z2ZVbS0FuacL5wHJXLd0wnF20B5XsdJpElJdmkD8Mvxc7rpHJDPpbM3_e2xVSOSHYLEPq059wLX7iuQiu6hNYa5roTpDA418oORR4JMJZZy9n5gFkfmVk7pMfMn4HMEa9vpMn_XHeNyU9WaEKC5Rl3utr9jCQsUxDP1X7tbFtyAtoxlebEndEwtLkmvVMYO_bQLKJ86yvwA884PnoNwuBgTmEAc3ogEbHc5G9oyJhfCfK40jJKttd0u8X8l6KvaGfh5gv640gI89Bl_3KA"
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+    "json": "application/json",
+}
 
-# 2) Base Julius endpoint
-BASE_URL = "https://api.julius.ai"
 
+class PassthroughDecoder(StreamDecoder):
+    """StreamDecoder that also keeps each decoded chunk's raw line for forwarding, until drained.
 
-@app.route("/send", methods=["POST"])
-def send_message():
+    Blank and malformed lines, and chunks replayed after a stream re-attach, are not kept.
+    Gateway.chunks drains it after every read, so it holds one read's lines at most.
     """
-    Receives JSON: { "prompt": "Hello Julius!" }
-    1) Starts a new conversation via /api/chat/start
-    2) Sends the prompt via /api/chat/message
-    3) Returns a JSON with:
-       {
-         "conversation_id": ...,
-         "parsed_chunks": [...],
-         "saved_file": "filename.json"
-       }
+
+    def __init__(self):
+        super().__init__()
+        self.lines: List[bytes] = []
+
+    def decode_line(self, line: bytes):
+        before = self.chunk_count
+        events = super().decode_line(line)
+        if self.chunk_count > before:
+            self.lines.append(line.strip())
+        return events
+
+    def drain(self) -> List[bytes]:
+        lines, self.lines = self.lines, []
+        return lines
+
+
+class Flight:
+    """One upstream call whose chunks are fanned out to every request that joined it.
+
+    Each request subscribes for a cursor, and a chunk is dropped once every subscribed cursor
+    is past it. Until the first chunk is dropped a request can still join and replay the
+    answer from its first chunk; after that subscribe returns None, and an identical request
+    starts a call of its own.
     """
 
-    data = request.json or {}
-    user_prompt = data.get("prompt", "")
-    if not user_prompt:
-        return jsonify({"error": "Please provide a 'prompt'"}), 400
+    def __init__(self, key: str):
+        self.key = key
+        self.conversation_id: Optional[str] = None
+        self.decoder = PassthroughDecoder()
+        self.lines: List[bytes] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._condition = threading.Condition()
+        self._base = 0  # Index in the whole answer of self.lines[0]
+        self._cursors: Dict[int, int] = {}
+        self._next_cursor = 0
 
-    # Check if token is present
-    if not JULIUS_TOKEN or "PASTE_THE_JWT_TOKEN_HERE" in JULIUS_TOKEN:
-        return jsonify({
-            "error": "Your Julius token is missing or still set to the placeholder. Paste it into the script!"
-        }), 401
+    def subscribe(self) -> Optional[int]:
+        """A cursor at the answer's first chunk, or None once chunks have been dropped."""
+        with self._condition:
+            if self._base:
+                return None
+            cursor = self._next_cursor
+            self._next_cursor += 1
+            self._cursors[cursor] = 0
+            return cursor
 
-    # Step 1: Start a new conversation
-    conversation_id = start_conversation(JULIUS_TOKEN)
-    if not conversation_id:
-        return jsonify({"error": "Failed to start conversation."}), 500
+    def unsubscribe(self, cursor: int):
+        with self._condition:
+            self._cursors.pop(cursor, None)
+            self._trim()
 
-    # Step 2: Send the user prompt (which now captures & stores multiple JSON chunks)
-    parsed_chunks, output_file, final_output = post_message(conversation_id, user_prompt, JULIUS_TOKEN)
+    def _trim(self):
+        """Drop the chunks every cursor has read; the caller holds the condition."""
+        read = min(self._cursors.values(), default=self._base + len(self.lines))
+        if read > self._base:
+            del self.lines[:read - self._base]
+            self._base = read
 
-    if not parsed_chunks:
-        return jsonify({"error": "Failed to send message or parse chunks."}), 500
+    def start(self, conversation_id: str):
+        with self._condition:
+            self.conversation_id = conversation_id
+            self._condition.notify_all()
 
-    return jsonify({
-        "conversation_id": conversation_id,
-        "parsed_chunks": parsed_chunks,
-        "saved_file": output_file,
-        "final_output": final_output
-    })
+    def publish(self, line: bytes):
+        with self._condition:
+            self.lines.append(line)
+            self._trim()
+            self._condition.notify_all()
 
+    def finish(self, error: Optional[Exception] = None):
+        with self._condition:
+            self.error = error
+            self.done = True
+            self._condition.notify_all()
 
-def start_conversation(token: str) -> str:
-    """
-    Calls Julius's /api/chat/start to create a new conversation.
-    Returns the conversation ID (string) or an empty string if it fails.
-    """
-    url = f"{BASE_URL}/api/chat/start"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Origin": "https://julius.ai"
-    }
-    resp = requests.post(url, headers=headers, json={})
-    if resp.status_code == 200:
-        data = resp.json()
-        # e.g. { "id": "05d3d5e1-a1d9-481a-b658-d2cba143436a", ... }
-        conversation_id = data.get("id", "")
-        if conversation_id:
-            print(f"Started conversation: {conversation_id}")
-            return conversation_id
+    def wait_started(self) -> str:
+        """Block until the conversation is started; raise if the upstream call failed before that."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.conversation_id is not None or self.done)
+            if self.conversation_id is None:
+                raise self.error or Exception("Failed to start conversation.")
+            return self.conversation_id
+
+    def follow(self, cursor: int) -> Iterator[bytes]:
+        """Yield every chunk of the answer from cursor, waiting for new ones until the call ends.
 
-    print("start_conversation error:", resp.status_code, resp.text)
-    return ""
+        The cursor is released when the iteration ends or is closed.
+        """
+        try:
+            while True:
+                with self._condition:
+                    position = self._cursors[cursor]
+                    self._condition.wait_for(lambda: position < self._base + len(self.lines) or self.done)
+                    lines = self.lines[position - self._base:]
+                    done, error = self.done, self.error
+                    self._cursors[cursor] = position + len(lines)
+                    self._trim()
+                yield from lines
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.unsubscribe(cursor)
 
 
-def post_message(conversation_id: str, prompt: str, token: str):
-    """
-    Calls Julius's /api/chat/message to send 'prompt'.
-    Because Julius may return multiple JSON objects in a single response,
-    we manually parse them line-by-line, store them in a local JSON file,
-    and return them as a list.
+class InvalidFilePath(ValueError):
+    """A requested file path that is not a file under the gateway's upload root."""
 
-    Returns a tuple: (list_of_parsed_chunks, json_filename)
-    """
-    url = f"{BASE_URL}/api/chat/message"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "conversation-id": conversation_id,
-        "Origin": "https://julius.ai"
-    }
-    payload = {
-        "message": {
-            "content": prompt
-        },
-        "provider": "default",
-        "chat_mode": "auto",
-        "client_version": "20240130",
-        "theme": "light"
+
+class Gateway:
+    """Relays prompts to the API over one shared client, coalescing identical in-flight requests."""
+
+    def __init__(self, client: Julius, record_dir: Optional[str] = None, coalesce: bool = True,
+                 upload_root: Optional[str] = None):
+        self.client = client
+        self.completions = client.chat.completions
+        self.record_dir = record_dir
+        self.coalesce = coalesce
+        self.upload_root = os.path.realpath(upload_root) if upload_root else None
+        self.metrics = ClientMetrics()
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def resolve_path(self, file_path) -> str:
+        """Map a requested relative path to a file under upload_root, or raise InvalidFilePath."""
+        if self.upload_root is None:
+            raise InvalidFilePath("file_paths are not accepted by this gateway (no upload root configured)")
+        if not isinstance(file_path, str) or not file_path:
+            raise InvalidFilePath(f"Invalid file path: {file_path!r}")
+        parts = file_path.replace("\\", "/").split("/")
+        if os.path.isabs(file_path) or file_path.startswith(("/", "\\")) or ".." in parts:
+            raise InvalidFilePath(f"File paths must be relative to the upload root: {file_path}")
+        resolved = os.path.realpath(os.path.join(self.upload_root, file_path))
+        # realpath also follows symlinks, so a link pointing outside the root is rejected here
+        if os.path.commonpath([self.upload_root, resolved]) != self.upload_root:
+            raise InvalidFilePath(f"File paths must be relative to the upload root: {file_path}")
+        if not os.path.isfile(resolved):
+            raise InvalidFilePath(f"No such file: {file_path}")
+        return resolved
+
+    def request_key(self, prompt: str, model: str, advanced_reasoning: Optional[bool], file_paths: List[str]) -> str:
+        """Identity of a request: whitespace-normalized prompt, model, reasoning flag and file contents."""
+        material = json.dumps({
+            "prompt": " ".join(prompt.split()),
+            "model": model,
+            "advanced_reasoning": advanced_reasoning,
+            "files": [_file_content_hash(self.client, path) for path in file_paths]
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def join(self, prompt: str, model: str = "default", advanced_reasoning: Optional[bool] = None,
+             file_paths: Optional[List[str]] = None) -> Tuple[Flight, int]:
+        """Return the in-flight call for an identical request, or start a new one, with a cursor to follow it.
+
+        Raises InvalidFilePath for a file path outside the upload root or that does not exist.
+        """
+        if file_paths is not None and not isinstance(file_paths, list):
+            raise InvalidFilePath("file_paths must be a list")
+        file_paths = [self.resolve_path(file_path) for file_path in file_paths or []]
+        key = self.request_key(prompt, model, advanced_reasoning, file_paths)
+        self.metrics.increment("requests")
+        with self._lock:
+            flight = self._flights.get(key) if self.coalesce else None
+            cursor = flight.subscribe() if flight is not None else None
+            if cursor is not None:
+                self.metrics.increment("coalesced")
+                return flight, cursor
+            # No call in flight, or its first chunks are already dropped and can't be replayed
+            flight = Flight(key)
+            cursor = flight.subscribe()
+            if self.coalesce:
+                self._flights[key] = flight
+        self.metrics.increment("upstream_calls")
+        threading.Thread(
+            target=self._pump, args=(flight, prompt, model, advanced_reasoning, file_paths),
+            name="julius-gateway-flight", daemon=True
+        ).start()
+        return flight, cursor
+
+    def _pump(self, flight: Flight, prompt: str, model: str, advanced_reasoning: Optional[bool],
+              file_paths: List[str]):
+        """Run one upstream call to completion, independently of the requests following it."""
+        error = None
+        try:
+            # The reasoning preference is account-wide: keep it from changing until the message is accepted.
+            # Without a preference the message takes whatever value is set, so it needs no gate.
+            if advanced_reasoning is None:
+                conversation_id, response = self.open_stream(prompt, model, advanced_reasoning, file_paths)
+            else:
+                with self.client.reasoning_gate.hold(advanced_reasoning):
+                    conversation_id, response = self.open_stream(prompt, model, advanced_reasoning, file_paths)
+            flight.start(conversation_id)
+            for line in self.chunks(conversation_id, response, flight.decoder):
+                flight.publish(line)
+        except Exception as e:
+            error = e
+            self.metrics.increment("upstream_errors")
+        finally:
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            flight.finish(error)
+
+    def open_stream(self, prompt: str, model: str = "default", advanced_reasoning: Optional[bool] = None,
+                    file_paths: Optional[List[str]] = None):
+        """Start a conversation and send the prompt; return (conversation_id, upstream response)."""
+        if advanced_reasoning is not None:
+            self.client.set_advanced_reasoning(bool(advanced_reasoning))
+        conversation_id = self.completions._start_conversation(model)
+        if not conversation_id:
+            raise Exception("Failed to start conversation.")
+        new_attachments = {}
+        for file_path in file_paths or []:
+            filename = self.client.files.upload(file_path)
+            self.completions._register_file_source(conversation_id, filename)
+            new_attachments[filename] = self.completions._attachment_entry(filename)
+        payload = self.completions._message_payload(
+            {"content": prompt}, model, new_attachments, bool(advanced_reasoning)
+        )
+        response = self.client.transport.post(
+            f"{self.client.base_url}/api/chat/message",
+            headers={**self.client.headers, "conversation-id": conversation_id},
+            json=payload,
+            stream=True
+        )
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return conversation_id, response
+
+    def chunks(self, conversation_id: str, response, decoder: PassthroughDecoder) -> Iterator[bytes]:
+        """Yield the raw NDJSON lines of an answer as they arrive, recording them when enabled."""
+        record = None
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+            record = open(os.path.join(self.record_dir, f"julius_response_{conversation_id}.ndjson"), 'wb')
+        try:
+            for data in self.completions._stream_bytes(response, conversation_id, decoder):
+                decoder.feed(data)
+                for line in decoder.drain():
+                    if record is not None:
+                        record.write(line + b"\n")
+                    yield line
+            decoder.close()
+            for line in decoder.drain():
+                if record is not None:
+                    record.write(line + b"\n")
+                yield line
+        finally:
+            response.close()
+            if record is not None:
+                record.close()
+
+    def stats(self) -> Dict[str, float]:
+        """Gateway counters plus coalescing_ratio, the share of requests served by another request's call."""
+        counters = self.metrics.snapshot()
+        requests_seen = counters.get("requests", 0)
+        with self._lock:
+            counters["in_flight"] = len(self._flights)
+        counters["coalescing_ratio"] = counters.get("coalesced", 0) / requests_seen if requests_seen else 0.0
+        return counters
+
+
+def _response_format() -> str:
+    requested = request.args.get("format") or (request.get_json(silent=True) or {}).get("format")
+    if requested in FORMATS:
+        return requested
+    best = request.accept_mimetypes.best_match(
+        [FORMATS["ndjson"], FORMATS["sse"], FORMATS["json"]], default=FORMATS["ndjson"]
+    )
+    return {mimetype: name for name, mimetype in FORMATS.items()}[best]
+
+
+def _done(flight: Flight) -> dict:
+    return {
+        "conversation_id": flight.conversation_id,
+        "final_output": flight.decoder.content,
+        "chunks": flight.decoder.chunk_count
     }
 
-    resp = requests.post(url, headers=headers, json=payload)
-    if resp.status_code != 200:
-        print("post_message error:", resp.status_code, resp.text)
-        return ([], "", "")
 
-    # Instead of resp.json(), parse multiple JSON objects from resp.text
-    resp_text = resp.text
-    final_output = ""
+def ndjson_body(flight: Flight, cursor: int) -> Iterator[bytes]:
+    try:
+        for line in flight.follow(cursor):
+            yield line + b"\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e), "conversation_id": flight.conversation_id}).encode('utf-8') + b"\n"
+
+
+def sse_body(flight: Flight, cursor: int) -> Iterator[bytes]:
+    yield f"event: start\ndata: {json.dumps({'conversation_id': flight.conversation_id})}\n\n".encode('utf-8')
+    try:
+        for line in flight.follow(cursor):
+            yield b"data: " + line + b"\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode('utf-8')
+        return
+    yield f"event: done\ndata: {json.dumps(_done(flight))}\n\n".encode('utf-8')
+
+
+def create_app(client: Optional[Julius] = None, record_dir: Optional[str] = None,
+               coalesce: Optional[bool] = None, upload_root: Optional[str] = None) -> Flask:
+    """Build the gateway app; without a client, one is created from JULIUS_API_TOKEN."""
+    if client is None:
+        token = os.getenv("JULIUS_API_TOKEN")
+        if not token:
+            raise RuntimeError("Set JULIUS_API_TOKEN to your Julius token (without 'Bearer ').")
+        pool_size = int(os.getenv("JULIUS_GATEWAY_POOL_SIZE", "32"))
+        client = Julius(
+            api_key=token,
+            base_url=os.getenv("JULIUS_BASE_URL", "https://api.julius.ai"),
+            transport_config=TransportConfig(pool_maxsize=pool_size)
+        )
+    if coalesce is None:
+        coalesce = os.getenv("JULIUS_GATEWAY_COALESCE", "1") != "0"
+    gateway = Gateway(
+        client, record_dir if record_dir is not None else os.getenv("JULIUS_GATEWAY_RECORD_DIR"), coalesce,
+        upload_root if upload_root is not None else os.getenv("JULIUS_GATEWAY_UPLOAD_ROOT")
+    )
 
-    parsed_chunks = []
-    for line in resp_text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
+    app = Flask(__name__)
+    app.config["GATEWAY"] = gateway
+
+    @app.route("/send", methods=["POST"])
+    def send_message():
+        """Start (or join) a conversation for the prompt and stream the answer in the negotiated format."""
+        data = request.get_json(silent=True) or {}
+        user_prompt = data.get("prompt", "")
+        if not user_prompt:
+            return jsonify({"error": "Please provide a 'prompt'"}), 400
+        response_format = _response_format()
+
+        try:
+            flight, cursor = gateway.join(
+                user_prompt, data.get("model", "default"), data.get("advanced_reasoning"), data.get("file_paths")
+            )
+        except InvalidFilePath as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": f"Failed to send message: {str(e)}"}), 502
         try:
-            data = json.loads(line)
-            parsed_chunks.append(data)
-        except json.JSONDecodeError:
-            # If a line doesn't parse, ignore or log
-            print(f"Skipping line that didn't parse as JSON:\n{line}\n")
+            conversation_id = flight.wait_started()
+        except Exception as e:
+            flight.unsubscribe(cursor)
+            return jsonify({"error": f"Failed to send message: {str(e)}"}), 502
+
+        if response_format == "json":
+            try:
+                parsed_chunks = [json.loads(line) for line in flight.follow(cursor)]
+            except Exception as e:
+                return jsonify({"error": f"Failed to read answer: {str(e)}", "conversation_id": conversation_id}), 502
+            return jsonify({
+                "conversation_id": conversation_id,
+                "parsed_chunks": parsed_chunks,
+                "saved_file": os.path.join(gateway.record_dir, f"julius_response_{conversation_id}.ndjson")
+                              if gateway.record_dir else None,
+                "final_output": flight.decoder.content
+            })
+
+        body = sse_body if response_format == "sse" else ndjson_body
+        response = Response(
+            body(flight, cursor),
+            mimetype=FORMATS[response_format],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Conversation-Id": conversation_id}
+        )
+        # Also releases the cursor of a client that disconnects before its body starts
+        response.call_on_close(lambda: flight.unsubscribe(cursor))
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """Gateway coalescing counters and the shared client's counters."""
+        return jsonify({"gateway": gateway.stats(), "client": gateway.client.metrics.snapshot()})
 
-    # Save all parsed chunks to a file named after the conversation ID.
-    # e.g. "julius_response_fb08fe0b-d099-b524.json"
-    filename = f"julius_response_{conversation_id}.json"
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(parsed_chunks, f, indent=2, ensure_ascii=False)
+    return app
 
-    print(f"Saved {len(parsed_chunks)} chunk(s) to {filename}")
 
-    final_output = ""
-    for chunk in parsed_chunks:
-        if chunk.get("role") == "assistant" or chunk.get("role") == "":
-            content = chunk.get("content", "")
-            if content:
-                final_output += content
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--record-dir", help="write every streamed answer to this directory")
+    parser.add_argument("--upload-root", help="accept file_paths relative to this directory (default: none accepted)")
+    parser.add_argument("--no-coalesce", action="store_true", help="give every request its own upstream call")
+    parser.add_argument("--debug", action="store_true", help="run Flask's debugger and reloader")
+    args = parser.parse_args()
 
-    return (parsed_chunks, filename, final_output)
+    app = create_app(record_dir=args.record_dir, coalesce=False if args.no_coalesce else None,
+                     upload_root=args.upload_root)
+    # One thread per request; every thread shares the client's connection pool
+    app.run(host=args.host, port=args.port, debug=args.debug, threaded=True)
 
 
 if __name__ == "__main__":
-    # Run the Flask app locally on port 5000
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    main()
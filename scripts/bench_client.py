@@ -0,0 +1,191 @@
+"""
+End-to-end benchmark of julius_api against the local stand-in server (scripts/stub_server.py).
+
+Runs Files.upload and chat.completions.create at increasing concurrency and reports, per level,
+requests/sec, end-to-end latency percentiles, per-phase latency (the client's http.* and stream.*
+trace events) and memory.
+
+    python -m scripts.bench_client --concurrency 1,4,16 --ops 64 --latency 0.02
+    python -m scripts.bench_client --url http://127.0.0.1:8765 --only create --json results.json
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from julius_api import Julius, TraceEvent, TransportConfig
+from scripts.stub_server import StubConfig, StubServer
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class PhaseRecorder:
+    """Tracer keeping every HTTP phase and stream milestone sample, for exact percentiles."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: TraceEvent):
+        if event.name.startswith("call."):
+            return
+        with self._lock:
+            self.samples.setdefault(event.name, []).append(event.seconds)
+
+    @property
+    def http_requests(self) -> int:
+        return sum(len(values) for name, values in self.samples.items() if name.startswith("http."))
+
+
+def make_files(directory: str, count: int, size_kb: int) -> List[str]:
+    """Distinct CSV files so every upload really transfers its bytes."""
+    paths = []
+    row = ("1,2,3,4,5,6,7,8\n" * 64).encode()
+    for i in range(count):
+        path = os.path.join(directory, f"bench_{i}.csv")
+        with open(path, "wb") as f:
+            f.write(f"run,{i}\n".encode())
+            while f.tell() < size_kb * 1024:
+                f.write(row)
+        paths.append(path)
+    return paths
+
+
+def run_level(args, base_url: str, workload: str, concurrency: int, files: List[str], workdir: str) -> Dict:
+    recorder = PhaseRecorder()
+    client = Julius(
+        api_key="bench",
+        base_url=base_url,
+        transport_config=TransportConfig(pool_maxsize=max(concurrency, 1), storage_pool_maxsize=max(concurrency, 1)),
+        dedupe_uploads=False,
+        max_image_workers=max(concurrency, 1),
+        tracers=[recorder],
+    )
+
+    def upload(i: int):
+        client.files.upload(files[i % len(files)], dedupe=False)
+
+    def create(i: int):
+        message = {"role": "user", "content": f"Summarize run {i}"}
+        if args.attach:
+            message["file_paths"] = [files[i % len(files)]]
+        client.chat.completions.create(
+            messages=[message], output_dir=os.path.join(workdir, "outputs", f"{concurrency}_{i}"), use_cache=False
+        )
+
+    operation = upload if workload == "upload" else create
+    latencies: List[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def timed_operation(i: int):
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            operation(i)
+        except Exception:
+            with lock:
+                failures += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed_operation, range(args.ops)))
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+        if args.trace_memory:
+            tracemalloc.stop()
+        client.close()
+
+    return {
+        "workload": workload,
+        "concurrency": concurrency,
+        "ops": args.ops,
+        "failures": failures,
+        "elapsed_seconds": elapsed,
+        "ops_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "requests_per_second": recorder.http_requests / elapsed if elapsed else 0.0,
+        "latency": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99)},
+        "phases": {name: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+                   for name, values in sorted(recorder.samples.items())},
+        "traced_peak_mb": peak / 1024 / 1024 if peak is not None else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def report(result: Dict):
+    memory = f"peak {result['traced_peak_mb']:.1f} MB traced, " if result["traced_peak_mb"] is not None else ""
+    print(f"\n{result['workload']} x{result['concurrency']}: {result['ops_per_second']:.1f} ops/s, "
+          f"{result['requests_per_second']:.1f} HTTP req/s, {result['failures']} failed, "
+          f"{memory}max RSS {result['max_rss_mb']:.0f} MB")
+    latency = result["latency"]
+    print(f"  {'end-to-end':<26} p50 {latency['p50'] * 1000:8.1f} ms  p95 {latency['p95'] * 1000:8.1f} ms  "
+          f"p99 {latency['p99'] * 1000:8.1f} ms")
+    for name, phase in result["phases"].items():
+        print(f"  {name:<26} p50 {phase['p50'] * 1000:8.1f} ms  p95 {phase['p95'] * 1000:8.1f} ms  "
+              f"({phase['count']} samples)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark an already running server instead of an embedded stub")
+    parser.add_argument("--only", choices=["upload", "create"], help="run a single workload")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated worker counts")
+    parser.add_argument("--ops", type=int, default=32, help="operations per concurrency level")
+    parser.add_argument("--file-size-kb", type=int, default=256)
+    parser.add_argument("--attach", action="store_true", help="attach a file to every create() call")
+    parser.add_argument("--trace-memory", action="store_true", help="measure peak Python allocations (slower)")
+    parser.add_argument("--json", help="write the results to this file")
+    # Embedded stub behaviour
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--chunks", type=int, default=100)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = None
+    if not args.url:
+        server = StubServer(StubConfig(latency=args.latency, chunks=args.chunks, chunk_delay=args.chunk_delay,
+                                       error_rate=args.error_rate, seed=0)).start()
+    base_url = args.url or server.url
+    workloads = [args.only] if args.only else ["upload", "create"]
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="julius-bench-") as workdir:
+            files = make_files(workdir, min(args.ops, 64), args.file_size_kb)
+            for workload in workloads:
+                for concurrency in levels:
+                    result = run_level(args, base_url, workload, concurrency, files, workdir)
+                    report(result)
+                    results.append(result)
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
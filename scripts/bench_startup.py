@@ -0,0 +1,101 @@
+"""
+Startup-time benchmark for julius_api and the `julius` command-line entry point.
+
+Every cron job or shell pipeline pays interpreter start plus imports on each invocation, so this
+runs each case in a fresh interpreter and reports min / median / max wall time over --runs:
+
+    bare           python -c pass (the floor)
+    import         python -c "import julius_api"
+    cli-help       julius --help (must not import julius_api)
+    cli-ls         julius ls against an embedded stub server (a full round trip)
+
+and, with --importtime, the slowest modules that `import julius_api` pulls in.
+
+    python -m scripts.bench_startup --runs 20
+    python -m scripts.bench_startup --importtime 15 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from scripts.stub_server import StubConfig, StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(command: List[str], env: Dict[str, str], runs: int) -> Dict:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - started)
+    return {"runs": runs, "min": min(samples), "median": statistics.median(samples), "max": max(samples)}
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Dict]:
+    """Modules with the largest cumulative import time under `python -X importtime -c "import julius_api"`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import julius_api"],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    modules, children = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]  # Drop the separator's space; what remains is indented two spaces per level
+        depth = (len(name) - len(name.lstrip())) // 2
+        entry = {"module": name.strip(), "self_us": int(own), "cumulative_us": int(cumulative)}
+        # A module is reported after everything it imported, so collect direct imports until their parent
+        if depth == 1:
+            children.append(entry)
+        elif depth == 0:
+            if entry["module"] == "julius_api":
+                modules = children + [entry]
+            children = []
+    return sorted(modules, key=lambda m: m["cumulative_us"], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per case")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="also list the N slowest imports of julius_api")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    env = {**os.environ, "JULIUS_API_TOKEN": "bench", "PYTHONPATH": ROOT}
+    # Compile once up front so every timed run loads bytecode rather than the first paying for it
+    subprocess.run([sys.executable, "-m", "py_compile", "julius_api.py", "julius_cli.py"], cwd=ROOT, check=True)
+
+    results = {}
+    with StubServer(StubConfig(latency=0.0, hub_files=50, seed=0)) as server:
+        env["JULIUS_BASE_URL"] = server.url
+        cases = {
+            "bare": [sys.executable, "-c", "pass"],
+            "import": [sys.executable, "-c", "import julius_api"],
+            "cli-help": [sys.executable, "julius_cli.py", "--help"],
+            "cli-ls": [sys.executable, "julius_cli.py", "ls"],
+        }
+        for name, command in cases.items():
+            results[name] = time_command(command, env, args.runs)
+            timing = results[name]
+            print(f"{name:<10} min {timing['min'] * 1000:7.1f} ms  median {timing['median'] * 1000:7.1f} ms  "
+                  f"max {timing['max'] * 1000:7.1f} ms")
+
+    if args.importtime:
+        results["slowest_imports"] = slowest_imports(env, args.importtime)
+        print("\nslowest imports of julius_api (cumulative):")
+        for module in results["slowest_imports"]:
+            print(f"  {module['cumulative_us'] / 1000:7.1f} ms  {module['module']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
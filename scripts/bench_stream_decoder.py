@@ -0,0 +1,151 @@
+"""
+Micro-benchmark for the /api/chat/message NDJSON stream decoder.
+
+Replays recorded streams (raw NDJSON such as scripts/app.py --record-dir writes, or
+parsed-chunk JSON arrays) or a synthetic multi-MB stream through julius_api.StreamDecoder and
+through the previous line-by-line decoding loop, and reports chunks/sec, MB/s and
+peak memory for each.
+
+    python -m scripts.bench_stream_decoder --size-mb 16
+    python -m scripts.bench_stream_decoder --replay recordings/julius_response_<id>.ndjson
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from julius_api import StreamDecoder, STREAM_READ_SIZE
+
+
+def synthetic_stream(size_mb: float) -> bytes:
+    """Build a stream shaped like a long analysis: many small tokens, code fragments and big outputs."""
+    target = int(size_mb * 1024 * 1024)
+    table = [{"NAME": f"Player {i}", "PPG": i * 0.7, "RPG": i * 0.3, "APG": i * 0.2} for i in range(2000)]
+    big_output = json.dumps({"type": "dataframe", "data": table})
+    lines = []
+    size = 0
+    i = 0
+    while size < target:
+        if i % 500 == 499:
+            chunk = {"outputs": [big_output]}
+        elif i % 50 == 49:
+            chunk = {"function_call": {"name": "python", "arguments": json.dumps({"python": f"df.describe()  # {i}"})}}
+        elif i % 200 == 199:
+            chunk = {"image_urls_dict": {f"image_{i}": f"https://example.invalid/images/{i}.png"}}
+        else:
+            chunk = {"role": "assistant", "content": f"token{i} "}
+        line = json.dumps(chunk).encode('utf-8') + b"\n"
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return b"".join(lines)
+
+
+def load_recording(path: str) -> bytes:
+    """Load a recorded stream: raw NDJSON, or a JSON array of parsed chunks."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.lstrip().startswith(b"["):
+        return b"".join(json.dumps(chunk).encode('utf-8') + b"\n" for chunk in json.loads(data))
+    return data
+
+
+def wire_pieces(stream: bytes, read_size: int):
+    """Split a stream into network-sized reads."""
+    return [stream[i:i + read_size] for i in range(0, len(stream), read_size)]
+
+
+def decode_with_stream_decoder(pieces) -> int:
+    decoder = StreamDecoder()
+    for piece in pieces:
+        decoder.feed(piece)
+    decoder.close()
+    decoder.content, decoder.code  # Materialize the joined strings like a caller would
+    return decoder.chunk_count
+
+
+def decode_legacy(pieces) -> int:
+    """The previous loop: requests-style iter_lines, json.loads per line and string concatenation."""
+    def iter_lines():
+        pending = None
+        for chunk in pieces:
+            if pending is not None:
+                chunk = pending + chunk
+            lines = chunk.splitlines()
+            pending = lines.pop() if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1] else None
+            yield from lines
+        if pending is not None:
+            yield pending
+
+    current_content = ""
+    accumulated_function = ""
+    accumulated_outputs = []
+    chunks = 0
+    for line in iter_lines():
+        if not line:
+            continue
+        try:
+            chunk = json.loads(line.decode('utf-8'))
+        except json.JSONDecodeError:
+            continue
+        chunks += 1
+        function_call = chunk.get('function_call', '')
+        if isinstance(function_call, dict) and 'arguments' in function_call:
+            try:
+                json.loads(function_call['arguments'])
+            except json.JSONDecodeError:
+                pass
+        if chunk.get('outputs'):
+            accumulated_outputs.extend(chunk['outputs'])
+        if chunk.get('content'):
+            current_content += chunk['content']
+        if isinstance(function_call, dict) and '"python":' in function_call.get('arguments', ''):
+            accumulated_function += function_call['arguments']
+    return chunks
+
+
+def measure(name: str, decode, pieces, total_bytes: int, repeat: int):
+    best = float('inf')
+    chunks = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = decode(pieces)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    decode(pieces)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<16} {chunks:>9} chunks  {chunks / best:>12,.0f} chunks/s  "
+          f"{total_bytes / best / 1024 / 1024:>8.1f} MB/s  peak {peak / 1024 / 1024:>7.1f} MB")
+    return chunks / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replay", nargs="*", default=[], help="recorded stream files to replay")
+    parser.add_argument("--size-mb", type=float, default=8.0, help="size of the synthetic stream")
+    parser.add_argument("--read-size", type=int, default=STREAM_READ_SIZE, help="bytes per simulated network read")
+    parser.add_argument("--legacy-read-size", type=int, default=512,
+                        help="read size of the legacy loop (requests' iter_lines default)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="only benchmark StreamDecoder")
+    args = parser.parse_args()
+
+    streams = [(path, load_recording(path)) for path in args.replay] or \
+              [(f"synthetic {args.size_mb:g} MB", synthetic_stream(args.size_mb))]
+
+    for label, stream in streams:
+        pieces = wire_pieces(stream, args.read_size)
+        print(f"\n{label}: {len(stream) / 1024 / 1024:.1f} MB in {len(pieces)} reads of {args.read_size} bytes")
+        rate = measure("StreamDecoder", decode_with_stream_decoder, pieces, len(stream), args.repeat)
+        if not args.skip_legacy:
+            legacy_pieces = wire_pieces(stream, args.legacy_read_size)
+            legacy_rate = measure("legacy loop", decode_legacy, legacy_pieces, len(stream), args.repeat)
+            print(f"speedup: {rate / legacy_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
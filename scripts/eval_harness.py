@@ -0,0 +1,347 @@
+"""
+Evaluation and throughput harness: runs the case matrix in eval_sets/matrix.json through julius_api.
+
+A matrix case names its files (relative to the matrix), a prompt, and lists of models and
+advanced_reasoning values; it expands to one run per combination, "repeat" times. Runs share one
+client and go --concurrency at a time. Runs with advanced reasoning on and off go in separate
+waves, because the preference is account-wide.
+
+Each run records end-to-end latency, per-phase latency (the client's http.* and stream.* trace
+events), bytes uploaded, stream chunks and bytes, and every artifact it wrote. <out>/report.json
+holds the runs plus a summary per case and overall. With --baseline, the summary is compared with
+an earlier report. The harness exits with status 1 if any gated metric got worse by more than
+--tolerance, or if more runs failed, so a client upgrade can be gated on it.
+
+--record saves the session's HTTP traffic to a cassette; --replay runs the matrix against one
+instead of a server. Replay is network-free and, with --time-scale 0, as fast as possible, which
+profiles the client's own stream processing and artifact writing on real transcripts. Record
+and replay with --concurrency 1 if each run must get back its own recorded answer.
+
+    python -m scripts.eval_harness --stub                                    # offline, embedded stub server
+    python -m scripts.eval_harness --concurrency 4 --out eval_results/base    # real API, JULIUS_API_TOKEN
+    python -m scripts.eval_harness --stub --baseline eval_results/base/report.json --tolerance 0.15
+    python -m scripts.eval_harness --concurrency 1 --record eval_results/prod.jsonl       # real API
+    python -m scripts.eval_harness --concurrency 1 --replay eval_results/prod.jsonl --time-scale 0
+"""
+import argparse
+import contextvars
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from julius_api import Cassette, Julius, TraceEvent, TransportConfig
+from scripts.bench_client import percentile
+from scripts.stub_server import StubConfig, StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UPLOAD_PHASES = {"http.upload", "http.upload_part"}
+
+# Summary metrics compared with the baseline, and whether a higher value is the better one
+GATED_METRICS = {"runs_per_second": True, "latency.p50": False, "latency.p95": False, "bytes_uploaded": False}
+GATED_PHASE_PERCENTILE = "p95"
+
+_run_id: contextvars.ContextVar = contextvars.ContextVar("eval_run", default=None)
+
+
+@dataclass
+class Run:
+    id: str
+    case: str
+    model: str
+    advanced_reasoning: bool
+    files: List[str]
+    prompt: str
+
+    @property
+    def group(self) -> str:
+        return f"{self.case}/{self.model}/{'reasoning' if self.advanced_reasoning else 'standard'}"
+
+
+class RunRecorder:
+    """Tracer filing every event under the run whose context emitted it, including upload and image threads."""
+
+    def __init__(self):
+        self.events: Dict[str, List[TraceEvent]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: TraceEvent):
+        run_id = _run_id.get()
+        if run_id is None:
+            return
+        with self._lock:
+            self.events.setdefault(run_id, []).append(event)
+
+    def take(self, run_id: str) -> List[TraceEvent]:
+        with self._lock:
+            return self.events.pop(run_id, [])
+
+
+def load_matrix(path: str, only: Optional[List[str]], repeat: Optional[int]) -> List[Run]:
+    with open(path) as f:
+        matrix = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    runs = []
+    for case in matrix["cases"]:
+        if only and case["name"] not in only:
+            continue
+        files = [os.path.join(base, name) for name in case.get("files", [])]
+        for file_path in files:
+            if not os.path.exists(file_path):
+                raise SystemExit(f"{case['name']}: file not found: {file_path}")
+        for model in case.get("models", ["default"]):
+            for reasoning in case.get("advanced_reasoning", [False]):
+                for repetition in range(repeat or matrix.get("repeat", 1)):
+                    mode = "reasoning" if reasoning else "standard"
+                    runs.append(Run(f"{case['name']}-{model}-{mode}-{repetition}", case["name"], model,
+                                    bool(reasoning), files, case["prompt"]))
+    return runs
+
+
+def list_artifacts(directory: str) -> List[Dict]:
+    artifacts = []
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(parent, name)
+            artifacts.append({"path": os.path.relpath(path, directory), "bytes": os.path.getsize(path)})
+    return sorted(artifacts, key=lambda artifact: artifact["path"])
+
+
+def execute(client: Julius, recorder: RunRecorder, run: Run, artifacts_dir: str) -> Dict:
+    """Send one run through the client and describe it from its trace events and artifacts."""
+    output_dir = os.path.join(artifacts_dir, run.id)
+    message = {"role": "user", "content": run.prompt, "advanced_reasoning": run.advanced_reasoning}
+    if run.files:
+        message["file_paths"] = run.files
+
+    token = _run_id.set(run.id)
+    started = time.perf_counter()
+    error, content = None, ""
+    try:
+        response = client.chat.completions.create(
+            messages=[message], model=run.model, output_dir=output_dir, use_cache=False
+        )
+        content = response.message.content
+    except Exception as e:
+        error = str(e)
+    finally:
+        seconds = time.perf_counter() - started
+        _run_id.reset(token)
+
+    events = recorder.take(run.id)
+    phases: Dict[str, float] = {}
+    for event in events:
+        if event.name.startswith("http.") or event.name == "stream.first_chunk":
+            phases[event.name] = phases.get(event.name, 0.0) + event.seconds
+    finished_streams = [event for event in events if event.name == "stream.last_chunk"]
+    return {
+        **asdict(run),
+        "files": [os.path.basename(file_path) for file_path in run.files],
+        "group": run.group,
+        "error": error,
+        "seconds": seconds,
+        "phases": phases,
+        "bytes_uploaded": sum(event.bytes_sent for event in events if event.name in UPLOAD_PHASES),
+        "stream_chunks": sum(event.attributes.get("chunks", 0) for event in finished_streams),
+        "stream_bytes": sum(event.bytes_received for event in finished_streams),
+        "content_chars": len(content),
+        "artifacts": list_artifacts(output_dir) if os.path.isdir(output_dir) else [],
+    }
+
+
+def summarize(records: List[Dict], elapsed: Optional[float] = None) -> Dict:
+    ok = [record for record in records if record["error"] is None]
+    latencies = [record["seconds"] for record in ok]
+    phase_samples: Dict[str, List[float]] = {}
+    for record in ok:
+        for name, seconds in record["phases"].items():
+            phase_samples.setdefault(name, []).append(seconds)
+    summary = {
+        "runs": len(records),
+        "failures": len(records) - len(ok),
+        "latency": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99)},
+        "phases": {name: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+                   for name, values in sorted(phase_samples.items())},
+        "bytes_uploaded": sum(record["bytes_uploaded"] for record in records),
+        "stream_chunks": sum(record["stream_chunks"] for record in records),
+        "stream_bytes": sum(record["stream_bytes"] for record in records),
+        "artifacts": sum(len(record["artifacts"]) for record in records),
+        "artifact_bytes": sum(artifact["bytes"] for record in records for artifact in record["artifacts"]),
+    }
+    if elapsed is not None:
+        summary["elapsed_seconds"] = elapsed
+        summary["runs_per_second"] = len(ok) / elapsed if elapsed else 0.0
+    return summary
+
+
+def gated_values(summary: Dict) -> Dict[str, tuple]:
+    """Metric name -> (value, higher is better) for every gated metric present in summary."""
+    values = {}
+    for name, higher_is_better in GATED_METRICS.items():
+        value = summary
+        for key in name.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None:
+            values[name] = (value, higher_is_better)
+    for phase, stats in summary.get("phases", {}).items():
+        values[f"phases.{phase}.{GATED_PHASE_PERCENTILE}"] = (stats[GATED_PHASE_PERCENTILE], False)
+    return values
+
+
+def compare(summary: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Relative change of every gated metric found in both summaries, flagging the regressions."""
+    rows = []
+    current, previous = gated_values(summary), gated_values(baseline)
+    for name in sorted(set(current) & set(previous)):
+        value, higher_is_better = current[name]
+        base = previous[name][0]
+        change = (value - base) / base if base else (0.0 if value == base else float("inf"))
+        worse = -change if higher_is_better else change
+        rows.append({"metric": name, "baseline": base, "current": value, "change": change,
+                     "regressed": worse > tolerance})
+    rows.append({"metric": "failures", "baseline": baseline["failures"], "current": summary["failures"],
+                 "change": summary["failures"] - baseline["failures"],
+                 "regressed": summary["failures"] > baseline["failures"]})
+    return rows
+
+
+def report(summary: Dict, groups: Dict[str, Dict]):
+    print(f"\n{summary['runs']} runs, {summary['failures']} failed, {summary['runs_per_second']:.2f} runs/s, "
+          f"{summary['bytes_uploaded'] / 1024:.0f} KiB uploaded, {summary['stream_chunks']} stream chunks, "
+          f"{summary['artifacts']} artifacts")
+    for name, group in groups.items():
+        latency = group["latency"]
+        print(f"  {name:<40} p50 {latency['p50'] * 1000:8.1f} ms  p95 {latency['p95'] * 1000:8.1f} ms  "
+              f"({group['runs']} runs, {group['failures']} failed)")
+    for name, phase in summary["phases"].items():
+        print(f"  {name:<40} p50 {phase['p50'] * 1000:8.1f} ms  p95 {phase['p95'] * 1000:8.1f} ms")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matrix", default=os.path.join(ROOT, "eval_sets", "matrix.json"))
+    parser.add_argument("--only", action="append", metavar="CASE", help="run only this case (repeatable)")
+    parser.add_argument("--repeat", type=int, help="runs per combination, overriding the matrix")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dedupe", action="store_true",
+                        help="let repeated files skip re-uploading (by default every run uploads its files)")
+    parser.add_argument("--out", help="report and artifacts directory (default: eval_results/<timestamp>)")
+    parser.add_argument("--baseline", help="earlier report.json to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--stub", action="store_true", help="run offline against an embedded stub server")
+    parser.add_argument("--url", help="API address (default: $JULIUS_BASE_URL or https://api.julius.ai)")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE", help="also record every HTTP exchange to this file")
+    cassette.add_argument("--replay", metavar="CASSETTE", help="answer every request from this recording")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="replayed delays relative to the recording (0 = as fast as possible)")
+    # Embedded stub behaviour
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--chunks", type=int, default=100)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    runs = load_matrix(args.matrix, args.only, args.repeat)
+    out = args.out or os.path.join("eval_results", datetime.now().strftime("%Y%m%d-%H%M%S"))
+    artifacts_dir = os.path.join(out, "artifacts")
+    os.makedirs(artifacts_dir, exist_ok=True)
+
+    server = None
+    if args.replay:
+        api_key, base_url = "replay", args.url or "https://api.julius.ai"
+    elif args.stub:
+        server = StubServer(StubConfig(latency=args.latency, chunks=args.chunks, chunk_delay=args.chunk_delay,
+                                       seed=0)).start()
+        api_key, base_url = "stub", server.url
+    else:
+        api_key = os.environ.get("JULIUS_API_TOKEN")
+        if not api_key:
+            raise SystemExit("Set JULIUS_API_TOKEN, or pass --stub to run offline")
+        base_url = args.url or os.environ.get("JULIUS_BASE_URL", "https://api.julius.ai")
+
+    recorder = RunRecorder()
+    client = Julius(
+        api_key=api_key,
+        base_url=base_url,
+        transport_config=TransportConfig(pool_maxsize=max(args.concurrency, 1)),
+        dedupe_uploads=args.dedupe,
+        upload_index_path=os.path.join(out, "upload_index.json"),
+        tracers=[recorder],
+        cassette=Cassette(args.record, "record") if args.record else
+        Cassette(args.replay, "replay", args.time_scale) if args.replay else None,
+    )
+    records = []
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+            for reasoning in (False, True):
+                wave = [run for run in runs if run.advanced_reasoning == reasoning]
+                records.extend(pool.map(lambda run: execute(client, recorder, run, artifacts_dir), wave))
+    finally:
+        elapsed = time.perf_counter() - started
+        client.close()
+        if server is not None:
+            server.stop()
+
+    groups: Dict[str, List[Dict]] = {}
+    for record in records:
+        groups.setdefault(record["group"], []).append(record)
+    result = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "target": f"replay:{os.path.basename(args.replay)}" if args.replay else "stub" if args.stub else base_url,
+            "matrix": os.path.abspath(args.matrix),
+            "concurrency": args.concurrency,
+            "dedupe": args.dedupe,
+        },
+        "summary": summarize(records, elapsed),
+        "groups": {name: summarize(group) for name, group in groups.items()},
+        "runs": records,
+    }
+    report(result["summary"], result["groups"])
+    for record in records:
+        if record["error"]:
+            print(f"  FAILED {record['id']}: {record['error']}")
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("target") != result["meta"]["target"]:
+            print(f"\nwarning: baseline ran against {baseline['meta'].get('target')}, this run against "
+                  f"{result['meta']['target']}")
+        result["comparison"] = compare(result["summary"], baseline["summary"], args.tolerance)
+        print(f"\ncompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for row in result["comparison"]:
+            marker = "REGRESSED" if row["regressed"] else ""
+            change = f"{row['change']:+.1%}" if row["metric"] != "failures" else f"{row['change']:+d}"
+            print(f"  {row['metric']:<40} {row['baseline']:>12.4g} -> {row['current']:<12.4g} {change:>8}  {marker}")
+        regressed = any(row["regressed"] for row in result["comparison"])
+
+    with open(os.path.join(out, "report.json"), "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nreport written to {os.path.join(out, 'report.json')}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Local stand-in for api.julius.ai, for load tests and benchmarks that must not touch the real service.
+
+Speaks every endpoint julius_api uses: conversation start, sources and streaming NDJSON messages
+(content, function_call, outputs and image_urls_dict chunks), signed-URL uploads (single PUT and
+resumable sessions), preprocessing, the hub file listing and user preferences. Latency, stream
+shape, error rates and a per-endpoint rate limit are configurable. GET /api/chat/reattach replays a conversation's last
+answer from its start, for clients configured with RetryPolicy(reattach_path="/api/chat/reattach").
+
+    python -m scripts.stub_server --port 8765 --latency 0.02 --chunks 200 --error-rate 0.01
+
+    julius = Julius(api_key="stub", base_url="http://127.0.0.1:8765")
+
+It can also be embedded:
+
+    with StubServer(StubConfig(latency=0.01)) as server:
+        julius = Julius(api_key="stub", base_url=server.url)
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import quote, unquote, urlsplit
+
+
+@dataclass
+class StubConfig:
+    """Behaviour of the stand-in server."""
+    latency: float = 0.0  # Seconds added before every response
+    jitter: float = 0.0  # Uniform random extra latency, in seconds
+    start_latency: float = 0.0  # Extra time /api/chat/start takes
+    preprocess_latency: float = 0.0  # Extra time /files/preprocess_file takes
+    chunks: int = 50  # Content chunks per streamed message
+    chunk_size: int = 16  # Characters of content per chunk
+    chunk_delay: float = 0.0  # Seconds between streamed chunks
+    code_blocks: int = 1  # function_call chunks per message
+    output_size: int = 256  # Characters per code output
+    images: int = 1  # image_urls_dict entries per message
+    error_rate: float = 0.0  # Probability that a request fails with 503
+    retry_after: Optional[float] = None  # Retry-After sent with injected 503s
+    stream_drop_rate: float = 0.0  # Probability that a message stream is cut off halfway
+    rate_limit: float = 0.0  # Requests per second each /api/chat/* endpoint accepts before answering 429; 0 disables
+    rate_limit_retry_after: float = 1.0  # Retry-After seconds sent with those 429s
+    hub_files: int = 0  # Files already in the hub listing at startup
+    list_etag: bool = True  # Send an ETag with the hub listing and answer If-None-Match with 304
+    seed: Optional[int] = None
+
+
+def _png() -> bytes:
+    """A valid 1x1 PNG, so clients can decode the images they download."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"\x00\xff\x00\x00")) + chunk(b"IEND", b""))
+
+
+def _endpoint(path: str) -> str:
+    """Group per-file and per-session paths under one name for the request counters."""
+    for prefix, placeholder in (("/storage/", "{filename}"), ("/session/", "{id}"), ("/images/", "{id}")):
+        if path.startswith(prefix):
+            return prefix + placeholder
+    return path
+
+
+class _StubState:
+    """Everything the server remembers between requests."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.files: Dict[str, int] = {f"existing_{i}.csv": 1024 + i for i in range(config.hub_files)}  # Name -> size
+        self.sessions: Dict[str, Dict] = {}  # Resumable upload sessions
+        self.preferences: Dict = {"advanced_reasoning": False}
+        self.answers: Dict[str, Dict] = {}  # Conversation id -> payload of its last message
+        self.requests: Dict[str, int] = {}  # "METHOD /path" -> count
+        self.errors = 0
+        self.buckets: Dict[str, tuple] = {}  # Rate-limited endpoint -> (tokens, last refill)
+        self.rate_limited = 0
+
+    def count(self, key: str):
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def roll(self, probability: float) -> bool:
+        with self.lock:
+            return probability > 0 and self.random.random() < probability
+
+    def throttled(self, endpoint: str) -> bool:
+        """Whether this request to endpoint exceeds config.rate_limit (a token bucket holding one second's worth)."""
+        limit = self.config.rate_limit
+        if limit <= 0 or not endpoint.startswith("/api/chat/"):
+            return False
+        with self.lock:
+            now = time.monotonic()
+            tokens, refilled = self.buckets.get(endpoint, (limit, now))
+            tokens = min(limit, tokens + (now - refilled) * limit)
+            if tokens < 1:
+                self.buckets[endpoint] = (tokens, now)
+                self.rate_limited += 1
+                return True
+            self.buckets[endpoint] = (tokens - 1, now)
+            return False
+
+    def delay(self, extra: float = 0.0):
+        jitter = self.random.uniform(0, self.config.jitter) if self.config.jitter else 0.0
+        pause = self.config.latency + jitter + extra
+        if pause > 0:
+            time.sleep(pause)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes
+    state: _StubState = None
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def host(self) -> str:
+        return "http://%s:%d" % self.server.server_address[:2]
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status: int, body: bytes = b"", content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data, status: int = 200):
+        self._reply(status, json.dumps(data).encode("utf-8"))
+
+    def _begin(self) -> Optional[str]:
+        """Count the request, apply latency and maybe inject an error; return the path or None if failed."""
+        path = urlsplit(self.path).path
+        self.state.count(f"{self.command} {_endpoint(path)}")
+        self.state.delay()
+        if self.state.throttled(path):
+            self._body()
+            retry_after = self.state.config.rate_limit_retry_after
+            self._reply(429, b'{"error": "rate limited"}', headers={"Retry-After": f"{retry_after:g}"})
+            return None
+        if self.state.roll(self.state.config.error_rate):
+            with self.state.lock:
+                self.state.errors += 1
+            self._body()
+            retry_after = self.state.config.retry_after
+            self._reply(503, b'{"error": "injected failure"}',
+                        headers={"Retry-After": f"{retry_after:g}"} if retry_after is not None else None)
+            return None
+        return path
+
+    def do_GET(self):
+        path = self._begin()
+        if path is None:
+            return
+        if path == "/hub/v2/list_hub_files":
+            with self.state.lock:
+                files = [{"name": name, "size": size} for name, size in self.state.files.items()]
+            body = json.dumps({"files": files}).encode("utf-8")
+            if not self.state.config.list_etag:
+                return self._reply(200, body)
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                return self._reply(304, headers={"ETag": etag})
+            return self._reply(200, body, headers={"ETag": etag})
+        if path.startswith("/images/"):
+            return self._reply(200, _png(), "image/png")
+        if path == "/api/chat/reattach":
+            with self.state.lock:
+                payload = self.state.answers.get(self.headers.get("conversation-id", ""))
+            if payload is None:
+                return self._json({"error": "no answer in progress"}, 404)
+            return self._stream_message(payload, may_drop=False)
+        self._json({"error": "not found"}, 404)
+
+    def do_PATCH(self):
+        path = self._begin()
+        if path is None:
+            return
+        if path == "/api/user_preferences":
+            preferences = json.loads(self._body() or b"{}").get("preferences", {})
+            with self.state.lock:
+                self.state.preferences.update(preferences)
+                current = dict(self.state.preferences)
+            return self._json({"preferences": current})
+        self._json({"error": "not found"}, 404)
+
+    def do_PUT(self):
+        path = self._begin()
+        if path is None:
+            return
+        body = self._body()
+        if path.startswith("/session/"):
+            return self._session_put(path[len("/session/"):], body)
+        if path.startswith("/storage/"):
+            with self.state.lock:
+                self.state.files[unquote(path[len("/storage/"):])] = len(body)
+            return self._reply(200)
+        self._json({"error": "not found"}, 404)
+
+    def _session_put(self, session_id: str, body: bytes):
+        """One part of a resumable upload: Content-Range 'bytes a-b/total' or a 'bytes */total' status query."""
+        span, total = self.headers.get("Content-Range", "bytes */0").split(" ")[1].split("/")
+        with self.state.lock:
+            session = self.state.sessions.get(session_id)
+            if session is not None and span != "*" and int(span.split("-")[0]) == session["received"]:
+                session["received"] += len(body)
+            elif session is not None and span != "*":
+                session = None  # A part that does not continue the upload
+            received = session["received"] if session else 0
+            done = session is not None and received >= int(total)
+            if done:
+                self.state.files[session["name"]] = received
+                del self.state.sessions[session_id]
+        if session is None:
+            return self._json({"error": "unknown session or non-contiguous part"}, 400)
+        if done:
+            return self._reply(200)
+        self._reply(308, headers={"Range": f"bytes=0-{received - 1}"} if received else None)
+
+    def do_POST(self):
+        path = self._begin()
+        if path is None:
+            return
+        if path.startswith("/storage/") and self.headers.get("x-goog-resumable") == "start":
+            self._body()
+            session_id = uuid.uuid4().hex
+            with self.state.lock:
+                self.state.sessions[session_id] = {"name": unquote(path[len("/storage/"):]), "received": 0}
+            return self._reply(201, headers={"Location": f"{self.host}/session/{session_id}"})
+
+        payload = json.loads(self._body() or b"{}")
+        if path == "/files/signed_url":
+            return self._json({"signedUrl": f"{self.host}/storage/{quote(payload.get('filename', 'upload'))}"})
+        if path == "/files/preprocess_file":
+            self.state.delay(self.state.config.preprocess_latency)
+            return self._json({"success": True, "res": {"success": True}})
+        if path == "/api/chat/start":
+            self.state.delay(self.state.config.start_latency)
+            return self._json({"id": str(uuid.uuid4())})
+        if path == "/api/chat/sources":
+            return self._json({"success": True})
+        if path == "/api/chat/message":
+            with self.state.lock:
+                self.state.answers[self.headers.get("conversation-id", "")] = payload
+            return self._stream_message(payload)
+        self._json({"error": "not found"}, 404)
+
+    def _message_chunks(self, payload: Dict):
+        """The NDJSON chunks of one assistant reply, shaped like the real stream."""
+        config = self.state.config
+        prompt = str(payload.get("message", {}).get("content", ""))
+        word = ("x" * max(config.chunk_size - 1, 0)) + " "
+        code_at = {(i + 1) * config.chunks // (config.code_blocks + 1) for i in range(config.code_blocks)}
+        for i in range(config.chunks):
+            if i in code_at:
+                code = f"print({len(prompt)} + {i})"
+                yield {"function_call": {"name": "python", "arguments": json.dumps({"python": code})}}
+                yield {"outputs": [f"{i}:" + "o" * config.output_size]}
+            yield {"role": "assistant", "content": word}
+        if config.images:
+            yield {"image_urls_dict": {f"image_{i}": f"{self.host}/images/{i}.png" for i in range(config.images)}}
+        yield {"role": "assistant", "content": f"(answered: {prompt[:40]})"}
+
+    def _stream_message(self, payload: Dict, may_drop: bool = True):
+        config = self.state.config
+        chunks = list(self._message_chunks(payload))
+        drop_at = len(chunks) // 2 if may_drop and self.state.roll(config.stream_drop_rate) else None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i == drop_at:
+                # Abort mid-stream without the terminating zero-length chunk
+                self.close_connection = True
+                return
+            line = json.dumps(chunk).encode("utf-8") + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            if config.chunk_delay:
+                self.wfile.flush()
+                time.sleep(config.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class StubServer:
+    """The stand-in server running on a background thread."""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.state = _StubState(self.config)
+        handler = type("StubHandler", (_Handler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % self.httpd.server_address[:2]
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="julius-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self) -> Dict:
+        """Request counts per endpoint, the number of injected errors and of 429s sent."""
+        with self.state.lock:
+            return {"requests": dict(self.state.requests), "errors": self.state.errors,
+                    "rate_limited": self.state.rate_limited}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform random extra latency in seconds")
+    parser.add_argument("--start-latency", type=float, default=0.0)
+    parser.add_argument("--preprocess-latency", type=float, default=0.0)
+    parser.add_argument("--chunks", type=int, default=50, help="content chunks per streamed message")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters of content per chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--code-blocks", type=int, default=1)
+    parser.add_argument("--output-size", type=int, default=256)
+    parser.add_argument("--images", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 503 per request")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with injected 503s")
+    parser.add_argument("--stream-drop-rate", type=float, default=0.0,
+                        help="probability that a message stream is cut off halfway")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="requests per second each /api/chat/* endpoint accepts before answering 429")
+    parser.add_argument("--rate-limit-retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--hub-files", type=int, default=0, help="files already in the hub listing")
+    parser.add_argument("--no-list-etag", dest="list_etag", action="store_false",
+                        help="send the hub listing without an ETag")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = StubConfig(**{name: getattr(args, name) for name in StubConfig.__dataclass_fields__})
+    server = StubServer(config, args.host, args.port).start()
+    print(f"Julius stub listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()